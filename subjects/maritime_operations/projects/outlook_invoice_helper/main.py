@@ -23,9 +23,73 @@ and design decisions at a level suitable for someone with ~1 year of CS backgrou
 from __future__ import annotations
 
 import argparse  # For parsing command-line arguments
+import hashlib   # For optional content hashes in the incremental manifest
+import importlib.util  # For loading the shared walker from its project folder
 import json      # For emitting structured output (JSON/JSONL)
+import os        # For the os.DirEntry type yielded by the shared walker
+import re        # For pulling labelled fields (vessel, ETA, ...) out of text
+import sqlite3   # For the incremental manifest (ships with Python)
 import sys       # For process exit codes and stdout/stderr
+import time      # For the manifest's "racy timestamp" check and --rule-stats timings
+from collections import deque  # Ordered window of in-flight parsing tasks
+from concurrent.futures import ProcessPoolExecutor  # Parse on several cores
+from email.header import decode_header, make_header
+from email.parser import BytesFeedParser, BytesHeaderParser, HeaderParser
+from email.utils import parsedate_to_datetime
+from itertools import islice
 from pathlib import Path  # For robust, cross-platform filesystem paths
+from typing import Iterator
+
+# Reuse the directory walker from the codebase size CLI (a sibling project in
+# this repository) instead of keeping a second, slower one here. It applies the
+# same exclusions (.git, node_modules, ...) and hidden-file rules, and yields
+# os.DirEntry objects whose type and stat() come from the directory listing.
+CODEBASE_SIZE_FILE = (
+    Path(__file__).resolve().parents[3] / "python" / "projects" / "codebase_size_cli" / "codebase_size.py"
+)
+
+
+def _load_codebase_size():
+    """
+    Import codebase_size.py from its project folder.
+
+    Why not put that folder on sys.path?
+    - Every other file in it (and in its tests/ folder) would then be importable
+      too, and could shadow a module with the same name here. Loading exactly
+      this one file, under a name of our own, keeps sys.path untouched and
+      cannot clash with another `codebase_size` module.
+    """
+    name = "_outlook_helper_codebase_size"
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, CODEBASE_SIZE_FILE)
+    if spec is None or spec.loader is None or not CODEBASE_SIZE_FILE.is_file():
+        raise ImportError(
+            f"parse-emails needs the directory walker from {CODEBASE_SIZE_FILE}; "
+            "keep outlook_invoice_helper and codebase_size_cli in this repository's layout"
+        )
+    module = importlib.util.module_from_spec(spec)
+    # Its dataclasses look up their own module in sys.modules while being created
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]  # don't leave a half-initialized module behind
+        raise
+    return module
+
+
+_codebase_size = _load_codebase_size()
+default_excluded_dirs = _codebase_size.default_excluded_dirs
+file_extension = _codebase_size.file_extension
+iter_file_entries = _codebase_size.iter_file_entries
+
+# Outlook .msg files are read by msg_reader.py, next to this file
+from msg_reader import read_msg  # noqa: E402
+
+# Which file extensions we consider as email exports at this stage.
+# We will refine this based on the actual formats you provide (e.g., .msg/.eml/.txt).
+CANDIDATE_EXTS = {".eml", ".msg", ".txt"}
 
 
 def ensure_directory_exists(path: Path) -> None:
@@ -44,52 +108,951 @@ def ensure_directory_exists(path: Path) -> None:
         path.mkdir(parents=True, exist_ok=True)
 
 
-def parse_emails_command(input_dir: Path, output_file: Path) -> int:
+def iter_email_exports(input_dir: Path, include_hidden: bool = False) -> Iterator[os.DirEntry]:
+    """
+    Yield exported email files under `input_dir`, one at a time.
+
+    Why a generator (and not a list)?
+    - Export shares can hold hundreds of thousands of files. Yielding each match
+      as soon as it is found lets the caller write output right away, so memory
+      stays flat and the first records appear before the walk is finished.
+
+    Why the shared walker instead of `input_dir.rglob("*")` + `is_file()`?
+    - rglob builds a Path for every entry and `is_file()` stats each one again.
+      The walker reads the entry type from the directory listing itself, and
+      we only look at the file name here, so most entries need no stat at all.
+    - It also skips noise directories (.git, caches, ...) and hidden files,
+      exactly like the codebase size CLI does.
+    """
+    for entry in iter_file_entries(
+        root=input_dir,
+        excluded_dirs=default_excluded_dirs(),
+        include_hidden=include_hidden,
+        follow_symlinks=False,
+    ):
+        if file_extension(entry.name) in CANDIDATE_EXTS:
+            yield entry
+
+
+# ------------------------------ Field Extraction ------------------------------
+
+# Fields every record has (None when no rule matched)
+EXTRACTED_FIELDS = ("vessel", "voyage", "eta", "terminal")
+
+# Built-in rules, used when no --rules file is given. Order is priority: for each
+# field, the first rule (in this list) that matches wins. "scope" is "text"
+# (subject + body) or "subject". A rule only runs if one of its "keywords"
+# appears in the text (case-insensitive); rules without keywords always run.
+# We keep the raw text; normalizing dates/names is a later step.
+DEFAULT_RULES = [
+    # Labelled lines such as "Vessel: EVER GIVEN" or "ETA - 2024-05-01 14:00"
+    {"name": "vessel_label", "field": "vessel", "scope": "text", "keywords": ["vessel", "ship"],
+     "pattern": r"^[ \t>]*(?:vessel(?: name)?|ship)[ \t]*[:\-][ \t]*(\S.*?)[ \t]*$"},
+    {"name": "voyage_label", "field": "voyage", "scope": "text", "keywords": ["voy"],
+     "pattern": r"^[ \t>]*(?:voyage|voy\.?)(?:[ \t]*(?:no\.?|number))?[ \t]*[:\-][ \t]*(\S.*?)[ \t]*$"},
+    {"name": "eta_label", "field": "eta", "scope": "text", "keywords": ["eta"],
+     "pattern": r"^[ \t>]*eta[ \t]*[:\-][ \t]*(\S.*?)[ \t]*$"},
+    {"name": "terminal_label", "field": "terminal", "scope": "text", "keywords": ["terminal", "berth"],
+     "pattern": r"^[ \t>]*(?:terminal|berth)[ \t]*[:\-][ \t]*(\S.*?)[ \t]*$"},
+    # Subject-line shorthand such as "MV EVER GIVEN / VOY 045E - ETA update"
+    {"name": "vessel_subject_mv", "field": "vessel", "scope": "subject", "keywords": ["mv", "m/v"],
+     "pattern": r"\bM/?V\.?\s+([^\W_][\w.\- ]*?)\s*(?=/|,|\bVOY|\(|$)"},
+    {"name": "voyage_subject", "field": "voyage", "scope": "subject", "keywords": ["voy"],
+     "pattern": r"\bVOY(?:AGE)?\.?\s*(?:NO\.?\s*)?([0-9][0-9A-Z]*)\b"},
+]
+
+RULE_SCOPES = ("text", "subject")
+
+# Leading groups of global flags, e.g. the "(?i)" in "(?i)maersk vsl: (.*)"
+LEADING_FLAGS = re.compile(r"(?:\(\?[aiLmsux]+\))+")
+
+
+def _scoped_flags(pattern: str) -> str:
+    """
+    Turn leading global flags into a group of their own: "(?i)abc" -> "(?i:abc)".
+
+    Why? Global flags are only allowed at the very start of a regex. In the
+    combined alternation a rule is no longer at the start, so "(?i)" would be
+    an error there; the scoped form means the same for this rule only.
+    """
+    match = LEADING_FLAGS.match(pattern)
+    if match is None:
+        return pattern
+    flags = "".join(dict.fromkeys(re.findall(r"[aiLmsux]", match.group())))
+    rest = pattern[match.end():]
+    # In verbose mode a trailing "# comment" would swallow our ")"
+    end = "\n)" if "x" in flags else ")"
+    return f"(?{flags}:{rest}{end}"
+
+
+class ExtractionRule:
+    """One validated rule (see DEFAULT_RULES for the fields of a rule)."""
+
+    def __init__(self, index: int, spec: dict) -> None:
+        where = f"rule {index + 1} ({spec.get('name', 'unnamed')})"
+        self.index = index
+        self.name = str(spec.get("name") or f"rule_{index + 1}")
+        self.field = spec.get("field")
+        self.scope = spec.get("scope", "text")
+        self.pattern = spec.get("pattern")
+        self.keywords = [str(k).lower() for k in spec.get("keywords", [])]
+        self.case_sensitive = bool(spec.get("case_sensitive", False))
+        if self.field not in EXTRACTED_FIELDS:
+            raise ValueError(f"{where}: field must be one of {', '.join(EXTRACTED_FIELDS)}")
+        if self.scope not in RULE_SCOPES:
+            raise ValueError(f"{where}: scope must be one of {', '.join(RULE_SCOPES)}")
+        if not isinstance(self.pattern, str):
+            raise ValueError(f"{where}: pattern must be a string")
+        try:
+            compiled = re.compile(self.pattern, self.flags)
+        except re.error as exc:
+            raise ValueError(f"{where}: invalid pattern: {exc}") from None
+        # The value is the rule's FIRST group. Inside the combined regex, group
+        # numbers shift and names must be unique, so named groups and numbered
+        # back-references (\1) are not allowed.
+        if compiled.groups < 1:
+            raise ValueError(f"{where}: pattern needs a capture group around the value")
+        if compiled.groupindex or re.search(r"\\[1-9]", self.pattern):
+            raise ValueError(f"{where}: named groups and back-references are not supported")
+        # What goes into the combined regex; it must compile there as well
+        self.source = _scoped_flags(self.pattern)
+        try:
+            re.compile(self.combined_source(), re.I | re.M)
+        except re.error as exc:
+            raise ValueError(f"{where}: pattern cannot be combined with other rules: {exc}") from None
+        # Used on its own by the fallback search and by --rule-stats
+        self.regex = compiled
+
+    @property
+    def flags(self) -> int:
+        return re.M if self.case_sensitive else re.I | re.M
+
+    def combined_source(self) -> str:
+        # All rules share one regex compiled with re.I | re.M; a case-sensitive
+        # rule switches IGNORECASE off for its own part only
+        return f"(?-i:{self.source})" if self.case_sensitive else f"(?:{self.source})"
+
+    def search(self, text: str) -> str | None:
+        """This rule's value in `text` on its own (None if no match or no value)."""
+        for match in self.regex.finditer(text):
+            if match.group(1) is not None:
+                return match.group(1).strip()
+        return None
+
+
+def load_rules(path: Path | None) -> list[dict]:
+    """Rule specs from a JSON file ({"rules": [...]} or a bare list); built-ins if None."""
+    if path is None:
+        return DEFAULT_RULES
+    with path.open("r", encoding="utf-8") as f:
+        data = json.load(f)
+    rules = data.get("rules") if isinstance(data, dict) else data
+    if not isinstance(rules, list) or not all(isinstance(r, dict) for r in rules):
+        raise ValueError(f"{path}: expected a list of rule objects (or {{\"rules\": [...]}})")
+    return rules
+
+
+class FieldExtractor:
+    """
+    Rule-driven extraction of vessel / voyage / ETA / terminal from email text.
+
+    Why not one regex search per rule?
+    - With dozens of carrier formats, that is dozens of passes over every email.
+      Instead all rules of a scope are compiled ONCE into a single alternation
+      `(?:rule 1)|(?:rule 2)|...`, so each email is scanned once per scope. The
+      number of the last group that matched (`match.lastindex`) says which rule
+      it was. (Wrapping every rule in a named group would say it more directly,
+      but extra capturing groups made the scan about 3x slower.)
+    - Keyword prefilter: a rule whose keywords don't occur in the text cannot
+      match, so it is left out of the alternation. Which rules are left depends
+      on the email, so each distinct subset is compiled once and cached
+      (in practice only a handful of subsets occur).
+    - Scanning stops early once every field has a match from its best remaining
+      rule.
+
+    Overlapping rules: one scan finds non-overlapping matches, so a rule can
+    consume the text another rule needed (e.g. `^vsl\s+(\w+)` for the vessel
+    and `^(vsl\s+\w+\s+\w+)` for the voyage both start at the same place).
+    So after the combined scan, every field that did not get its value from
+    its best active rule is searched again with each active rule that ranks
+    above its current value, one rule at a time and in priority order; the
+    first hit wins. Only fields that missed their best rule pay for this;
+    ending values with a lookahead (`(?=/|$)`) instead of matching the
+    separator keeps such misses rare.
+
+    A match whose value group did not take part (e.g. `vessel:(\s*\S+)?`
+    matching "vessel:" alone) is ignored, just like no match.
+
+    Statistics (for --rule-stats): per rule, how often it passed the prefilter
+    ("active") and how often it supplied a field ("hits"); per scope, the time
+    spent scanning. With `profile=True`, every active rule is also timed on its
+    own - that doubles the work, but shows which pattern is slow.
+    """
+
+    def __init__(self, rule_specs: list[dict], profile: bool = False) -> None:
+        self.rules = [ExtractionRule(index, spec) for index, spec in enumerate(rule_specs)]
+        names = [rule.name for rule in self.rules]
+        if len(set(names)) != len(names):
+            raise ValueError("rule names must be unique (statistics are reported by name)")
+        self.profile = profile
+        self._keywords = sorted({k for r in self.rules for k in r.keywords})
+        # frozenset of keywords present -> {scope: rules passing the prefilter}
+        self._prefiltered: dict = {}
+        # tuple of active rules -> (combined regex, group map)
+        self._compiled: dict = {}
+        # Compile every scope's full alternation now, so a rule that only fails
+        # in combination is reported while loading, not in the middle of a run
+        for scope in RULE_SCOPES:
+            rules = tuple(rule for rule in self.rules if rule.scope == scope)
+            if rules:
+                try:
+                    self._combined(rules)
+                except re.error as exc:
+                    raise ValueError(f"{scope} rules cannot be combined into one regex: {exc}") from None
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        # Per rule index: times active, hits, own seconds; per scope: scans, seconds
+        self._active = [0] * len(self.rules)
+        self._hits = [0] * len(self.rules)
+        self._seconds = [0.0] * len(self.rules)
+        self._scope_stats = {scope: [0, 0.0] for scope in RULE_SCOPES}
+
+    def _candidates(self, present: frozenset) -> dict:
+        """Rules of each scope whose keywords passed the prefilter (cached)."""
+        candidates = self._prefiltered.get(present)
+        if candidates is None:
+            candidates = self._prefiltered[present] = {
+                scope: tuple(
+                    rule for rule in self.rules
+                    if rule.scope == scope and (not rule.keywords or not present.isdisjoint(rule.keywords))
+                )
+                for scope in RULE_SCOPES
+            }
+        return candidates
+
+    def _combined(self, rules: tuple) -> tuple[re.Pattern, dict]:
+        """The alternation of `rules`, plus group number -> (rule, its value group)."""
+        combined = self._compiled.get(rules)
+        if combined is None:
+            groups = {}
+            offset = 0
+            for rule in rules:
+                for number in range(offset + 1, offset + rule.regex.groups + 1):
+                    groups[number] = (rule, offset + 1)
+                offset += rule.regex.groups
+            regex = re.compile("|".join(rule.combined_source() for rule in rules), re.I | re.M)
+            combined = self._compiled[rules] = (regex, groups)
+        return combined
+
+    def extract(self, subject: str, body: str) -> dict:
+        """Return {field: value or None} for one email."""
+        text = f"{subject}\n{body}" if body else subject
+        # Keywords are checked once against the full text (the subject is part of it)
+        lowered = text.lower()
+        candidates = self._candidates(frozenset(k for k in self._keywords if k in lowered))
+        # field -> (rule index, value) of the best match so far
+        best: dict = {}
+        # The short subject first: what it finds can rule out text rules with a
+        # lower priority before the (long) body is scanned
+        for scope, scope_text in (("subject", subject), ("text", text)):
+            active = candidates[scope]
+            if best:
+                # Drop rules that can't win: their field already has a match
+                # from a higher-priority rule
+                active = tuple(r for r in active if r.field not in best or best[r.field][0] > r.index)
+            if active:
+                self._scan(scope, scope_text, active, best)
+        for index, _ in best.values():
+            self._hits[index] += 1
+        return {field: best[field][1] if field in best else None for field in EXTRACTED_FIELDS}
+
+    def _scan(self, scope: str, text: str, active: tuple, best: dict) -> None:
+        """Run one combined scan of `text` and keep the best match per field."""
+        # A field can't improve on its best active rule; stop once all fields have it
+        goal = {}
+        for rule in active:
+            self._active[rule.index] += 1
+            goal.setdefault(rule.field, rule.index)
+        pending = len(goal)
+        regex, groups = self._combined(active)
+        started = time.perf_counter()
+        for match in regex.finditer(text):
+            if match.lastindex is None:
+                continue  # no group took part, so there is no value
+            rule, value_group = groups[match.lastindex]
+            value = match.group(value_group)
+            if value is None:
+                continue  # an optional value group that did not match
+            index, field = rule.index, rule.field
+            if field not in best or best[field][0] > index:
+                best[field] = (index, value.strip())
+                if index == goal[field]:
+                    pending -= 1
+                    if not pending:
+                        break
+        if pending:
+            # A higher-priority rule may have lost its text to an overlapping
+            # match of another rule: try every rule that would beat a field's
+            # current value on its own. `active` is in priority order, so the
+            # first value found for a field wins and later rules are skipped.
+            for rule in active:
+                current = best.get(rule.field)
+                if current is not None and current[0] <= rule.index:
+                    continue
+                value = rule.search(text)
+                if value is not None:
+                    best[rule.field] = (rule.index, value)
+        stats = self._scope_stats[scope]
+        stats[0] += 1
+        stats[1] += time.perf_counter() - started
+        if self.profile:
+            for rule in active:
+                started = time.perf_counter()
+                rule.regex.search(text)
+                self._seconds[rule.index] += time.perf_counter() - started
+
+    def snapshot(self) -> dict:
+        """Statistics as plain data (sent back from worker processes)."""
+        rules = {
+            rule.name: [self._active[rule.index], self._hits[rule.index], self._seconds[rule.index]]
+            for rule in self.rules
+        }
+        return {"rules": rules, "scopes": self._scope_stats}
+
+
+def merge_rule_stats(total: dict, part: dict) -> None:
+    """Add one worker's `FieldExtractor.snapshot()` into `total` (same shape)."""
+    for key in ("rules", "scopes"):
+        target = total.setdefault(key, {})
+        for name, values in part[key].items():
+            current = target.setdefault(name, [0] * len(values))
+            for i, value in enumerate(values):
+                current[i] += value
+
+
+def print_rule_stats(stats: dict) -> None:
+    """Print --rule-stats: slowest rules first."""
+    print("\nRule statistics:")
+    for scope, (scans, seconds) in stats.get("scopes", {}).items():
+        if scans:
+            print(f"  scope {scope:<8} {scans:>8} scans  {seconds * 1000:10.1f} ms combined")
+    rows = sorted(stats.get("rules", {}).items(), key=lambda kv: (kv[1][2], kv[1][0]), reverse=True)
+    for name, (active, hits, seconds) in rows:
+        print(f"  {name:<28} active {active:>8}  hits {hits:>8}  own time {seconds * 1000:10.1f} ms")
+
+
+# Per-process extractor cache: rules are loaded and compiled once per worker
+_EXTRACTORS: dict = {}
+
+
+def get_extractor(rules_path: str | None = None, profile: bool = False) -> FieldExtractor:
+    key = (rules_path, profile)
+    extractor = _EXTRACTORS.get(key)
+    if extractor is None:
+        specs = load_rules(Path(rules_path) if rules_path else None)
+        extractor = _EXTRACTORS[key] = FieldExtractor(specs, profile=profile)
+    return extractor
+
+
+# ------------------------------ Email Parsing ------------------------------
+
+# Headers longer than this are treated as a broken file (a header block is
+# normally a few KiB; this stops us reading a whole file that has no blank line)
+MAX_HEADER_BYTES = 256 * 1024
+# How much of a message (headers + body) the full parser reads. The readable
+# text part almost always comes first; big attachments come after it and are
+# never loaded.
+MAX_MESSAGE_BYTES = 1024 * 1024
+# Read size used when feeding the parser
+FEED_CHUNK = 64 * 1024
+# Files handed to a worker process per task (fewer, bigger tasks = less overhead)
+PARSE_CHUNK_FILES = 32
+
+HTML_TAG = re.compile(r"<[^>]+>")
+
+
+def _read_header_block(handle) -> bytes:
+    """
+    Read the message headers: every line up to (and including) the first blank line.
+
+    Reading line by line lets us stop right after the headers, so in headers-only
+    mode the body is never read at all.
+    """
+    lines = []
+    size = 0
+    for line in handle:
+        lines.append(line)
+        size += len(line)
+        if line in (b"\n", b"\r\n") or size >= MAX_HEADER_BYTES:
+            break
+    return b"".join(lines)
+
+
+def _header_text(message, name: str) -> str | None:
+    """
+    Return a header as readable text, decoding "=?utf-8?q?...?=" words if present.
+
+    Why not `email.policy.default`, which decodes headers for us?
+    - It builds a rich header object for every header it touches, and profiling
+      showed that took about three quarters of the parsing time. The classic
+      parser returns plain strings, so we only pay for decoding when a header
+      actually contains encoded words (the "=?" marker).
+    """
+    raw = message.get(name)
+    if raw is None:
+        return None
+    raw = str(raw)
+    if "=?" in raw:
+        try:
+            raw = str(make_header(decode_header(raw)))
+        except (LookupError, ValueError, UnicodeDecodeError):
+            pass  # unknown charset or broken encoding: keep the raw text
+    # Folded (multi-line) headers keep their line breaks; join them back
+    return " ".join(raw.split()) or None
+
+
+def _body_text(message) -> str:
+    """
+    Return the readable text of a parsed message (the first text/plain part, else
+    the first text/html part with tags stripped). Attachments are skipped.
+
+    Transfer encodings (base64, quoted-printable) are undone by
+    `get_payload(decode=True)`, which is lenient: a part cut off by our size cap
+    just decodes to what we have.
+    """
+    fallback = None
+    for part in message.walk():
+        if part.is_multipart() or part.get_content_maintype() != "text":
+            continue
+        if (part.get("content-disposition") or "").lower().startswith("attachment"):
+            continue
+        subtype = part.get_content_subtype()
+        if subtype == "plain":
+            return _decode_payload(part)
+        if subtype == "html" and fallback is None:
+            fallback = part
+    if fallback is None:
+        return ""
+    return HTML_TAG.sub(" ", _decode_payload(fallback))
+
+
+def _decode_payload(part) -> str:
+    """Decode one text part's bytes using its declared charset (UTF-8 if unknown)."""
+    payload = part.get_payload(decode=True) or b""
+    charset = part.get_content_charset() or "utf-8"
+    try:
+        return payload.decode(charset, errors="replace")
+    except LookupError:
+        return payload.decode("utf-8", errors="replace")
+
+
+def _read_eml_fields(path: str, headers_only: bool) -> dict:
+    """
+    Read an .eml (or Outlook .txt export) with the standard `email` package.
+
+    - headers_only=True: just the header block; the body is never read.
+    - Otherwise the file is fed to the parser in chunks, stopping after
+      MAX_MESSAGE_BYTES. A 40 MB email with attachments therefore costs about
+      1 MB of reading and memory.
+    """
+    truncated = False
+    with open(path, "rb") as handle:
+        header = _read_header_block(handle)
+        if headers_only:
+            message = BytesHeaderParser().parsebytes(header)
+        else:
+            parser = BytesFeedParser()
+            parser.feed(header)
+            remaining = MAX_MESSAGE_BYTES - len(header)
+            while remaining > 0:
+                chunk = handle.read(min(FEED_CHUNK, remaining))
+                if not chunk:
+                    break
+                parser.feed(chunk)
+                remaining -= len(chunk)
+            truncated = remaining <= 0 and handle.read(1) != b""
+            message = parser.close()
+
+    return {
+        "subject": _header_text(message, "subject"),
+        "from": _header_text(message, "from"),
+        # Outlook's text export says "Sent:" where an .eml says "Date:"
+        "date": _iso_date(_header_text(message, "date") or _header_text(message, "sent")),
+        "message_id": _header_text(message, "message-id"),
+        "body": "" if headers_only else _body_text(message),
+        "body_truncated": truncated,
+    }
+
+
+def _read_msg_fields(path: str, headers_only: bool) -> dict:
+    """
+    Read an Outlook .msg with `msg_reader` (memory-mapped; attachments are listed,
+    never read).
+
+    A received .msg usually keeps the original internet headers; where it does,
+    sender, date and message id come from them, so the record matches what the
+    same email exported as .eml would give. Otherwise the MAPI properties are used
+    (the date is then the UTC send time).
+    """
+    msg = read_msg(path, headers_only=headers_only, max_body_bytes=MAX_MESSAGE_BYTES)
+    headers = HeaderParser().parsestr(msg.headers) if msg.headers else None
+
+    def header(name: str) -> str | None:
+        return _header_text(headers, name) if headers is not None else None
+
+    sender = header("from")
+    if sender is None and (msg.sender_name or msg.sender_email):
+        if msg.sender_name and msg.sender_email:
+            sender = f"{msg.sender_name} <{msg.sender_email}>"
+        else:
+            sender = msg.sender_name or msg.sender_email
+    sent = msg.submit_time or msg.delivery_time
+    return {
+        "subject": msg.subject or header("subject"),
+        "from": sender,
+        "date": _iso_date(header("date")) or (sent.isoformat() if sent else None),
+        "message_id": header("message-id") or msg.message_id,
+        "body": msg.body or (HTML_TAG.sub(" ", msg.html) if msg.html else ""),
+        "body_truncated": msg.body_truncated,
+        "attachments": [
+            {"filename": a.filename, "mime_type": a.mime_type, "size": a.size} for a in msg.attachments
+        ],
+    }
+
+
+def _iso_date(raw: str | None) -> str | None:
+    """An email date header as ISO 8601, or the raw text if it can't be parsed."""
+    if not raw:
+        return None
+    try:
+        return parsedate_to_datetime(raw).isoformat()
+    except (TypeError, ValueError):
+        return raw  # keep what we could not interpret
+
+
+def parse_email_file(path: str, headers_only: bool = False, extractor: FieldExtractor | None = None) -> dict:
+    """
+    Parse one exported email file into a JSON-ready record.
+
+    How much is read:
+    - headers_only=True: just the headers (subject, sender, date, message id);
+      vessel/voyage then come from the subject alone.
+    - Otherwise at most MAX_MESSAGE_BYTES of the message; `body_truncated`
+      marks records whose body was cut there.
+
+    .eml and .txt files (Outlook's text export starts with header lines) go
+    through the `email` package; .msg (Outlook's binary format) through
+    `msg_reader`, and their records also list the attachments (name, type, size).
+    Errors never escape: a broken file becomes a record with "parsed": False and an
+    "error" message, so one bad export cannot stop a run over thousands.
+
+    Fields are extracted by `extractor` (the built-in rules if None).
+    """
+    if extractor is None:
+        extractor = get_extractor()
+    record = {
+        "source_path": path,
+        "subject": None,
+        "from": None,
+        "date": None,
+        "message_id": None,
+        "vessel": None,
+        "voyage": None,
+        "eta": None,
+        "terminal": None,
+        "parsed": False,
+    }
+    try:
+        if path.lower().endswith(".msg"):
+            fields = _read_msg_fields(path, headers_only)
+        else:
+            fields = _read_eml_fields(path, headers_only)
+        subject = fields["subject"]
+        record.update(
+            subject=subject,
+            date=fields["date"],
+            message_id=fields["message_id"],
+            **extractor.extract(subject or "", fields["body"]),
+        )
+        record["from"] = fields["from"]
+        record["parsed"] = True
+        if fields["body_truncated"]:
+            record["body_truncated"] = True
+        if fields.get("attachments"):
+            record["attachments"] = fields["attachments"]
+    except Exception as exc:  # noqa: BLE001 - one bad file must not stop the run
+        record["error"] = f"{type(exc).__name__}: {exc}"
+    return record
+
+
+def _parse_email_chunk(
+    paths: list[str], headers_only: bool, rules_path: str | None, profile: bool
+) -> tuple[list[dict], dict]:
+    """
+    Parse a chunk of files; runs inside a worker process.
+
+    Returns the records plus this chunk's rule statistics. The extractor (and its
+    compiled regexes) is built once per process and reused for every chunk.
+
+    This is a module-level function (not a lambda) because the process pool has to
+    pickle it to send it to the workers.
+    """
+    extractor = get_extractor(rules_path, profile)
+    extractor.reset_stats()
+    records = [parse_email_file(path, headers_only, extractor) for path in paths]
+    return records, extractor.snapshot()
+
+
+def iter_parsed_emails(
+    paths: Iterator[str],
+    workers: int = 1,
+    headers_only: bool = False,
+    rules_path: str | None = None,
+    rule_stats: dict | None = None,
+    profile: bool = False,
+) -> Iterator[dict]:
+    """
+    Parse files from `paths` and yield one record per file, in input order.
+
+    How the work is shared:
+    - Paths are grouped into chunks of PARSE_CHUNK_FILES and each chunk is one task
+      for a worker process (parsing is CPU work, so threads would not help).
+    - At most `workers * 4` chunks are in flight; results are taken from the oldest
+      chunk first. So the output order never depends on which worker finishes
+      first, memory stays bounded, and discovery keeps streaming while workers parse.
+    - With workers=1 everything runs in this process (no pool to start).
+
+    `rules_path` selects the extraction rules (see FieldExtractor); per-rule
+    statistics from every worker are added into `rule_stats` if given.
+    """
+    def unpack(result: tuple[list[dict], dict]) -> list[dict]:
+        records, stats = result
+        if rule_stats is not None:
+            merge_rule_stats(rule_stats, stats)
+        return records
+
+    chunks = iter(lambda: list(islice(paths, PARSE_CHUNK_FILES)), [])
+    if workers <= 1:
+        for chunk in chunks:
+            yield from unpack(_parse_email_chunk(chunk, headers_only, rules_path, profile))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(pool.submit(_parse_email_chunk, chunk, headers_only, rules_path, profile))
+            if len(in_flight) >= workers * 4:
+                yield from unpack(in_flight.popleft().result())
+        while in_flight:
+            yield from unpack(in_flight.popleft().result())
+
+
+# ---------------------------- Incremental Manifest ----------------------------
+
+
+def manifest_path_for(output_file: Path) -> Path:
+    """The manifest lives next to the JSONL: parsed.jsonl -> parsed.jsonl.manifest.sqlite."""
+    return output_file.with_name(output_file.name + ".manifest.sqlite")
+
+
+def file_digest(path: str) -> str:
+    """Content hash used by --hash (BLAKE2b, read in 1 MiB chunks)."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ParseManifest:
+    """
+    Remember which export files earlier parse-emails runs already processed.
+
+    How it works:
+    - For every file written to the JSONL we store its path, size and modification
+      time (and, with --hash, a content hash). On the next run a file whose size
+      and mtime are unchanged is skipped without being opened, so an unchanged
+      folder costs one stat per file.
+    - Files that are new or changed are parsed and their records APPENDED to the
+      JSONL; files that disappeared get a tombstone record
+      ({"source_path": ..., "deleted": true}). Readers keep the LAST record per
+      source_path (gen-checklist does this).
+    - With a stored hash, a file whose mtime changed but whose content did not
+      (e.g. copied again by a sync job) is not parsed again.
+
+    The "racy timestamp" problem: a file changed within the same clock tick as
+    our record could keep its size and mtime. Rows recorded less than
+    RACY_WINDOW_NS after the file's mtime are flagged and re-checked next time.
+
+    Why SQLite? Same reason as the codebase size CLI's scan cache: it ships with
+    Python and updates atomically, so an interrupted run never leaves a
+    half-written manifest. Changing the input folder or parsing options starts
+    over with a full run (records made with other options would not match).
+    """
+
+    SCHEMA_VERSION = "1"
+    RACY_WINDOW_NS = 2_000_000_000
+
+    def __init__(self, db_path: Path, settings: dict) -> None:
+        self.db_path = db_path
+        self.conn = sqlite3.connect(str(db_path))
+        self.reused = self._prepare(json.dumps(settings, sort_keys=True))
+
+    def _prepare(self, fingerprint: str) -> bool:
+        """Create tables; returns False (and empties the manifest) if the stored
+        one was made with other settings or does not exist yet."""
+        conn = self.conn
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        stored = dict(conn.execute("SELECT key, value FROM meta"))
+        reused = stored.get("schema") == self.SCHEMA_VERSION and stored.get("settings") == fingerprint
+        if not reused:
+            conn.execute("DROP TABLE IF EXISTS files")
+            conn.execute("DELETE FROM meta")
+            conn.executemany(
+                "INSERT INTO meta (key, value) VALUES (?, ?)",
+                [("schema", self.SCHEMA_VERSION), ("settings", fingerprint)],
+            )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " hash TEXT,"                 # NULL unless recorded with --hash
+            " racy INTEGER NOT NULL)"     # 1 = recorded too soon after the mtime
+        )
+        conn.commit()
+        return reused
+
+    def reset(self) -> None:
+        """Forget every file (used when the JSONL is rewritten from scratch)."""
+        self.conn.execute("DELETE FROM files")
+
+    def load(self) -> dict:
+        """All rows as {path: (size, mtime_ns, hash, racy)} (one query, one pass)."""
+        return {
+            path: (size, mtime_ns, digest, racy)
+            for path, size, mtime_ns, digest, racy in self.conn.execute(
+                "SELECT path, size, mtime_ns, hash, racy FROM files"
+            )
+        }
+
+    def record(self, path: str, size: int, mtime_ns: int, digest: str | None) -> None:
+        racy = int(time.time_ns() - mtime_ns < self.RACY_WINDOW_NS)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, hash, racy) VALUES (?, ?, ?, ?, ?)",
+            (path, size, mtime_ns, digest, racy),
+        )
+
+    def forget(self, path: str) -> None:
+        self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "ParseManifest":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
+def parse_emails_command(
+    input_dir: Path,
+    output_file: Path,
+    include_hidden: bool = False,
+    workers: int = 1,
+    headers_only: bool = False,
+    incremental: bool = False,
+    use_hash: bool = False,
+    rules_path: Path | None = None,
+    rule_stats: bool = False,
+) -> int:
     """
     Parse exported Outlook emails (read-only) and emit JSON Lines.
 
     Parameters
-    - input_dir: Directory containing exported emails (.eml/.msg/.txt). We will keep
-      the parsing very conservative at first (placeholder). Later we can add robust
-      parsers once we know the exact formats you can export.
+    - input_dir: Directory containing exported emails (.eml/.msg/.txt).
     - output_file: JSONL file path to write one JSON object per email.
+    - include_hidden: Also look inside hidden (dot) files and folders.
+    - workers: Number of processes parsing in parallel (1 = no pool).
+    - headers_only: Only read the headers (much faster; vessel/voyage then come
+      from the subject line only).
+    - incremental: Only parse files that are new or changed since the last run and
+      append their records; tombstone deleted files (see ParseManifest).
+    - use_hash: With `incremental`, also store a content hash, so files whose
+      mtime changed but content did not are not parsed again.
+    - rules_path: JSON file with extraction rules (default: DEFAULT_RULES).
+    - rule_stats: Print per-rule hit counts and timings at the end (this times
+      every active rule on its own, so the run gets slower).
 
-    Behavior (initial stub):
-    - Walk the input directory and list candidate files by extension
-    - For now, we DO NOT parse content in detail; we emit a placeholder record with
-      filename and path. This ensures the end-to-end flow works and provides a place
-      to plug in real parsing rules later without changing the CLI surface.
+    Behavior:
+    - Walk the input directory and stream candidate files (by extension) straight
+      into the parser and then the JSONL writer (see `iter_email_exports` and
+      `iter_parsed_emails`); nothing is collected in memory.
+    - Records come out in discovery order whatever the number of workers, so two
+      runs over the same folder produce the same file.
+    - Without `incremental` the JSONL is rewritten from scratch and any manifest
+      next to it is removed (it would no longer describe the file).
     """
-    # Define which file extensions we consider as email exports at this stage.
-    # We will refine this based on the actual formats you provide (e.g., .msg/.eml/.txt).
-    candidate_exts = {".eml", ".msg", ".txt"}
+    if not input_dir.is_dir():
+        print(f"Input directory not found: {input_dir}", file=sys.stderr)
+        return 1
+    if workers < 1:
+        print("--workers must be at least 1", file=sys.stderr)
+        return 1
+    if use_hash and not incremental:
+        print("--hash only applies together with --incremental", file=sys.stderr)
+        return 1
+    # Load and compile the rules here first, so a bad rules file is reported once
+    # instead of failing inside every worker
+    rules = str(rules_path.resolve()) if rules_path is not None else None
+    try:
+        get_extractor(rules)
+    except (OSError, ValueError) as exc:  # json.JSONDecodeError is a ValueError
+        print(f"Cannot load rules: {exc}", file=sys.stderr)
+        return 1
+    options = {"workers": workers, "headers_only": headers_only, "rules_path": rules, "profile": rule_stats}
 
     # Prepare output destination and ensure parent folder exists
     ensure_directory_exists(output_file)
 
-    discovered = []
-    for path in input_dir.rglob("*"):
-        if path.is_file() and path.suffix.lower() in candidate_exts:
-            discovered.append(path)
+    entries = iter_email_exports(input_dir, include_hidden=include_hidden)
+    manifest_path = manifest_path_for(output_file)
+    if not incremental:
+        manifest_path.unlink(missing_ok=True)
+        paths = (entry.path for entry in entries)
+        return _write_parsed(paths, output_file, "w", **options)
+
+    settings = {
+        "input_dir": str(input_dir),
+        "include_hidden": include_hidden,
+        "headers_only": headers_only,
+        # Editing the rules changes what would be extracted: start over
+        "rules": file_digest(rules) if rules else "builtin",
+    }
+    with ParseManifest(manifest_path, settings) as manifest:
+        appending = manifest.reused and output_file.exists()
+        if not appending:
+            manifest.reset()  # first run (or new options): write everything
+        known = manifest.load()
+        # path -> (size, mtime_ns, hash) for files queued for parsing; entries are
+        # removed once their record is written, so this stays small
+        queued: dict = {}
+        unchanged = 0
+
+        def changed_paths() -> Iterator[str]:
+            """Yield the files that need parsing; skip the rest after one stat."""
+            nonlocal unchanged
+            for entry in entries:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue  # vanished since the listing
+                previous = known.pop(entry.path, None)
+                digest = None
+                if previous is not None:
+                    size, mtime_ns, old_digest, racy = previous
+                    if size == st.st_size and mtime_ns == st.st_mtime_ns and not racy:
+                        unchanged += 1
+                        continue
+                    if use_hash and old_digest is not None and size == st.st_size:
+                        digest = _digest_or_none(entry.path)
+                        if digest == old_digest:
+                            # Touched but not changed: just refresh the row
+                            manifest.record(entry.path, st.st_size, st.st_mtime_ns, digest)
+                            unchanged += 1
+                            continue
+                if use_hash and digest is None:
+                    digest = _digest_or_none(entry.path)
+                queued[entry.path] = (st.st_size, st.st_mtime_ns, digest)
+                yield entry.path
+
+        def written(record: dict) -> None:
+            path = record["source_path"]
+            manifest.record(path, *queued.pop(path))
+
+        status = _write_parsed(
+            changed_paths(), output_file, "a" if appending else "w", **options,
+            on_written=written, on_flush=manifest.commit,
+        )
+        # Whatever is left in `known` was not found this time: tombstone it
+        deleted = 0
+        if known:
+            with output_file.open("a", encoding="utf-8") as f:
+                for path in known:
+                    f.write(json.dumps({"source_path": path, "deleted": True}, ensure_ascii=False) + "\n")
+                    deleted += 1
+            for path in known:
+                manifest.forget(path)
+        manifest.commit()
+    print(
+        f"Incremental: {unchanged} unchanged file(s) skipped, {deleted} deleted file(s) "
+        f"tombstoned{'' if appending else ' (full run: no usable manifest yet)'}."
+    )
+    return status
+
+
+def _digest_or_none(path: str) -> str | None:
+    try:
+        return file_digest(path)
+    except OSError:
+        return None
+
+
+def _write_parsed(
+    paths: Iterator[str],
+    output_file: Path,
+    mode: str,
+    workers: int,
+    headers_only: bool,
+    rules_path: str | None = None,
+    profile: bool = False,
+    on_written=None,
+    on_flush=None,
+) -> int:
+    """
+    Parse `paths` and write one JSONL record each (mode "w" rewrites, "a" appends).
+
+    `on_written(record)` runs after each record is written; `on_flush()` runs
+    after the file has been flushed, every 1000 records and at the end. The
+    incremental mode uses them to update its manifest only for records that are
+    safely on disk - if a run is interrupted, the worst case is that a few files
+    are parsed (and appended) again next time.
 
+    With `profile`, per-rule statistics are printed at the end.
+    """
+    stats: dict = {}
+    discovered = 0
+    parsed = 0
     # Write JSONL output (one JSON object per line). JSONL is nice for streaming and
     # incremental processing; each line is a complete JSON object.
-    with output_file.open("w", encoding="utf-8") as f:
-        for email_path in discovered:
-            record = {
-                "source_path": str(email_path),
-                # Fields below are placeholders to be populated by real parsers later.
-                "vessel": None,
-                "voyage": None,
-                "eta": None,
-                "terminal": None,
-                "subject": None,
-                "parsed": False,  # Signals this is a stub record for now
-            }
+    with output_file.open(mode, encoding="utf-8") as f:
+        records = iter_parsed_emails(
+            paths, workers=workers, headers_only=headers_only,
+            rules_path=rules_path, rule_stats=stats, profile=profile,
+        )
+        for record in records:
+            discovered += 1
+            parsed += record["parsed"]
             f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if on_written is not None:
+                on_written(record)
+            if on_flush is not None and discovered % 1000 == 0:
+                f.flush()
+                on_flush()
+        f.flush()
+        if on_flush is not None:
+            on_flush()
 
-    print(f"Discovered {len(discovered)} exported email files.")
-    print(f"Wrote JSONL to: {output_file}")
+    verb = "Appended" if mode == "a" else "Wrote"
+    print(f"Processed {discovered} exported email file(s) ({parsed} parsed, {discovered - parsed} failed).")
+    print(f"{verb} JSONL to: {output_file}")
+    if profile:
+        print_rule_stats(stats)
     return 0
 
 
@@ -105,6 +1068,9 @@ def generate_checklist_command(input_jsonl: Path, output_dir: Path) -> int:
     - Read each JSON record and create a simple checklist file with placeholders.
     - File is named using the email filename stem where possible; otherwise a counter.
     - This gives a visible output you can review while we develop real templates.
+    - A JSONL written with `parse-emails --incremental` can hold several records for
+      the same source_path (the file changed between runs); only the LAST one counts,
+      and a tombstone ({"deleted": true}) means the email is gone - no checklist.
     """
     ensure_directory_exists(output_dir)
 
@@ -112,6 +1078,16 @@ def generate_checklist_command(input_jsonl: Path, output_dir: Path) -> int:
         print(f"Input not found: {input_jsonl}", file=sys.stderr)
         return 1
 
+    # First pass: the line number of the latest record for each source file. Only
+    # line numbers are kept (not records), so memory stays small.
+    latest: dict = {}
+    with input_jsonl.open("r", encoding="utf-8") as f:
+        for index, line in enumerate(f, start=1):
+            try:
+                latest[json.loads(line).get("source_path")] = index
+            except (json.JSONDecodeError, AttributeError):
+                continue  # reported in the second pass
+
     created = 0
     with input_jsonl.open("r", encoding="utf-8") as f:
         for index, line in enumerate(f, start=1):
@@ -120,6 +1096,8 @@ def generate_checklist_command(input_jsonl: Path, output_dir: Path) -> int:
             except json.JSONDecodeError:
                 print(f"Skipping invalid JSON on line {index}", file=sys.stderr)
                 continue
+            if latest.get(record.get("source_path")) != index or record.get("deleted"):
+                continue  # superseded by a later record, or deleted
 
             # Determine filename stem from source path if available
             stem = Path(record.get("source_path", f"email_{index}")).stem
@@ -212,6 +1190,48 @@ def build_parser() -> argparse.ArgumentParser:
         required=True,
         help="Output JSONL file path",
     )
+    p_parse.add_argument(
+        "--include-hidden",
+        action="store_true",
+        help="Also search hidden (dot) files and folders",
+    )
+    p_parse.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of processes parsing in parallel (default: number of CPUs)",
+    )
+    p_parse.add_argument(
+        "--headers-only",
+        action="store_true",
+        help="Only read headers (faster; vessel/voyage are taken from the subject)",
+    )
+    p_parse.add_argument(
+        "--incremental",
+        action="store_true",
+        help=(
+            "Only parse new or changed files and append them; deleted files get a "
+            "tombstone record (state is kept in <out>.manifest.sqlite)"
+        ),
+    )
+    p_parse.add_argument(
+        "--hash",
+        dest="use_hash",
+        action="store_true",
+        help="With --incremental: also compare content hashes, so touched-but-unchanged files are skipped",
+    )
+    p_parse.add_argument(
+        "--rules",
+        dest="rules_path",
+        type=Path,
+        default=None,
+        help='JSON file with extraction rules ({"rules": [{"name", "field", "scope", "keywords", "pattern"}, ...]})',
+    )
+    p_parse.add_argument(
+        "--rule-stats",
+        action="store_true",
+        help="Print per-rule hit counts and timings (slower: each rule is also timed on its own)",
+    )
 
     # gen-checklist
     p_check = subparsers.add_parser(
@@ -241,7 +1261,17 @@ def main(argv: list[str] | None = None) -> int:
     args = parser.parse_args(argv)
 
     if args.command == "parse-emails":
-        return parse_emails_command(args.input_dir, args.output_file)
+        return parse_emails_command(
+            args.input_dir,
+            args.output_file,
+            include_hidden=args.include_hidden,
+            workers=args.workers,
+            headers_only=args.headers_only,
+            incremental=args.incremental,
+            use_hash=args.use_hash,
+            rules_path=args.rules_path,
+            rule_stats=args.rule_stats,
+        )
     if args.command == "gen-checklist":
         return generate_checklist_command(args.input_jsonl, args.output_dir)
     if args.command == "validate-invoices":
@@ -0,0 +1,254 @@
+"""
+Test-only writer for compound files / .msg (independent of msg_reader.py).
+
+It builds small .msg files with exactly the layout a test needs: streams in
+the mini stream or in regular sectors, sectors in shuffled order, 4096-byte
+sectors, a cut-off end or a looping chain. Only what the reader looks at is written (no red-black colours, no
+timestamps, no CLSIDs).
+"""
+
+from __future__ import annotations
+
+import random
+import struct
+from datetime import datetime, timezone
+
+FREESECT = 0xFFFFFFFF  # also NOSTREAM for directory links
+ENDOFCHAIN = 0xFFFFFFFE
+FATSECT = 0xFFFFFFFD
+DIFSECT = 0xFFFFFFFC
+MINI_CUTOFF = 4096
+HEADER_DIFAT_ENTRIES = 109
+
+
+def _ceil_div(a: int, b: int) -> int:
+    return -(-a // b)
+
+
+def _flatten(tree: dict) -> list[dict]:
+    """Directory entries (root first); a dict is a storage, bytes are a stream."""
+    entries: list[dict] = []
+
+    def add(name: str, node) -> int:
+        entry = {"name": name, "kind": 1 if isinstance(node, dict) else 2, "left": FREESECT,
+                 "right": FREESECT, "child": FREESECT, "data": None if isinstance(node, dict) else node,
+                 "start": ENDOFCHAIN, "size": 0}
+        entries.append(entry)
+        index = len(entries) - 1
+        if isinstance(node, dict):
+            # Children form a binary search tree ordered by (length, upper-case name)
+            kids = sorted((add(n, child) for n, child in node.items()),
+                          key=lambda i: (len(entries[i]["name"]), entries[i]["name"].upper()))
+
+            def balanced(part: list[int]) -> int:
+                if not part:
+                    return FREESECT
+                middle = len(part) // 2
+                entries[part[middle]]["left"] = balanced(part[:middle])
+                entries[part[middle]]["right"] = balanced(part[middle + 1:])
+                return part[middle]
+
+            entry["child"] = balanced(kids)
+        return index
+
+    add("Root Entry", tree)
+    entries[0]["kind"] = 5
+    return entries
+
+
+def write_cfb(path, tree: dict, shift: int = 9, shuffle: bool = False, seed: int = 1,
+              truncate: int = 0, loop: bool = False) -> None:
+    """
+    Write `tree` as a compound file.
+
+    - shift: 9 for 512-byte sectors (version 3), 12 for 4096 (version 4).
+    - shuffle: place data sectors in random order, so every chain jumps around.
+    - truncate: cut this many bytes off the end of the file.
+    - loop: make the directory's chain point back to its start (a chain that
+      is followed to its end, so the reader must notice it never ends).
+    """
+    size = 1 << shift
+    per_sector = size // 4
+    entries = _flatten(tree)
+
+    # Small streams go into the mini stream (64-byte mini sectors)
+    mini = bytearray()
+    minifat: list[int] = []
+    big = []
+    for entry in entries[1:]:
+        if entry["kind"] != 2:
+            continue
+        data = entry["data"]
+        entry["size"] = len(data)
+        if not data:
+            continue
+        if len(data) < MINI_CUTOFF:
+            first = len(mini) // 64
+            count = _ceil_div(len(data), 64)
+            mini += data.ljust(count * 64, b"\0")
+            minifat += [first + i + 1 for i in range(count - 1)] + [ENDOFCHAIN]
+            entry["start"] = first
+        else:
+            big.append(entry)
+
+    directory_sectors = _ceil_div(len(entries) * 128, size)
+    blobs = [(entry, entry["data"]) for entry in big]
+    blobs.append(("mini", bytes(mini)))
+    blobs.append(("minifat", struct.pack(f"<{len(minifat)}I", *minifat)))
+    blobs.append(("dir", None))
+    counts = [directory_sectors if owner == "dir" else _ceil_div(len(data), size) for owner, data in blobs]
+    data_sectors = sum(counts)
+
+    # The FAT covers every sector, its own and the DIFAT's included; FAT sectors
+    # past the 109 listed in the header are listed in DIFAT sectors
+    fat_count = difat_count = 0
+    while True:
+        total = data_sectors + fat_count + difat_count
+        fat_needed = _ceil_div(total, per_sector)
+        difat_needed = max(0, _ceil_div(fat_needed - HEADER_DIFAT_ENTRIES, per_sector - 1))
+        if (fat_needed, difat_needed) == (fat_count, difat_count):
+            break
+        fat_count, difat_count = fat_needed, difat_needed
+    total = data_sectors + fat_count + difat_count
+
+    order = list(range(data_sectors))
+    if shuffle:
+        random.Random(seed).shuffle(order)
+    fat = [FREESECT] * (fat_count * per_sector)
+    placed = {}
+    position = 0
+    for (owner, data), count in zip(blobs, counts):
+        sectors = order[position:position + count]
+        position += count
+        for i, sector in enumerate(sectors):
+            fat[sector] = sectors[i + 1] if i + 1 < count else ENDOFCHAIN
+        if isinstance(owner, dict):
+            owner["start"] = sectors[0]
+            placed[id(owner)] = (sectors, data)
+        else:
+            placed[owner] = (sectors, data)
+    if loop:
+        sectors = placed["dir"][0]
+        fat[sectors[-1]] = sectors[0]
+    fat_sectors = list(range(data_sectors, data_sectors + fat_count))
+    difat_sectors = list(range(data_sectors + fat_count, total))
+    for sector in fat_sectors:
+        fat[sector] = FATSECT
+    for sector in difat_sectors:
+        fat[sector] = DIFSECT
+
+    mini_sectors = placed["mini"][0]
+    entries[0]["start"] = mini_sectors[0] if mini_sectors else ENDOFCHAIN
+    entries[0]["size"] = len(mini)
+    directory = bytearray()
+    for entry in entries:
+        name = entry["name"].encode("utf-16-le") + b"\0\0"
+        directory += struct.pack("<64sHBBIII16sIQQIQ", name, len(name), entry["kind"], 1, entry["left"],
+                                 entry["right"], entry["child"], b"", 0, 0, 0, entry["start"], entry["size"])
+    while len(directory) < directory_sectors * size:  # unused entries
+        directory += struct.pack("<64sHBBIII16sIQQIQ", b"", 0, 0, 0, FREESECT, FREESECT, FREESECT,
+                                 b"", 0, 0, 0, 0, 0)
+    placed["dir"] = (placed["dir"][0], bytes(directory))
+
+    out = bytearray(size * (total + 1))
+
+    def put(sector: int, data: bytes) -> None:
+        out[(sector + 1) * size:(sector + 1) * size + len(data)] = data
+
+    for sectors, data in placed.values():
+        for i, sector in enumerate(sectors):
+            put(sector, data[i * size:(i + 1) * size])
+    fat_bytes = struct.pack(f"<{len(fat)}I", *fat)
+    for i, sector in enumerate(fat_sectors):
+        put(sector, fat_bytes[i * size:(i + 1) * size])
+    overflow = fat_sectors[HEADER_DIFAT_ENTRIES:]
+    for i, sector in enumerate(difat_sectors):
+        part = overflow[i * (per_sector - 1):(i + 1) * (per_sector - 1)]
+        part += [FREESECT] * (per_sector - 1 - len(part))
+        following = difat_sectors[i + 1] if i + 1 < len(difat_sectors) else ENDOFCHAIN
+        put(sector, struct.pack(f"<{per_sector}I", *part, following))
+
+    major = 3 if shift == 9 else 4
+    in_header = fat_sectors[:HEADER_DIFAT_ENTRIES]
+    header = struct.pack(
+        "<8s16sHHHHH6sIIIIIIIII", bytes.fromhex("D0CF11E0A1B11AE1"), b"", 0x3E, major, 0xFFFE, shift, 6, b"",
+        directory_sectors if major == 4 else 0, fat_count, placed["dir"][0][0], 0, MINI_CUTOFF,
+        placed["minifat"][0][0] if minifat else ENDOFCHAIN, len(placed["minifat"][0]),
+        difat_sectors[0] if difat_sectors else ENDOFCHAIN, len(difat_sectors),
+    )
+    header += struct.pack(f"<{HEADER_DIFAT_ENTRIES}I", *in_header, *[FREESECT] * (HEADER_DIFAT_ENTRIES - len(in_header)))
+    out[:len(header)] = header
+    if truncate:
+        del out[-truncate:]
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def utf16(text: str) -> bytes:
+    return text.encode("utf-16-le") + b"\0\0"
+
+
+def filetime(moment: datetime) -> int:
+    return int((moment - datetime(1601, 1, 1, tzinfo=timezone.utc)).total_seconds() * 10**7)
+
+
+def properties(header_size: int, fixed: list[tuple[int, int, int]]) -> bytes:
+    """A __properties_version1.0 stream: (property id, type, value) entries."""
+    data = bytearray(header_size)
+    for prop_id, prop_type, value in fixed:
+        raw = struct.pack("<Q", value) if prop_type == 0x0040 else struct.pack("<iI", value, 0)
+        data += struct.pack("<HHI8s", prop_type, prop_id, 6, raw)
+    return bytes(data)
+
+
+def make_msg(path, subject: str = "MV EVER GIVEN / VOY 045E",
+             body: str | None = "Vessel: EVER GIVEN\r\nETA: 2024-05-01\r\n",
+             html: str | None = None, attachments=(), string8: bool = False, codepage: int = 1252,
+             headers: str | None = None, sender=("Ops Desk", "ops@example.com"),
+             submit: datetime = datetime(2024, 4, 30, 8, 15, tzinfo=timezone.utc),
+             message_id: str | None = "<abc@example.com>", **layout) -> None:
+    """
+    Write a .msg with the given properties (`layout` goes to write_cfb).
+
+    Each attachment is a dict with any of: name (long file name), short (8.3
+    name), mime, data (bytes), embedded (a storage dict), method, attach_size.
+    """
+    tree: dict = {}
+    fixed = [(0x0039, 0x0040, filetime(submit)), (0x0E06, 0x0040, filetime(submit)), (0x3FFD, 0x0003, codepage)]
+    if string8:
+        tree["__substg1.0_0037001E"] = subject.encode(f"cp{codepage}") + b"\0"
+    else:
+        tree["__substg1.0_0037001F"] = utf16(subject)
+    if sender:
+        tree["__substg1.0_0C1A001F"] = utf16(sender[0])
+        tree["__substg1.0_0C1F001F"] = utf16("/O=EXCHANGE/OU=FIRST/CN=OPS")  # not an SMTP address
+        tree["__substg1.0_5D01001F"] = utf16(sender[1])
+    if message_id:
+        tree["__substg1.0_1035001F"] = utf16(message_id)
+    if headers:
+        tree["__substg1.0_007D001F"] = utf16(headers)
+    if body is not None:
+        tree["__substg1.0_1000001F"] = utf16(body)
+    if html is not None:
+        tree["__substg1.0_10130102"] = html.encode("utf-8")
+        fixed.append((0x3FDE, 0x0003, 65001))
+    for i, attachment in enumerate(attachments):
+        data = attachment.get("data", b"")
+        storage = {"__properties_version1.0": properties(8, [
+            (0x3705, 0x0003, attachment.get("method", 1)),
+            (0x0E20, 0x0003, attachment.get("attach_size", len(data) + 200)),
+        ])}
+        if "name" in attachment:
+            storage["__substg1.0_3707001F"] = utf16(attachment["name"])
+        if "short" in attachment:
+            storage["__substg1.0_3704001F"] = utf16(attachment["short"])
+        if "mime" in attachment:
+            storage["__substg1.0_370E001F"] = utf16(attachment["mime"])
+        if "data" in attachment:
+            storage["__substg1.0_37010102"] = data
+        if "embedded" in attachment:
+            storage["__substg1.0_3701000D"] = attachment["embedded"]
+        tree[f"__attach_version1.0_#{i:08X}"] = storage
+    tree["__properties_version1.0"] = properties(32, fixed)
+    tree["__nameid_version1.0"] = {"__substg1.0_00020102": bytes(16)}
+    write_cfb(path, tree, **layout)
@@ -0,0 +1,109 @@
+"""Tests for rule-driven field extraction (FieldExtractor).
+
+Run from the project folder:
+    python -m unittest discover -s tests
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+from main import DEFAULT_RULES, FieldExtractor  # noqa: E402
+
+
+def rule(name: str, field: str, pattern: str, **extra) -> dict:
+    return {"name": name, "field": field, "pattern": pattern, **extra}
+
+
+class DefaultRulesTests(unittest.TestCase):
+    def test_labels_and_subject_shorthand(self) -> None:
+        extractor = FieldExtractor(DEFAULT_RULES)
+        fields = extractor.extract(
+            "MV EVER GIVEN / VOY 045E - ETA update",
+            "Dear all,\n> ETA: 2024-05-01 14:00\nBerth - CT5\n",
+        )
+        self.assertEqual(
+            fields,
+            {"vessel": "EVER GIVEN", "voyage": "045E", "eta": "2024-05-01 14:00", "terminal": "CT5"},
+        )
+
+    def test_label_beats_subject_when_it_comes_first(self) -> None:
+        extractor = FieldExtractor(DEFAULT_RULES)
+        fields = extractor.extract("MV OTHER SHIP / VOY 1", "Vessel: EVER GIVEN\n")
+        self.assertEqual((fields["vessel"], fields["voyage"]), ("EVER GIVEN", "1"))
+
+
+class CombinedRegexTests(unittest.TestCase):
+    def test_overlapping_rules_both_find_their_field(self) -> None:
+        extractor = FieldExtractor([
+            rule("vsl", "vessel", r"^vsl\s+(\w+)"),
+            rule("vsl_voy", "voyage", r"^(vsl\s+\w+\s+\w+)"),
+        ])
+        fields = extractor.extract("update", "vsl EVER 045E\n")
+        self.assertEqual((fields["vessel"], fields["voyage"]), ("EVER", "vsl EVER 045E"))
+        self.assertEqual(extractor.snapshot()["rules"]["vsl_voy"][1], 1)  # counted as a hit
+
+    def test_overlap_does_not_let_a_weaker_rule_win(self) -> None:
+        extractor = FieldExtractor([
+            rule("voyage_line", "voyage", r"^(mv\s+\w+\s+v\.\s*\w+)"),
+            rule("vessel_mv", "vessel", r"^mv\s+(\w+)"),
+            rule("vessel_label", "vessel", r"vessel:\s*(\w+)"),
+        ])
+        fields = extractor.extract("", "MV ALPHA V. 12\nold vessel: BETA")
+        self.assertEqual((fields["vessel"], fields["voyage"]), ("ALPHA", "MV ALPHA V. 12"))
+        hits = {name: values[1] for name, values in extractor.snapshot()["rules"].items()}
+        self.assertEqual(hits, {"voyage_line": 1, "vessel_mv": 1, "vessel_label": 0})
+
+    def test_optional_value_group_is_no_match(self) -> None:
+        extractor = FieldExtractor([
+            rule("eta_maybe", "eta", r"^eta:(?:[ \t]*(\d[\d:-]*))?"),
+            rule("eta_words", "eta", r"^eta is (\w+)"),
+            rule("berth", "terminal", r"^(?:berth:)(x)?"),
+        ])
+        fields = extractor.extract("", "ETA:\nberth:\nETA is tomorrow\n")
+        self.assertEqual(fields, {"vessel": None, "voyage": None, "eta": "tomorrow", "terminal": None})
+        self.assertEqual(extractor.extract("", "ETA: 05-01\n")["eta"], "05-01")
+
+    def test_leading_inline_flags(self) -> None:
+        extractor = FieldExtractor([
+            rule("cs", "vessel", r"(?m)^Ship=(\S+)$", case_sensitive=True),
+            rule("verbose", "voyage", "(?x) ^ voy \\s* = \\s* (\\w+)  # trailing comment"),
+            rule("several", "eta", r"(?s)(?i)eta<(.+?)>"),
+        ])
+        fields = extractor.extract("", "ship=lower\nShip=UPPER\nVOY = 7\nETA<multi\nline>")
+        self.assertEqual(
+            fields, {"vessel": "UPPER", "voyage": "7", "eta": "multi\nline", "terminal": None}
+        )
+
+    def test_bad_rules_are_rejected_when_loading(self) -> None:
+        bad = {
+            "invalid pattern": r"eta: ([0-9]",
+            "capture group": r"eta: \d+",
+            "named groups": r"eta: (?P<v>\d+)",
+            "back-references": r"(eta)\1 (\d+)",
+        }
+        for message, pattern in bad.items():
+            with self.subTest(pattern=pattern):
+                with self.assertRaisesRegex(ValueError, message):
+                    FieldExtractor([rule("ok", "vessel", r"vessel: (\w+)"), rule("bad", "eta", pattern)])
+        with self.assertRaisesRegex(ValueError, "unique"):
+            FieldExtractor([rule("same", "eta", r"(x)"), rule("same", "vessel", r"(y)")])
+
+    def test_keyword_prefilter_and_priority(self) -> None:
+        extractor = FieldExtractor([
+            rule("maersk", "vessel", r"^maersk vsl:\s*(\S+)", keywords=["maersk"]),
+            rule("generic", "vessel", r"^(?:vessel|vsl):\s*(\S+)"),
+        ])
+        self.assertEqual(extractor.extract("", "vsl: GENERIC\n")["vessel"], "GENERIC")
+        self.assertEqual(
+            extractor.extract("", "vsl: GENERIC\nMaersk vsl: MAERSK1\n")["vessel"], "MAERSK1"
+        )
+        active = {name: values[0] for name, values in extractor.snapshot()["rules"].items()}
+        self.assertEqual(active, {"maersk": 1, "generic": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+"""Tests for parse-emails --incremental (ParseManifest).
+
+Run from the project folder:
+    python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+from main import ParseManifest, manifest_path_for, parse_emails_command  # noqa: E402
+
+OLD = time.time() - 3600  # an mtime well outside the racy window
+
+
+def write_eml(path: Path, vessel: str, mtime: float = OLD) -> None:
+    path.write_text(f"Subject: update\n\nVessel: {vessel}\n", encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+
+
+class ParseManifestTests(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db = Path(tmp.name) / "m.sqlite"
+
+    def test_rows_survive_only_with_the_same_settings(self) -> None:
+        with ParseManifest(self.db, {"a": 1}) as manifest:
+            self.assertFalse(manifest.reused)
+            manifest.record("x.eml", 10, 1, None)
+            manifest.commit()
+        with ParseManifest(self.db, {"a": 1}) as manifest:
+            self.assertTrue(manifest.reused)
+            self.assertEqual(manifest.load(), {"x.eml": (10, 1, None, 0)})
+        with ParseManifest(self.db, {"a": 2}) as manifest:
+            self.assertFalse(manifest.reused)
+            self.assertEqual(manifest.load(), {})
+
+    def test_recent_mtime_is_flagged_racy(self) -> None:
+        with ParseManifest(self.db, {}) as manifest:
+            manifest.record("old.eml", 1, int(OLD * 1e9), None)
+            manifest.record("new.eml", 1, time.time_ns(), "abc")
+            rows = manifest.load()
+        self.assertEqual(rows["old.eml"][3], 0)
+        self.assertEqual(rows["new.eml"], (1, rows["new.eml"][1], "abc", 1))
+
+
+class IncrementalRunTests(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.inbox = self.tmp / "in"
+        self.inbox.mkdir()
+        self.out = self.tmp / "parsed.jsonl"
+        write_eml(self.inbox / "a.eml", "ALPHA")
+        write_eml(self.inbox / "b.eml", "BRAVO")
+
+    def run_parse(self, **options) -> str:
+        options.setdefault("incremental", True)
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(parse_emails_command(self.inbox, self.out, **options), 0)
+        return stdout.getvalue()
+
+    def records(self) -> list:
+        with self.out.open(encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def names(self) -> list:
+        return [(Path(r["source_path"]).name, r.get("vessel"), r.get("deleted", False)) for r in self.records()]
+
+    def test_unchanged_files_are_skipped(self) -> None:
+        self.assertIn("full run", self.run_parse())
+        self.assertEqual(sorted(self.names()), [("a.eml", "ALPHA", False), ("b.eml", "BRAVO", False)])
+        output = self.run_parse()
+        self.assertIn("2 unchanged file(s) skipped, 0 deleted", output)
+        self.assertEqual(len(self.records()), 2)
+
+    def test_changed_and_deleted_files_are_appended(self) -> None:
+        self.run_parse()
+        write_eml(self.inbox / "a.eml", "ALPHA TWO", mtime=OLD + 60)
+        (self.inbox / "b.eml").unlink()
+        write_eml(self.inbox / "c.eml", "CHARLIE")
+        output = self.run_parse()
+        self.assertIn("0 unchanged file(s) skipped, 1 deleted", output)
+        appended = self.names()[2:]
+        self.assertEqual(
+            sorted(appended),
+            [("a.eml", "ALPHA TWO", False), ("b.eml", None, True), ("c.eml", "CHARLIE", False)],
+        )
+        # The tombstoned file is gone from the manifest: no second tombstone
+        self.assertIn("2 unchanged file(s) skipped, 0 deleted", self.run_parse())
+        self.assertEqual(len(self.records()), 5)
+
+    def test_racy_rows_are_checked_again(self) -> None:
+        write_eml(self.inbox / "a.eml", "ALPHA", mtime=time.time())
+        self.run_parse()
+        self.assertIn("1 unchanged file(s) skipped", self.run_parse())
+        self.assertEqual([name for name, _, _ in self.names()[2:]], ["a.eml"])
+
+    def test_hash_skips_touched_but_unchanged_files(self) -> None:
+        self.run_parse(use_hash=True)
+        os.utime(self.inbox / "a.eml", (OLD + 60, OLD + 60))
+        self.assertIn("2 unchanged file(s) skipped", self.run_parse(use_hash=True))
+        self.assertEqual(len(self.records()), 2)
+        # The row got the new mtime, so the next run skips it after one stat
+        with sqlite3.connect(str(manifest_path_for(self.out))) as conn:
+            mtimes = dict(conn.execute("SELECT path, mtime_ns FROM files"))
+        conn.close()
+        self.assertEqual(mtimes[str(self.inbox / "a.eml")], (self.inbox / "a.eml").stat().st_mtime_ns)
+
+    def test_other_settings_or_rules_start_over(self) -> None:
+        self.run_parse()
+        self.assertIn("full run", self.run_parse(headers_only=True))
+        rules = self.tmp / "rules.json"
+        rules.write_text(json.dumps({"rules": []}), encoding="utf-8")
+        self.assertIn("full run", self.run_parse(rules_path=rules))
+        self.assertIn("2 unchanged", self.run_parse(rules_path=rules))
+        rules.write_text(json.dumps({"rules": [], "note": "edited"}), encoding="utf-8")
+        self.assertIn("full run", self.run_parse(rules_path=rules))
+        self.assertEqual(len(self.records()), 2)  # a full run rewrites the JSONL
+
+    def test_full_run_removes_the_manifest(self) -> None:
+        self.run_parse()
+        self.assertTrue(manifest_path_for(self.out).exists())
+        self.run_parse(incremental=False)
+        self.assertFalse(manifest_path_for(self.out).exists())
+        self.assertIn("full run", self.run_parse())
+
+
+if __name__ == "__main__":
+    unittest.main()
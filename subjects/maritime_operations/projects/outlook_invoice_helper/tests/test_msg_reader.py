@@ -0,0 +1,168 @@
+"""Tests for the Outlook .msg reader (msg_reader.py).
+
+Run from the project folder:
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest import mock
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import msg_reader  # noqa: E402
+from main import parse_email_file  # noqa: E402
+from msg_reader import CompoundFile, MsgFormatError, read_msg  # noqa: E402
+from msg_writer import make_msg  # noqa: E402
+
+FIXTURES = HERE / "fixtures"
+BODY_STREAM = "__SUBSTG1.0_1000001F"
+DATA_STREAM = "__SUBSTG1.0_37010102"
+
+
+class FixtureTests(unittest.TestCase):
+    """outer.msg was saved by Outlook (see fixtures/README.md)."""
+
+    def test_outer_msg(self) -> None:
+        message = read_msg(str(FIXTURES / "outer.msg"))
+        self.assertEqual(message.subject, "outer subject")
+        self.assertEqual(message.body, "Outer body\r\n")
+        self.assertFalse(message.body_truncated)
+        self.assertIsNone(message.sender_email)
+        # An embedded message: a storage, so there is no size from a data stream
+        self.assertEqual(
+            [(a.filename, a.mime_type, a.size, a.method) for a in message.attachments],
+            [("test", None, None, 5)],
+        )
+
+    def test_parse_email_file_record(self) -> None:
+        record = parse_email_file(str(FIXTURES / "outer.msg"))
+        self.assertTrue(record["parsed"])
+        self.assertEqual(record["subject"], "outer subject")
+        self.assertEqual(record["attachments"], [{"filename": "test", "mime_type": None, "size": None}])
+
+
+class SyntheticMsgTests(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+
+    def make(self, **options) -> str:
+        path = str(self.tmp / "m.msg")
+        make_msg(path, **options)
+        return path
+
+    def test_subject_sender_dates_and_body(self) -> None:
+        message = read_msg(self.make())
+        self.assertEqual(message.subject, "MV EVER GIVEN / VOY 045E")
+        self.assertEqual(message.sender_name, "Ops Desk")
+        # The SMTP address wins over the Exchange path in PR_SENDER_EMAIL_ADDRESS
+        self.assertEqual(message.sender_email, "ops@example.com")
+        self.assertEqual(message.submit_time, datetime(2024, 4, 30, 8, 15, tzinfo=timezone.utc))
+        self.assertEqual(message.message_id, "<abc@example.com>")
+        self.assertEqual(message.body, "Vessel: EVER GIVEN\r\nETA: 2024-05-01\r\n")
+
+    def test_code_page_subject_and_html_only_body(self) -> None:
+        message = read_msg(self.make(subject="MV CAFÉ STAR", string8=True, body=None, html="<p>Hi</p>"))
+        self.assertEqual(message.subject, "MV CAFÉ STAR")
+        self.assertEqual((message.body, message.html), ("", "<p>Hi</p>"))
+
+    def test_headers_only_reads_no_body(self) -> None:
+        message = read_msg(self.make(), headers_only=True)
+        self.assertEqual(message.body, "")
+        self.assertEqual(message.subject, "MV EVER GIVEN / VOY 045E")
+
+    def test_truncation_in_mini_stream_and_regular_sectors(self) -> None:
+        for body in ("x" * 1000, "y" * 300_000):  # under / over the 4096-byte cutoff
+            with self.subTest(length=len(body)):
+                path = self.make(body=body, shuffle=True)
+                message = read_msg(path, max_body_bytes=600)
+                self.assertTrue(message.body_truncated)
+                self.assertEqual(message.body, body[:300])  # 600 bytes of UTF-16
+                full = read_msg(path, max_body_bytes=10**6)
+                self.assertFalse(full.body_truncated)
+                self.assertEqual(full.body, body)
+
+    def test_mini_stream_chains_across_shuffled_sectors(self) -> None:
+        # Many small streams: the mini stream spans several (shuffled) sectors
+        body = "".join(f"line {i}\r\n" for i in range(180))
+        attachments = [{"name": f"n{i}.txt", "mime": "text/plain", "data": bytes([i]) * 700} for i in range(6)]
+        path = self.make(body=body, attachments=attachments, shuffle=True, seed=7)
+        with CompoundFile(path) as cfb:
+            root = cfb.children(cfb.entries[0])
+            self.assertLess(root[BODY_STREAM].size, 4096)
+            self.assertGreater(cfb.entries[0].size, 4 * cfb.sector_size)
+            for i in range(6):
+                storage = cfb.children(root[f"__ATTACH_VERSION1.0_#{i:08X}"])
+                self.assertEqual(cfb.read_stream(storage[DATA_STREAM]), bytes([i]) * 700)
+        self.assertEqual(read_msg(path).body, body)
+
+    def test_attachment_table_reads_no_attachment_data(self) -> None:
+        attachments = [
+            {"name": "invoice 2024-05.pdf", "mime": "application/pdf", "data": os.urandom(200_000)},
+            {"short": "NOTE.TXT", "data": b"hello"},
+            {"name": "fwd.msg", "method": 5, "attach_size": 12345,
+             "embedded": {"__properties_version1.0": bytes(24)}},
+        ]
+        path = self.make(attachments=attachments, shuffle=True)
+        read = []
+        real_read_stream = CompoundFile.read_stream
+
+        def read_stream(cfb, entry, limit=None):
+            read.append(entry.name.upper())
+            return real_read_stream(cfb, entry, limit)
+
+        with mock.patch.object(CompoundFile, "read_stream", read_stream):
+            message = read_msg(path)
+        self.assertEqual(
+            [(a.filename, a.mime_type, a.size, a.method) for a in message.attachments],
+            [("invoice 2024-05.pdf", "application/pdf", 200_000, 1),
+             ("NOTE.TXT", None, 5, 1),
+             ("fwd.msg", None, 12345, 5)],
+        )
+        self.assertNotIn(DATA_STREAM, read)
+
+    def test_difat_and_4096_byte_sectors(self) -> None:
+        # Over 109 FAT sectors (~7 MB with 512-byte sectors) need a DIFAT sector
+        for shift, size in ((9, 7_500_000), (12, 300_000)):
+            with self.subTest(shift=shift):
+                data = os.urandom(size)
+                path = self.make(attachments=[{"name": "big.bin", "data": data}], shift=shift, shuffle=True)
+                with CompoundFile(path) as cfb:
+                    self.assertEqual(cfb._difat_sectors, 1 if shift == 9 else 0)
+                    root = cfb.children(cfb.entries[0])
+                    storage = cfb.children(root["__ATTACH_VERSION1.0_#00000000"])
+                    self.assertEqual(cfb.read_stream(storage[DATA_STREAM]), data)
+                    self.assertEqual(cfb.read_stream(storage[DATA_STREAM], 1000), data[:1000])
+                message = read_msg(path)
+                self.assertEqual(message.subject, "MV EVER GIVEN / VOY 045E")
+                self.assertEqual(message.attachments[0].size, size)
+
+    def test_broken_files_raise_msg_format_error(self) -> None:
+        attachments = [{"name": "a.bin", "data": os.urandom(100_000)}]
+        cases = {
+            "not a compound file": lambda path: Path(path).write_bytes(b"x" * 1000),
+            "empty": lambda path: Path(path).write_bytes(b""),
+            "truncated": lambda path: make_msg(path, attachments=attachments, truncate=60_000),
+            "looping chain": lambda path: make_msg(path, attachments=attachments, loop=True),
+        }
+        for name, write in cases.items():
+            with self.subTest(name):
+                path = str(self.tmp / f"{name}.msg")
+                write(path)
+                with self.assertRaises(MsgFormatError):
+                    with CompoundFile(path) as cfb:
+                        root = cfb.children(cfb.entries[0])
+                        storage = cfb.children(root["__ATTACH_VERSION1.0_#00000000"])
+                        cfb.read_stream(storage[DATA_STREAM])
+        self.assertTrue(issubclass(msg_reader.MsgFormatError, ValueError))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,470 @@
+"""
+Benchmark harness for codebase_size.py - reproducible, machine-readable timings.
+
+Why this script?
+- Changes to `iter_files`, `collect_file_info` or `top_n_largest` can make
+  scans faster or slower in ways nobody notices by eye. This harness builds
+  the same synthetic trees every time (seeded random numbers), times each
+  pipeline stage separately, and writes JSON you can compare between commits.
+
+What it measures, per tree shape:
+- Stages (wall-clock AND CPU time, best and median of --repeat runs):
+    walk       -> iter_file_entries: os.scandir + classification only
+    stat       -> collect_file_info over the walked entries (the stat calls)
+    aggregate  -> ScanAggregator over the FileInfo records
+    top_n      -> top_n_largest over the FileInfo records
+    end_to_end -> main(["--json", "--by-ext", "--top", "10"]) with output discarded
+- files/sec for the walk+stat part, CPU microseconds per file for the
+  end-to-end run, peak RSS of the run, and (when `strace` is installed) how
+  many system calls of each kind a full scan issues.
+- With `--backends scandir fd`, each case also runs with the descriptor-
+  relative walker. That walker stats files while walking, so its "walk"
+  stage includes the stat calls and its "stat" stage only builds FileInfo
+  records.
+
+Every case runs in a fresh child process, so peak memory of one case never
+leaks into the next, and caches inside Python start cold each time.
+
+Tree shapes (counts are multiplied by --scale):
+  wide        one level with many directories, a few files each
+  deep        long chains (300 levels) of nested directories, one per scale step
+  many_small  lots of tiny files spread over a modest tree
+  few_huge    a handful of very large (sparse, so they cost no disk) files
+  symlinks    a tree where many entries are symlinks to files/directories
+  excludes    a tree dominated by excluded dirs (node_modules, .git, build)
+
+Usage examples:
+  # Generate trees (once) and benchmark every shape
+  python bench_codebase_size.py --out results.json
+
+  # Larger trees, fewer shapes, 5 repeats
+  python bench_codebase_size.py --scale 4 --shapes wide deep --repeat 5 --out big.json
+
+  # Compare two result files (e.g. before/after a change)
+  python bench_codebase_size.py --compare before.json after.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import resource  # Unix only; used for peak RSS
+except ImportError:  # pragma: no cover - Windows
+    resource = None  # type: ignore[assignment]
+
+HERE = Path(__file__).resolve().parent
+RESULTS_VERSION = 1
+SHAPES = ("wide", "deep", "many_small", "few_huge", "symlinks", "excludes")
+# Bump when generate_tree changes, so cached trees from older versions are rebuilt
+GENERATOR_VERSION = 2
+
+
+# ------------------------------ Tree Generator -------------------------------
+
+
+def _write_file(path: Path, size: int, sparse: bool = False) -> None:
+    """Create a file of exactly `size` bytes.
+
+    Sparse files (truncate only) take no real disk space, which lets the
+    "few_huge" shape report multi-GB sizes without filling the disk.
+    """
+
+    with open(path, "wb") as handle:
+        if sparse:
+            handle.truncate(size)
+        else:
+            handle.write(b"x" * size)
+
+
+def generate_tree(root: Path, shape: str, scale: int, seed: int) -> None:
+    """Build one synthetic tree under `root` (deterministic for a given seed)."""
+
+    rng = random.Random(f"{shape}:{scale}:{seed}")
+    exts = [".py", ".md", ".txt", ".json", ".js", "", ".c", ".h"]
+    root.mkdir(parents=True)
+
+    def small_file(directory: Path, index: int) -> None:
+        _write_file(directory / f"file_{index}{rng.choice(exts)}", rng.randint(0, 4096))
+
+    if shape == "wide":
+        for d in range(2000 * scale):
+            directory = root / f"dir_{d}"
+            directory.mkdir()
+            for f in range(3):
+                small_file(directory, f)
+    elif shape == "deep":
+        # Depth stays fixed (paths must stay under PATH_MAX); scale adds chains
+        for chain in range(scale):
+            directory = root / f"chain_{chain}"
+            directory.mkdir()
+            for depth in range(300):
+                directory = directory / f"level_{depth}"
+                directory.mkdir()
+                for f in range(5):
+                    small_file(directory, f)
+    elif shape == "many_small":
+        dirs = [root]
+        for d in range(300 * scale):
+            parent = rng.choice(dirs)
+            child = parent / f"pkg_{d}"
+            child.mkdir()
+            dirs.append(child)
+        for f in range(20000 * scale):
+            _write_file(rng.choice(dirs) / f"m_{f}{rng.choice(exts)}", rng.randint(0, 256))
+    elif shape == "few_huge":
+        for f in range(8 * scale):
+            _write_file(root / f"blob_{f}.bin", rng.randint(1, 4) * 1024**3, sparse=True)
+        for f in range(50):
+            small_file(root, f)
+    elif shape == "symlinks":
+        targets = root / "targets"
+        targets.mkdir()
+        for f in range(2000 * scale):
+            small_file(targets, f)
+        links = root / "links"
+        links.mkdir()
+        names = sorted(os.listdir(targets))
+        for i in range(4000 * scale):
+            (links / f"link_{i}").symlink_to(targets / rng.choice(names))
+        for i in range(50 * scale):
+            (links / f"dirlink_{i}").symlink_to(targets, target_is_directory=True)
+    elif shape == "excludes":
+        for d in range(100 * scale):
+            project = root / f"project_{d}"
+            for noisy in ("node_modules/pkg/lib", ".git/objects/ab", "build/out", "src"):
+                (project / noisy).mkdir(parents=True)
+            for f in range(40):
+                small_file(project / "node_modules" / "pkg" / "lib", f)
+                small_file(project / ".git" / "objects" / "ab", f)
+            for f in range(10):
+                small_file(project / "build" / "out", f)
+                small_file(project / "src", f)
+    else:
+        raise ValueError(f"unknown shape: {shape}")
+
+
+def ensure_tree(work_dir: Path, shape: str, scale: int, seed: int) -> Path:
+    """Return the tree for (shape, scale, seed), generating it only once.
+
+    A marker file is written last, so a half-generated tree (e.g. after
+    Ctrl+C) is detected and rebuilt.
+    """
+
+    root = work_dir / f"{shape}-s{scale}-seed{seed}-v{GENERATOR_VERSION}"
+    marker = work_dir / f"{root.name}.done"
+    if marker.exists() and root.is_dir():
+        return root
+    if root.exists():
+        shutil.rmtree(root)
+    generate_tree(root, shape, scale, seed)
+    marker.write_text("ok\n", encoding="utf-8")
+    return root
+
+
+# ------------------------------- Child Process -------------------------------
+
+
+def _timed(func: Callable[[], object]) -> Dict[str, float]:
+    """Run `func` once; return wall and CPU seconds."""
+
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    func()
+    return {"wall_s": time.perf_counter() - wall, "cpu_s": time.process_time() - cpu}
+
+
+def _peak_rss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_case(root: Path, workers: int, backend: str = "scandir") -> Dict[str, object]:
+    """Time every stage once for one tree (runs inside the child process)."""
+
+    sys.path.insert(0, str(HERE))
+    import codebase_size as cs
+
+    excluded = cs.default_excluded_dirs()
+    stages: Dict[str, Dict[str, float]] = {}
+    holder: Dict[str, object] = {}
+
+    def walk() -> None:
+        if backend == "fd":
+            holder["entries"] = list(cs.iter_directory_stats_fd(root, excluded, False, False))
+        else:
+            holder["entries"] = list(
+                cs.iter_file_entries(root, excluded, False, False, workers=workers)
+            )
+
+    def stat_stage() -> None:
+        if backend == "fd":
+            holder["infos"] = [
+                info
+                for directory, records in holder["entries"]  # type: ignore[union-attr]
+                for info in cs.fd_file_infos(directory, records)
+            ]
+        else:
+            holder["infos"] = list(cs.collect_file_info(holder["entries"]))  # type: ignore[arg-type]
+
+    def aggregate() -> None:
+        cs.ScanAggregator(top_n=10).consume(holder["infos"])  # type: ignore[arg-type]
+
+    def top_n() -> None:
+        cs.top_n_largest(holder["infos"], 10)  # type: ignore[arg-type]
+
+    def end_to_end() -> None:
+        argv = ["--path", str(root), "--json", "--by-ext", "--top", "10", "--workers", str(workers)]
+        argv += ["--backend", backend]
+        with redirect_stdout(io.StringIO()):
+            cs.main(argv)
+
+    for name, func in (
+        ("walk", walk),
+        ("stat", stat_stage),
+        ("aggregate", aggregate),
+        ("top_n", top_n),
+        ("end_to_end", end_to_end),
+    ):
+        stages[name] = _timed(func)
+
+    files = len(holder["infos"])  # type: ignore[arg-type]
+    scan_wall = stages["walk"]["wall_s"] + stages["stat"]["wall_s"]
+    return {
+        "files": files,
+        "stages": stages,
+        "files_per_sec": files / scan_wall if scan_wall > 0 else None,
+        "cpu_us_per_file": stages["end_to_end"]["cpu_s"] * 1e6 / files if files else None,
+        "peak_rss_bytes": _peak_rss_bytes(),
+    }
+
+
+def _child_main(root: str, workers: int, backend: str) -> int:
+    """Entry point when this script is re-run as a benchmark child."""
+
+    json.dump(run_case(Path(root), workers, backend), sys.stdout)
+    return 0
+
+
+# --------------------------------- Parent Side -------------------------------
+
+
+def _run_child(root: Path, workers: int, backend: str) -> Dict[str, object]:
+    cmd = [sys.executable, str(Path(__file__).resolve()), "--child", str(root), "--workers", str(workers)]
+    cmd += ["--backends", backend]
+    done = subprocess.run(cmd, check=True, capture_output=True, text=True)
+    return json.loads(done.stdout)
+
+
+_STRACE_LINE = re.compile(r"^\s*[\d.]+\s+[\d.]+\s+\d+\s+(\d+)(?:\s+\d+)?\s+(\w+)\s*$")
+
+
+def count_syscalls(root: Path, workers: int, backend: str = "scandir") -> Optional[Dict[str, int]]:
+    """Count system calls of one full CLI scan using `strace -c`.
+
+    Timings under strace are meaningless, so this is a separate run that
+    only reports counts. Returns None when strace is not installed.
+    """
+
+    strace = shutil.which("strace")
+    if strace is None:
+        return None
+    with tempfile.NamedTemporaryFile("r", suffix=".strace", delete=False) as tmp:
+        summary_path = tmp.name
+    try:
+        cmd = [
+            strace, "-f", "-c", "-o", summary_path,
+            sys.executable, str(HERE / "codebase_size.py"),
+            "--path", str(root), "--json", "--workers", str(workers), "--backend", backend,
+        ]
+        subprocess.run(cmd, check=True, capture_output=True)
+        counts: Dict[str, int] = {}
+        with open(summary_path, encoding="utf-8") as handle:
+            for line in handle:
+                match = _STRACE_LINE.match(line)
+                if match and match.group(2) != "total":
+                    counts[match.group(2)] = int(match.group(1))
+        return counts
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    finally:
+        os.unlink(summary_path)
+
+
+def _summarize(runs: List[Dict[str, object]]) -> Dict[str, object]:
+    """Collapse repeated runs into best/median per stage."""
+
+    stages: Dict[str, Dict[str, float]] = {}
+    for name in runs[0]["stages"]:  # type: ignore[union-attr]
+        walls = [run["stages"][name]["wall_s"] for run in runs]  # type: ignore[index]
+        cpus = [run["stages"][name]["cpu_s"] for run in runs]  # type: ignore[index]
+        stages[name] = {
+            "wall_s_min": min(walls),
+            "wall_s_median": statistics.median(walls),
+            "cpu_s_min": min(cpus),
+            "cpu_s_median": statistics.median(cpus),
+        }
+    rates = [run["files_per_sec"] for run in runs if run["files_per_sec"]]
+    cpu_per_file = [run["cpu_us_per_file"] for run in runs if run["cpu_us_per_file"]]
+    rss = [run["peak_rss_bytes"] for run in runs if run["peak_rss_bytes"]]
+    return {
+        "files": runs[0]["files"],
+        "stages": stages,
+        "files_per_sec_median": statistics.median(rates) if rates else None,
+        "cpu_us_per_file_median": statistics.median(cpu_per_file) if cpu_per_file else None,
+        "peak_rss_bytes_max": max(rss) if rss else None,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        done = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=HERE, check=True, capture_output=True, text=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return done.stdout.strip() or None
+
+
+def benchmark(args: argparse.Namespace) -> Dict[str, object]:
+    work_dir = Path(args.work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    cases = []
+    for shape in args.shapes:
+        print(f"[{shape}] preparing tree...", file=sys.stderr)
+        root = ensure_tree(work_dir, shape, args.scale, args.seed)
+        for backend in args.backends:
+            for workers in args.workers:
+                if backend == "fd" and workers > 1:
+                    continue  # the fd walker is serial
+                runs = [_run_child(root, workers, backend) for _ in range(args.repeat)]
+                case = {"shape": shape, "workers": workers, "backend": backend, **_summarize(runs)}
+                if not args.no_strace:
+                    case["syscalls"] = count_syscalls(root, workers, backend)
+                cases.append(case)
+                e2e = case["stages"]["end_to_end"]["wall_s_median"]  # type: ignore[index]
+                print(
+                    f"[{shape}] backend={backend} workers={workers} files={case['files']} "
+                    f"end_to_end={e2e:.3f}s cpu/file={case['cpu_us_per_file_median']:.2f}us",
+                    file=sys.stderr,
+                )
+    return {
+        "version": RESULTS_VERSION,
+        "timestamp": time.time(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": args.scale,
+        "seed": args.seed,
+        "generator_version": GENERATOR_VERSION,
+        "repeat": args.repeat,
+        "cases": cases,
+    }
+
+
+def compare(old_path: Path, new_path: Path, threshold: float) -> int:
+    """Print per-stage changes between two result files.
+
+    Returns 1 if any stage got slower by more than `threshold` (e.g. 0.10 =
+    10%), so the comparison can gate a CI job.
+    """
+
+    old = json.loads(old_path.read_text(encoding="utf-8"))
+    new = json.loads(new_path.read_text(encoding="utf-8"))
+    def key(case: Dict[str, object]) -> Tuple[object, ...]:
+        # Result files written before backends existed only used "scandir"
+        return (case["shape"], case["workers"], case.get("backend", "scandir"))
+
+    old_cases = {key(c): c for c in old["cases"]}
+    regressed = False
+    for case in new["cases"]:
+        before = old_cases.get(key(case))
+        if before is None:
+            continue
+        print(f"{case['shape']} (backend={case.get('backend', 'scandir')}, workers={case['workers']}):")
+        for stage, numbers in case["stages"].items():
+            old_wall = before["stages"].get(stage, {}).get("wall_s_median")
+            new_wall = numbers["wall_s_median"]
+            if not old_wall:
+                continue
+            change = (new_wall - old_wall) / old_wall
+            flag = "  <-- slower" if change > threshold else ""
+            regressed = regressed or bool(flag)
+            print(f"  {stage:>10}: {old_wall:.4f}s -> {new_wall:.4f}s ({change:+.1%}){flag}")
+    return 1 if regressed else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark codebase_size.py on synthetic trees.")
+    parser.add_argument("--shapes", nargs="*", default=list(SHAPES), choices=SHAPES)
+    parser.add_argument("--scale", type=int, default=1, help="Multiply tree sizes (default: 1)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for tree generation")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case (default: 3)")
+    parser.add_argument(
+        "--workers", type=int, nargs="*", default=[1], help="--workers values to benchmark"
+    )
+    parser.add_argument(
+        "--backends",
+        nargs="*",
+        default=["scandir"],
+        choices=("scandir", "fd"),
+        help="Walker backends to benchmark (default: scandir)",
+    )
+    parser.add_argument(
+        "--work-dir",
+        default=os.path.join(tempfile.gettempdir(), "codebase_size_bench"),
+        help="Where generated trees are kept between runs",
+    )
+    parser.add_argument("--out", help="Write JSON results to this file (default: stdout)")
+    parser.add_argument("--no-strace", action="store_true", help="Skip syscall counting")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files and exit"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.10, help="With --compare: slowdown that counts as a regression"
+    )
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.child:
+        return _child_main(
+            args.child,
+            args.workers[0] if args.workers else 1,
+            args.backends[0] if args.backends else "scandir",
+        )
+    if args.compare:
+        return compare(Path(args.compare[0]), Path(args.compare[1]), args.threshold)
+
+    results = benchmark(args)
+    text = json.dumps(results, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+        print(f"Wrote results to {args.out}", file=sys.stderr)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -36,172 +36,4551 @@ Usage examples (PowerShell on Windows):
 
   # Output as JSON (machine-readable)
   python subjects\\python\\projects\\codebase_size_cli\\codebase_size.py --json
+
+  # Scan a slow network share with 8 threads
+  python subjects\\python\\projects\\codebase_size_cli\\codebase_size.py --path Z:\\repo --workers 8
+
+  # Scan two volumes at once (separate processes) without crossing mounts
+  python subjects\\python\\projects\\codebase_size_cli\\codebase_size.py --path C:\\src D:\\data --one-file-system
 """
 
-from __future__ import annotations
+from __future__ import annotations
+
+import argparse
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import heapq
+import json
+import math
+import os
+import random
+import re
+import select
+import sqlite3
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+from collections import Counter, defaultdict
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import (
+    AsyncIterator,
+    Callable,
+    ContextManager,
+    IO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Pattern,
+    Set,
+    Tuple,
+    Union,
+)
+
+try:
+    import resource  # Unix only; used for the peak memory in --stats
+except ImportError:  # pragma: no cover - Windows
+    resource = None  # type: ignore[assignment]
+
+
+# ------------------------------ Data Structures ------------------------------
+
+
+@dataclass
+class FileInfo:
+    """Simple container for file metadata we care about.
+
+    Attributes:
+        path: Absolute or relative path to the file.
+        size_bytes: File size in bytes (the "apparent" size).
+        extension: Lowercased file extension (e.g., ".py"). Empty string if none.
+        allocated_bytes: Bytes actually allocated on disk (st_blocks * 512).
+            Only filled in by --disk-usage mode; None otherwise.
+        device, inode: st_dev and st_ino of the file, when the walker knows
+            them. Two paths with the same pair are the same file (hardlinks,
+            or one file reached twice through symlinks).
+    """
+
+    path: str
+    size_bytes: int
+    extension: str
+    allocated_bytes: Optional[int] = None
+    device: Optional[int] = None
+    inode: Optional[int] = None
+
+
+class FileStore:
+    """Compact, column-oriented list of FileInfo records.
+
+    Why not just a list of FileInfo?
+    - Every FileInfo is a Python object holding three more Python objects
+      (two strings and an int). That is a few hundred bytes per file, and the
+      extension string is repeated for every ".py" file. At 10 million files
+      that is gigabytes before any real work happens.
+
+    What we store instead (one "column" per field, like a database):
+    - sizes:     array('Q') -> 8 bytes per file
+    - ext_codes: array('H') -> 2 bytes per file; each distinct extension is
+                 stored once and referred to by a small integer code
+    - dir_codes: array('I') -> 4 bytes per file; directories are interned the
+                 same way, since many files share a directory
+    - name_ends: array('I') -> 4 bytes per file; the end offset of the file's
+                 name inside ONE shared bytes buffer (`_names`). Widened to
+                 8-byte offsets automatically once the buffer passes 4 GiB
+    Plus the UTF-8 file name itself, which is typically 10-20 bytes. That keeps
+    resident memory well under 40 bytes per file for ordinary trees.
+
+    With `track_ids=True` two more columns (devices, inodes: 8 bytes each)
+    remember which file every record is, for callers such as DuplicateFinder
+    that must recognise the same file under two paths.
+
+    It behaves like a read-only sequence of FileInfo (len, iteration,
+    indexing), so existing code keeps working; `summarize_by_extension` and
+    `top_n_largest` detect a FileStore and work directly on the columns.
+    """
+
+    def __init__(self, track_ids: bool = False) -> None:
+        self.sizes = array("Q")
+        self.ext_codes = array("H")
+        self.dir_codes = array("I")
+        self.name_ends = array("I")
+        # 0 means "unknown" (not reported, or too large for the column)
+        self.devices: Optional[array] = array("Q") if track_ids else None
+        self.inodes: Optional[array] = array("Q") if track_ids else None
+        self._names = bytearray()
+        self.extensions: List[str] = []
+        self._ext_index: Dict[str, int] = {}
+        self.directories: List[str] = []
+        self._dir_index: Dict[str, int] = {}
+
+    def append(self, info: FileInfo) -> None:
+        """Add one file (allocated_bytes, if any, is not stored)."""
+
+        if self.inodes is not None and self.devices is not None:
+            device, inode = info.device or 0, info.inode or 0
+            if device > 0xFFFFFFFFFFFFFFFF or inode > 0xFFFFFFFFFFFFFFFF:
+                device = inode = 0
+            self.devices.append(device)
+            self.inodes.append(inode)
+
+        ext_code = self._ext_index.get(info.extension)
+        if ext_code is None:
+            ext_code = self._ext_index[info.extension] = len(self.extensions)
+            self.extensions.append(info.extension)
+            if ext_code > 0xFFFF and self.ext_codes.typecode == "H":
+                # More than 65,536 distinct extensions: widen the column
+                self.ext_codes = array("I", self.ext_codes)
+
+        # Keep the separator on the directory part ("/srv/x/"), so joining is
+        # plain concatenation and paths without a directory still round-trip
+        directory, sep, name = info.path.rpartition(os.sep)
+        directory += sep
+        dir_code = self._dir_index.get(directory)
+        if dir_code is None:
+            dir_code = self._dir_index[directory] = len(self.directories)
+            self.directories.append(directory)
+
+        # surrogateescape keeps undecodable file names round-trippable
+        self._names += name.encode("utf-8", "surrogateescape")
+        self.sizes.append(info.size_bytes)
+        self.ext_codes.append(ext_code)
+        self.dir_codes.append(dir_code)
+        if len(self._names) > 0xFFFFFFFF and self.name_ends.typecode == "I":
+            self.name_ends = array("Q", self.name_ends)
+        self.name_ends.append(len(self._names))
+
+    def extend(self, files: Iterable[FileInfo]) -> "FileStore":
+        for info in files:
+            self.append(info)
+        return self
+
+    def __len__(self) -> int:
+        return len(self.sizes)
+
+    def path(self, index: int) -> str:
+        """Rebuild the full path of record `index` (only done when needed)."""
+
+        start = self.name_ends[index - 1] if index > 0 else 0
+        name = self._names[start : self.name_ends[index]].decode("utf-8", "surrogateescape")
+        return self.directories[self.dir_codes[index]] + name
+
+    def file_id(self, index: int) -> Optional[Tuple[int, int]]:
+        """(st_dev, st_ino) of record `index`, or None if it is not known."""
+
+        if self.inodes is None or self.devices is None or not self.inodes[index]:
+            return None
+        return self.devices[index], self.inodes[index]
+
+    def __getitem__(self, index: int) -> FileInfo:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("FileStore index out of range")
+        file_id = self.file_id(index)
+        return FileInfo(
+            path=self.path(index),
+            size_bytes=self.sizes[index],
+            extension=self.extensions[self.ext_codes[index]],
+            device=file_id[0] if file_id else None,
+            inode=file_id[1] if file_id else None,
+        )
+
+    def __iter__(self) -> Iterator[FileInfo]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def nbytes(self) -> int:
+        """Approximate memory used by the per-file columns and name buffer."""
+
+        columns = [self.sizes, self.ext_codes, self.dir_codes, self.name_ends]
+        if self.inodes is not None and self.devices is not None:
+            columns += [self.devices, self.inodes]
+        return sum(col.itemsize * len(col) for col in columns) + len(self._names)
+
+
+# ------------------------------ Scan Statistics ------------------------------
+
+
+class ScanStats:
+    """Counters and per-phase timings for one scan (the --stats report).
+
+    Why?
+    - When a scan is slow you want to know *where* the time goes: listing
+      directories, stat'ing files, summarizing, or encoding the output. Pass
+      one ScanStats to `iter_file_entries` and `collect_file_info`, wrap the
+      other steps in `with stats.phase("name"):`, and read `as_dict()` at the
+      end. That is also the programmatic hook for callers other than the CLI.
+
+    Keeping it cheap (well under 2% of a scan):
+    - Clocks are read once per directory and once per phase, never per file;
+      per-file work only bumps a local integer.
+    - Directory counters are updated under a lock, once per directory,
+      because the parallel walker scans directories on several threads.
+      `stat_calls` counts every stat the scan issues: one per file, plus the
+      per-directory ones made for --follow-symlinks, --cache and
+      --one-file-system.
+    - Building Path objects for subdirectories is timed per directory too
+      (in bulk, after the listing), so it is reported apart from scandir.
+    - Peak memory comes from the operating system (ru_maxrss) for free.
+      `tracemalloc` reports the peak of Python allocations precisely but slows
+      every allocation down a lot, so it is opt-in (`trace_memory=True`).
+    """
+
+    def __init__(self, trace_memory: bool = False) -> None:
+        self.phases: Dict[str, Dict[str, float]] = {}
+        self.dirs_scanned = 0
+        self.files_found = 0
+        self.stat_calls = 0
+        # Time spent inside os.scandir loops, summed over all walker threads
+        self.scandir_seconds = 0.0
+        # Time spent building subdirectory Path objects, likewise summed
+        self.path_seconds = 0.0
+        # "where:ExceptionType" -> count, for errors we skipped over
+        self.errors: Counter = Counter()
+        self.trace_memory = trace_memory
+        self._lock = threading.Lock()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Add the wall-clock and CPU time of the `with` block to phase `name`."""
+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            totals = self.phases.setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0})
+            totals["wall_s"] += time.perf_counter() - wall
+            totals["cpu_s"] += time.process_time() - cpu
+
+    def record_directory(
+        self,
+        seconds: float,
+        files: int,
+        errors: Optional[List[str]],
+        stat_calls: int = 0,
+        path_seconds: float = 0.0,
+    ) -> None:
+        """Called by the walker after listing one directory (thread-safe)."""
+
+        with self._lock:
+            self.dirs_scanned += 1
+            self.files_found += files
+            self.scandir_seconds += seconds
+            self.stat_calls += stat_calls
+            self.path_seconds += path_seconds
+            if errors:
+                self.errors.update(errors)
+
+    def record_stat_calls(self, count: int) -> None:
+        """Add `count` stat calls (thread-safe; call once per batch, not per file)."""
+
+        with self._lock:
+            self.stat_calls += count
+
+    def record_error(self, where: str, exc: BaseException) -> None:
+        """Count an error that was handled by skipping an entry."""
+
+        with self._lock:
+            self.errors[f"{where}:{type(exc).__name__}"] += 1
+
+    def peak_memory(self) -> Dict[str, int]:
+        """Peak memory figures available on this platform."""
+
+        peaks: Dict[str, int] = {}
+        if resource is not None:
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Linux reports kilobytes, macOS reports bytes
+            peaks["peak_rss_bytes"] = rss if sys.platform == "darwin" else rss * 1024
+        if self.trace_memory and tracemalloc.is_tracing():
+            peaks["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+        return peaks
+
+    def as_dict(self) -> Dict[str, object]:
+        """JSON-friendly snapshot of everything recorded so far."""
+
+        return {
+            "phases": {
+                name: {key: round(value, 6) for key, value in totals.items()}
+                for name, totals in self.phases.items()
+            },
+            "scandir_s": round(self.scandir_seconds, 6),
+            "path_construction_s": round(self.path_seconds, 6),
+            "dirs_scanned": self.dirs_scanned,
+            "files_found": self.files_found,
+            "stat_calls": self.stat_calls,
+            "errors_skipped": dict(sorted(self.errors.items())),
+            **self.peak_memory(),
+        }
+
+    def lines(self) -> Iterator[str]:
+        """Human-readable version of `as_dict()`."""
+
+        for name, totals in self.phases.items():
+            yield f"  {name:>10}: {totals['wall_s']:.3f}s wall, {totals['cpu_s']:.3f}s CPU"
+        yield f"  Listing directories (all threads): {self.scandir_seconds:.3f}s"
+        yield f"  Building Path objects (all threads): {self.path_seconds:.3f}s"
+        yield (
+            f"  Directories scanned: {self.dirs_scanned} | Files found: {self.files_found}"
+            f" | stat() calls: {self.stat_calls}"
+        )
+        errors = ", ".join(f"{key} x{count}" for key, count in sorted(self.errors.items()))
+        yield f"  Errors skipped: {errors or 'none'}"
+        labels = {"peak_rss_bytes": "Peak memory (RSS)", "peak_traced_bytes": "Peak traced allocations"}
+        for key, value in self.peak_memory().items():
+            yield f"  {labels[key]}: {human_readable_size(value)}"
+
+
+# ------------------------------ Helper Functions -----------------------------
+
+
+def human_readable_size(num_bytes: int) -> str:
+    """Convert raw bytes to megabytes for consistent display.
+
+    Always shows megabytes (MB) to make sizes easy to compare.
+    Example: 1_234_567 bytes -> "1.18 MB"
+    """
+
+    # Convert bytes to megabytes (divide by 1024^2)
+    # Using 1024^2 = 1,048,576 for binary megabytes (MiB)
+    size_mb = num_bytes / (1024 * 1024)
+    
+    # Format with 2 decimal places for readability
+    # Show more precision for very small files
+    if size_mb < 0.01:
+        return f"{size_mb:.4f} MB"
+    else:
+        return f"{size_mb:.2f} MB"
+
+
+def default_excluded_dirs() -> Set[str]:
+    """Common directories to skip by default.
+
+    Rationale: These directories frequently contain binary caches or third-party
+    dependencies that do not represent your authored code and can distort size
+    measurements if included.
+    """
+
+    return {
+        ".git",
+        "__pycache__",
+        "node_modules",
+        "venv",
+        ".venv",
+        "env",
+        "build",
+        "dist",
+        ".mypy_cache",
+        ".pytest_cache",
+        ".ruff_cache",
+    }
+
+
+# ------------------------------- Ignore Patterns ------------------------------
+
+
+def _glob_to_regex(pattern: str) -> str:
+    """Translate ONE gitignore glob (already stripped of "!" and "/") to regex.
+
+    Supported syntax, following `git help gitignore`:
+      *      any run of characters except "/"
+      ?      any single character except "/"
+      [a-z]  character class ("[!a-z]" negates; a "]" right after "[" or
+             "[!" is a literal member, and "[" with no closing "]" is a
+             literal "[" - both like fnmatch)
+      **/    at the start: any number of leading directories (or none)
+      /**/   in the middle: zero or more directories
+      /**    at the end: everything inside
+      \\x     the literal character x
+    """
+
+    out: List[str] = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**", i):
+                at_start = i == 0
+                before_slash = at_start or pattern[i - 1] == "/"
+                after = pattern[i + 2 : i + 3]
+                if before_slash and after == "/":
+                    # "**/" -> zero or more whole directories
+                    out.append("(?:.*/)?")
+                    i += 3
+                    continue
+                if before_slash and after == "" and not at_start:
+                    # trailing "/**" -> everything below
+                    out.append(".*")
+                    i += 2
+                    continue
+                if at_start and after == "":
+                    out.append(".*")
+                    i += 2
+                    continue
+            # A plain "*" (or "**" git treats like one)
+            while i < n and pattern[i] == "*":
+                i += 1
+            out.append("[^/]*")
+            continue
+        if c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            start = i + 1
+            if pattern[start : start + 1] in ("!", "^"):
+                start += 1
+            if pattern[start : start + 1] == "]":
+                start += 1  # "[]...]" / "[!]...]": the first "]" is a member
+            end = pattern.find("]", start)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1 : end]
+                negate = body[:1] in ("!", "^")
+                if negate:
+                    body = body[1:]
+                # Backslashes, "[" and "]" are literal inside a gitignore class
+                body = body.replace("\\", "\\\\").replace("[", "\\[").replace("]", "\\]")
+                out.append(("[^" if negate else "[") + body + "]")
+                i = end
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+_GLOB_CHARS = frozenset("*?[\\")
+
+
+class _PatternGroup:
+    """A set of same-polarity patterns, organised for fast matching.
+
+    Regex alternation (p1|p2|...) is still tried one alternative after the
+    other by Python's regex engine, so hundreds of patterns would make every
+    check slow. But most real ignore patterns have simple shapes, which we
+    answer with hash lookups instead:
+      node_modules / Thumbs.db  -> exact name, looked up in a set
+      *.log / *~               -> name suffix, one set lookup per suffix length
+      tmp*                     -> name prefix, same idea
+    Only the remaining "real" globs go into combined regexes: one matched
+    against the entry name, one against its path relative to the rules file.
+    The cost per entry therefore stays flat as the pattern count grows.
+    """
+
+    __slots__ = ("names", "suffixes", "prefixes", "name_regex", "path_regex")
+
+    def __init__(self, patterns: List[Tuple[str, str]]) -> None:
+        self.names: Set[str] = set()
+        # length -> set of suffixes/prefixes of that length
+        self.suffixes: Dict[int, Set[str]] = defaultdict(set)
+        self.prefixes: Dict[int, Set[str]] = defaultdict(set)
+        name_rx: List[str] = []
+        path_rx: List[str] = []
+        for kind, value in patterns:
+            if kind == "name":
+                self.names.add(value)
+            elif kind == "suffix":
+                self.suffixes[len(value)].add(value)
+            elif kind == "prefix":
+                self.prefixes[len(value)].add(value)
+            elif kind == "name_regex":
+                name_rx.append(value)
+            else:
+                path_rx.append(value)
+        self.suffixes = dict(self.suffixes)
+        self.prefixes = dict(self.prefixes)
+        self.name_regex = self._combine(name_rx)
+        self.path_regex = self._combine(path_rx)
+
+    @staticmethod
+    def _combine(regexes: List[str]) -> Optional[Pattern[str]]:
+        if not regexes:
+            return None
+        return re.compile("|".join(f"(?:{rx})" for rx in regexes), re.DOTALL)
+
+    def matches(self, rel_path: str, name: str) -> bool:
+        if name in self.names:
+            return True
+        for length, values in self.suffixes.items():
+            if name[-length:] in values and len(name) >= length:
+                return True
+        for length, values in self.prefixes.items():
+            if name[:length] in values:
+                return True
+        if self.name_regex is not None and self.name_regex.fullmatch(name):
+            return True
+        return self.path_regex is not None and self.path_regex.fullmatch(rel_path) is not None
+
+
+class IgnoreRules:
+    """One compiled list of gitignore-style patterns (e.g. one .gitignore file).
+
+    Patterns are compiled once into _PatternGroup objects (hash lookups plus
+    combined regexes), so checking an entry costs about the same whether the
+    file has 5 patterns or 500.
+
+    Gitignore's "last matching pattern wins" rule (needed for "!" re-includes)
+    is kept by splitting the list into runs of same-polarity patterns. Runs
+    are tried from last to first; the first run that matches decides. Most
+    files have no or few negations, so there are only one or two runs.
+
+    Each run has two groups: one with every pattern (used for directories)
+    and one without the directory-only patterns ending in "/" (used for files).
+
+    A line that cannot be compiled (e.g. the empty range "[z-a]") is skipped
+    and kept in `invalid`, the way git silently ignores bad patterns; one
+    typo in a .gitignore must not abort the scan.
+    """
+
+    def __init__(self, patterns: Iterable[str]) -> None:
+        runs: List[Tuple[bool, List[Tuple[str, str]], List[Tuple[str, str]]]] = []
+        self.invalid: List[str] = []
+        for raw in patterns:
+            try:
+                parsed = self._parse(raw)
+            except re.error:
+                self.invalid.append(raw.rstrip("\r\n"))
+                continue
+            if parsed is None:
+                continue
+            negated, dir_only, compiled = parsed
+            if not runs or runs[-1][0] != negated:
+                runs.append((negated, [], []))
+            runs[-1][1].append(compiled)
+            if not dir_only:
+                runs[-1][2].append(compiled)
+
+        self._runs = [
+            (negated, _PatternGroup(all_patterns), _PatternGroup(file_patterns))
+            for negated, all_patterns, file_patterns in runs
+        ]
+
+    @staticmethod
+    def _parse(line: str) -> Optional[Tuple[bool, bool, Tuple[str, str]]]:
+        """Turn one pattern line into (negated, directory_only, (kind, value)).
+
+        `kind` says how the pattern is matched (see _PatternGroup). Raises
+        re.error for a glob that does not translate to a valid regex.
+        """
+
+        line = line.rstrip("\n").rstrip("\r")
+        # Trailing spaces are ignored unless escaped with a backslash
+        stripped = line.rstrip(" ")
+        if stripped.endswith("\\") and len(stripped) < len(line):
+            stripped += " "
+        line = stripped
+        if not line or line.startswith("#"):
+            return None
+        negated = line.startswith("!")
+        if negated:
+            line = line[1:]
+        elif line.startswith("\\!") or line.startswith("\\#"):
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            return None
+
+        # A slash at the start or in the middle anchors the pattern to the
+        # directory holding the rules; otherwise it matches the entry's name
+        # at any depth.
+        if "/" in line:
+            regex = _glob_to_regex(line.lstrip("/"))
+            re.compile(regex)  # checked alone, before it joins a combined regex
+            return negated, dir_only, ("path_regex", regex)
+        if not _GLOB_CHARS.intersection(line):
+            return negated, dir_only, ("name", line)
+        if line[0] == "*" and not _GLOB_CHARS.intersection(line[1:]) and len(line) > 1:
+            return negated, dir_only, ("suffix", line[1:])
+        if line[-1] == "*" and not _GLOB_CHARS.intersection(line[:-1]) and len(line) > 1:
+            return negated, dir_only, ("prefix", line[:-1])
+        regex = _glob_to_regex(line)
+        re.compile(regex)
+        return negated, dir_only, ("name_regex", regex)
+
+    @classmethod
+    def from_file(cls, path: Union[str, Path]) -> Optional["IgnoreRules"]:
+        """Load a .gitignore file; None if it can't be read or has no rules."""
+
+        try:
+            with open(path, "r", encoding="utf-8", errors="surrogateescape") as handle:
+                rules = cls(handle)
+        except OSError:
+            return None
+        return rules if rules._runs else None
+
+    def match(self, rel_path: str, is_dir: bool) -> Optional[bool]:
+        """True = ignored, False = re-included by "!", None = no rule matched.
+
+        `rel_path` uses "/" separators and is relative to the rules' directory.
+        """
+
+        name = rel_path.rpartition("/")[2]
+        for negated, all_group, file_group in reversed(self._runs):
+            group = all_group if is_dir else file_group
+            if group.matches(rel_path, name):
+                return not negated
+        return None
+
+
+def exclude_glob_pattern(value: str) -> str:
+    """argparse type for --exclude-glob: reject patterns that can't compile."""
+
+    try:
+        IgnoreRules._parse(value)
+    except re.error as exc:
+        raise argparse.ArgumentTypeError(f"invalid glob pattern {value!r}: {exc}") from None
+    return value
+
+
+class IgnoreState:
+    """Which ignore rules apply inside one directory during a walk.
+
+    Rules are inherited like in git: a directory sees its own .gitignore plus
+    those of all its parents, and deeper files take precedence. We keep them
+    as a linked chain of (rules, base path) pairs so each directory just adds
+    one link; subdirectories share the rest.
+
+    `rel` is the directory's path relative to the scan root, with "/"
+    separators ("" for the root itself).
+    """
+
+    __slots__ = ("chain", "rel", "respect_gitignore")
+
+    def __init__(
+        self,
+        chain: Optional[Tuple[Tuple[IgnoreRules, str], object]],
+        rel: str,
+        respect_gitignore: bool,
+    ) -> None:
+        self.chain = chain
+        self.rel = rel
+        self.respect_gitignore = respect_gitignore
+
+    @classmethod
+    def for_root(cls, patterns: Iterable[str], respect_gitignore: bool) -> Optional["IgnoreState"]:
+        """Initial state for a walk, or None when nothing can be ignored.
+
+        Command-line patterns act like rules in the root directory with the
+        lowest precedence (any .gitignore may override them with "!").
+        """
+
+        patterns = list(patterns)
+        if not patterns and not respect_gitignore:
+            return None
+        chain = ((IgnoreRules(patterns), ""), None) if patterns else None
+        return cls(chain, "", respect_gitignore)
+
+    def enter(self, directory: Union[str, Path], names: Set[str]) -> "IgnoreState":
+        """State for the contents of `directory` (adds its .gitignore, if any)."""
+
+        if self.respect_gitignore and ".gitignore" in names:
+            rules = IgnoreRules.from_file(os.path.join(directory, ".gitignore"))
+            if rules is not None:
+                return IgnoreState(((rules, self.rel), self.chain), self.rel, True)
+        return self
+
+    def child(self, name: str) -> "IgnoreState":
+        """State for a subdirectory, before its own .gitignore is read."""
+
+        rel = f"{self.rel}/{name}" if self.rel else name
+        return IgnoreState(self.chain, rel, self.respect_gitignore)
+
+    def is_ignored(self, name: str, is_dir: bool) -> bool:
+        """Decide whether an entry of this directory should be skipped."""
+
+        full_rel = f"{self.rel}/{name}" if self.rel else name
+        link = self.chain
+        while link is not None:
+            (rules, base), link = link
+            rel = full_rel[len(base) + 1 :] if base else full_rel
+            verdict = rules.match(rel, is_dir)
+            if verdict is not None:
+                return verdict
+        return False
+
+
+def _scan_directory(
+    current: Path,
+    excluded_dirs: Set[str],
+    include_hidden: bool,
+    follow_symlinks: bool,
+    ignore: Optional[IgnoreState] = None,
+    stats: Optional[ScanStats] = None,
+    device: Optional[int] = None,
+    fd: Optional[int] = None,
+) -> Tuple[List[os.DirEntry], List[Path], Optional[IgnoreState]]:
+    """Scan ONE directory and split its entries into (files, subdirectories).
+
+    This is the single place where the traversal rules live (hidden names,
+    excluded directory names, ignore patterns, symlink handling). Both the
+    serial walker and the parallel walker call it, which is what guarantees
+    they agree on results.
+
+    Files are returned as the os.DirEntry objects themselves (not Paths): a
+    DirEntry caches its stat() result, so later stages can read the size
+    without asking the operating system a second time.
+
+    `ignore` is the IgnoreState for `current` (None when no patterns are in
+    use). The third return value is the state for its contents - pass
+    `state.child(subdir.name)` along with each subdirectory. Ignored
+    directories are dropped here, so they are never even listed.
+
+    `device` (--one-file-system) is the st_dev of the scan root: subdirectories
+    on any other device (mount points) are not entered. That costs one stat
+    per subdirectory, so it is only done when requested.
+
+    `fd` (used by the --backend fd walker) is an open descriptor of the
+    directory: it is listed instead of `current`, and the subdirectories come
+    back as bare names (str) rather than Paths. `current` is then only used
+    to read .gitignore files.
+
+    Errors are handled the same way the original walker did: an unreadable
+    entry is skipped, and an unreadable directory yields whatever was read
+    before the error (often nothing). With `stats`, the time spent and the
+    skipped errors are recorded there.
+    """
+
+    files: List[os.DirEntry] = []
+    dir_entries: List[os.DirEntry] = []
+    errors: Optional[List[str]] = None
+    started = time.perf_counter() if stats is not None else 0.0
+    stat_calls = 0
+
+    try:
+        with os.scandir(current if fd is None else fd) as it:
+            entries: Iterable[os.DirEntry] = it
+            if ignore is not None:
+                # Read the whole listing first so we know about .gitignore
+                # before judging any entry
+                entries = list(it)
+                ignore = ignore.enter(current, {entry.name for entry in entries})
+            for entry in entries:
+                try:
+                    # Skip hidden (dot) entries unless explicitly requested.
+                    # This covers both hidden files and hidden directories
+                    # (we never traverse into a hidden directory).
+                    name = entry.name
+                    if not include_hidden and name.startswith("."):
+                        continue
+
+                    # Skip excluded directories by name match (shallow check)
+                    if entry.is_dir(follow_symlinks=follow_symlinks):
+                        if name in excluded_dirs:
+                            continue
+                        if ignore is not None and ignore.is_ignored(name, True):
+                            continue
+                        if device is not None:
+                            stat_calls += 1
+                            if entry.stat(follow_symlinks=follow_symlinks).st_dev != device:
+                                continue  # a mount point: stay on this file system
+                        # Remember directory for traversal
+                        dir_entries.append(entry)
+                        continue
+
+                    # Only keep regular files; ignore others (sockets, devices)
+                    if entry.is_file(follow_symlinks=follow_symlinks):
+                        if ignore is not None and ignore.is_ignored(name, False):
+                            continue
+                        files.append(entry)
+                except OSError as exc:
+                    # Some entries may become inaccessible or disappear, or be
+                    # symlinks that can't be resolved (e.g. a -> b -> a); skip
+                    if stats is not None:
+                        errors = errors or []
+                        errors.append(f"entry:{type(exc).__name__}")
+                    continue
+    except (PermissionError, FileNotFoundError) as exc:
+        # Current directory might be inaccessible; skip
+        if stats is not None:
+            errors = errors or []
+            errors.append(f"scandir:{type(exc).__name__}")
+
+    # Paths are built in one go after the listing, so their cost can be
+    # timed once per directory instead of once per entry
+    listed = time.perf_counter() if stats is not None else 0.0
+    subdirs: List[Path] = (
+        [Path(entry.path) for entry in dir_entries]
+        if fd is None
+        else [entry.name for entry in dir_entries]  # type: ignore[misc]
+    )
+    if stats is not None:
+        done = time.perf_counter()
+        stats.record_directory(listed - started, len(files), errors, stat_calls, done - listed)
+    return files, subdirs, ignore
+
+
+# Chain of directory identities from the root down to a directory, stored as
+# nested pairs (identity, parent_chain) so siblings share their parents' links.
+Ancestry = Optional[Tuple[int, "Ancestry"]]
+
+
+class VisitedDirectories:
+    """Make --follow-symlinks safe: walk each physical directory only once.
+
+    When symlinks are followed, two things can go wrong:
+    - A cycle: `ln -s .. loop` makes a directory its own descendant, so a naive
+      walker goes round forever (loop/loop/loop/...).
+    - Duplicates: two symlinks (or a symlink and the real path) lead to the
+      same directory, which then gets scanned - and counted - twice.
+
+    A directory's real identity is its (device, inode) pair, whatever path we
+    reached it through. We remember every identity we've walked ("claimed")
+    and each directory's chain of ancestors:
+    - identity already among its own ancestors -> a cycle; skipped,
+    - identity claimed elsewhere -> a duplicate path; skipped.
+    So the number of directories scanned is bounded by the number of unique
+    directories, and both kinds of skip are counted for the report.
+
+    Claims are made in the consumer's depth-first order, which keeps results
+    identical between the serial and the parallel walker.
+    """
+
+    def __init__(self) -> None:
+        self._claimed: Set[int] = set()
+        self.cycles_skipped = 0
+        self.duplicates_skipped = 0
+
+    @staticmethod
+    def identity(path: Union[str, Path]) -> Optional[int]:
+        """(device, inode) of a directory packed into one int; None if unreadable."""
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_dev << 64) | st.st_ino
+
+    @staticmethod
+    def is_cycle(identity: int, ancestry: Ancestry) -> bool:
+        """True if `identity` already appears on the path from the root."""
+
+        while ancestry is not None:
+            if ancestry[0] == identity:
+                return True
+            ancestry = ancestry[1]
+        return False
+
+    def seen(self, identity: int) -> bool:
+        """True if this physical directory has already been claimed."""
+
+        return identity in self._claimed
+
+    def enter(self, identity: int, ancestry: Ancestry) -> Ancestry:
+        """Claim a directory for walking.
+
+        Returns the ancestry chain to hand to its subdirectories, or None if
+        the directory must be skipped (a cycle or an already-walked duplicate).
+        """
+
+        if self.is_cycle(identity, ancestry):
+            self.cycles_skipped += 1
+            return None
+        if identity in self._claimed:
+            self.duplicates_skipped += 1
+            return None
+        self._claimed.add(identity)
+        return (identity, ancestry)
+
+    def release(self, identity: int) -> None:
+        """Forget a claimed directory (watch mode, after it was removed)."""
+
+        self._claimed.discard(identity)
+
+
+def iter_file_entries(
+    root: Path,
+    excluded_dirs: Set[str],
+    include_hidden: bool,
+    follow_symlinks: bool,
+    workers: int = 1,
+    visited: Optional[VisitedDirectories] = None,
+    ignore: Optional[IgnoreState] = None,
+    stats: Optional[ScanStats] = None,
+    one_file_system: bool = False,
+    on_directory: Optional[Callable[[], None]] = None,
+) -> Iterator[os.DirEntry]:
+    """Yield an os.DirEntry for every regular file under `root`.
+
+    This is the walker the CLI uses. Yielding DirEntry objects (instead of
+    Path objects) matters for speed: `entry.stat()` reuses information the
+    operating system already gave us while listing the directory, so each file
+    costs at most one stat call. See `iter_files` for the rules applied.
+
+    With `follow_symlinks`, cycles and duplicate directories are skipped using
+    a VisitedDirectories tracker; pass your own `visited` to read its counters
+    afterwards.
+
+    `ignore` (see IgnoreState.for_root) enables --exclude-glob patterns and
+    nested .gitignore files. `stats` collects --stats counters. With
+    `one_file_system`, directories on other devices (mounts) are skipped.
+    `on_directory()` is called after each directory's files were yielded,
+    even when it had none (NdjsonWriter uses it to flush stale output).
+    """
+
+    guard: Optional[VisitedDirectories] = None
+    if follow_symlinks:
+        guard = visited if visited is not None else VisitedDirectories()
+
+    device: Optional[int] = None
+    if one_file_system:
+        if stats is not None:
+            stats.record_stat_calls(1)
+        try:
+            device = os.stat(root).st_dev
+        except OSError:
+            return
+
+    if workers > 1:
+        yield from _iter_files_parallel(
+            root, excluded_dirs, include_hidden, follow_symlinks, workers, guard, ignore, stats,
+            device, on_directory,
+        )
+        return
+
+    # Use a manual stack to avoid recursion limits on very deep trees.
+    # Each item also carries the directory's ancestry (only used with a guard)
+    # and its ignore state (only used with ignore patterns).
+    stack: List[Tuple[Path, Ancestry, Optional[IgnoreState]]] = [(root, None, ignore)]
+
+    while stack:
+        current, ancestry, state = stack.pop()
+        if guard is not None:
+            if stats is not None:
+                stats.record_stat_calls(1)
+            identity = guard.identity(current)
+            if identity is None:
+                continue
+            ancestry = guard.enter(identity, ancestry)
+            if ancestry is None:
+                continue
+        files, subdirs, state = _scan_directory(
+            current, excluded_dirs, include_hidden, follow_symlinks, state, stats, device
+        )
+        yield from files
+        if on_directory is not None:
+            on_directory()
+        stack.extend(
+            (sub, ancestry, state.child(sub.name) if state is not None else None)
+            for sub in subdirs
+        )
+
+
+def iter_files(
+    root: Path,
+    excluded_dirs: Set[str],
+    include_hidden: bool,
+    follow_symlinks: bool,
+    workers: int = 1,
+) -> Iterator[Path]:
+    """Yield paths for all regular files under `root`.
+
+    We use os.scandir for performance and to minimize system calls. Hidden files
+    on Windows don't always start with a dot, but for simplicity we treat "dot"
+    names as hidden across platforms. You can override with --include-hidden.
+
+    With `workers > 1` directory scans are fanned out over a thread pool (see
+    `_iter_files_parallel`). The yielded paths and their order are identical to
+    the serial walk; only the waiting on the file system overlaps.
+    """
+
+    for entry in iter_file_entries(
+        root, excluded_dirs, include_hidden, follow_symlinks, workers
+    ):
+        yield Path(entry.path)
+
+
+class _PendingScan:
+    """A directory waiting to be scanned, plus the future scanning it (if any).
+
+    `future` stays None when the look-ahead limit was reached at the time the
+    directory was discovered; the consumer then submits the scan itself once it
+    actually needs the result. `ancestry` and `identity` are only used when
+    following symlinks (see VisitedDirectories).
+    """
+
+    __slots__ = ("path", "ancestry", "ignore", "identity", "future")
+
+    def __init__(
+        self, path: Path, ancestry: Ancestry = None, ignore: Optional[IgnoreState] = None
+    ) -> None:
+        self.path = path
+        self.ancestry = ancestry
+        self.ignore = ignore
+        self.identity: Optional[int] = None
+        self.future: Optional["Future[Tuple[List[os.DirEntry], List[_PendingScan]]]"] = None
+
+
+def _iter_files_parallel(
+    root: Path,
+    excluded_dirs: Set[str],
+    include_hidden: bool,
+    follow_symlinks: bool,
+    workers: int,
+    guard: Optional[VisitedDirectories] = None,
+    ignore: Optional[IgnoreState] = None,
+    stats: Optional[ScanStats] = None,
+    device: Optional[int] = None,
+    on_directory: Optional[Callable[[], None]] = None,
+) -> Iterator[os.DirEntry]:
+    """Parallel version of `iter_file_entries` backed by a thread pool.
+
+    Why threads (and not processes)?
+    - os.scandir releases the GIL while it waits on the operating system, so on
+      slow (e.g. network-mounted) file systems several threads can wait at the
+      same time. The Python-side work per entry is small by comparison.
+
+    How the work is shared:
+    - Each worker scans a directory and immediately schedules scans for the
+      subdirectories it found, so idle threads pick up new work as soon as it
+      exists (no central coordinator has to hand it out).
+    - The consumer (this generator) replays the exact depth-first order of the
+      serial walker: it keeps the same stack, but each stack slot holds a
+      future instead of a path. Results are therefore identical and stable.
+    - To keep memory bounded, at most `workers * 64` scans may run ahead of the
+      consumer. Directories found beyond that limit are scanned on demand.
+    - With a symlink guard, workers skip cycles and already-claimed
+      directories early, but only the consumer claims directories, so which
+      path "wins" a duplicated directory is the same as in a serial walk.
+      In that mode the subdirectories of a scan are only scheduled once the
+      consumer has claimed the directory: a worker may scan a duplicate that
+      the consumer then skips, and scheduling its children from the worker
+      would walk (and leak look-ahead slots for) a whole subtree nobody
+      reads. The extra scans are therefore limited to one per duplicate path.
+    """
+
+    max_ahead = workers * 64
+    # Number of scans submitted but not yet consumed (guarded by `lock`)
+    in_flight = 0
+    lock = threading.Lock()
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan")
+
+    def scan(slot: _PendingScan) -> Tuple[List[os.DirEntry], List[_PendingScan]]:
+        chain: Ancestry = None
+        if guard is not None:
+            if stats is not None:
+                stats.record_stat_calls(1)
+            slot.identity = guard.identity(slot.path)
+            if (
+                slot.identity is None
+                or guard.is_cycle(slot.identity, slot.ancestry)
+                or guard.seen(slot.identity)
+            ):
+                # The consumer will skip (and count) this directory anyway
+                return [], []
+            chain = (slot.identity, slot.ancestry)
+        files, subdirs, state = _scan_directory(
+            slot.path, excluded_dirs, include_hidden, follow_symlinks, slot.ignore, stats, device
+        )
+        pending = [
+            _PendingScan(sub, chain, state.child(sub.name) if state is not None else None)
+            for sub in subdirs
+        ]
+        if guard is None:
+            # Schedule the newest directories first: the consumer pops the
+            # last one off its stack next, so that is the result it needs first.
+            for slot in reversed(pending):
+                submit(slot)
+        return files, pending
+
+    def submit(slot: _PendingScan) -> None:
+        nonlocal in_flight
+        with lock:
+            if in_flight >= max_ahead:
+                return
+            in_flight += 1
+        slot.future = pool.submit(scan, slot)
+
+    root_slot = _PendingScan(root, None, ignore)
+    submit(root_slot)
+    stack: List[_PendingScan] = [root_slot]
+
+    try:
+        while stack:
+            slot = stack.pop()
+            if slot.future is None:
+                # Look-ahead limit was hit when this slot was created
+                submit(slot)
+            if slot.future is None:
+                # Still over the limit: scan inline on the consumer thread
+                files, pending = scan(slot)
+            else:
+                files, pending = slot.future.result()
+                with lock:
+                    in_flight -= 1
+            if guard is not None:
+                if slot.identity is None or guard.enter(slot.identity, slot.ancestry) is None:
+                    continue
+                # Claimed: now its subdirectories are worth scanning
+                for child in reversed(pending):
+                    submit(child)
+            yield from files
+            if on_directory is not None:
+                on_directory()
+            stack.extend(pending)
+    finally:
+        # If the consumer stops early (e.g. an exception or break), drop
+        # queued scans so the pool can shut down quickly.
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+class _FdDirectory:
+    """One directory on the fd walker's stack.
+
+    Holds an open descriptor (or None once closed to save descriptors), the
+    names of subdirectories still to visit, and the directory's name. The
+    full path is only joined from the parents' names the first time someone
+    asks for it (`path()`), and then cached.
+    """
+
+    __slots__ = ("parent", "name", "fd", "pending", "ancestry", "ignore", "_path")
+
+    def __init__(
+        self,
+        parent: Optional["_FdDirectory"],
+        name: str,
+        fd: Optional[int],
+        ancestry: Ancestry = None,
+        ignore: Optional[IgnoreState] = None,
+        path: Optional[str] = None,
+    ) -> None:
+        self.parent = parent
+        self.name = name
+        self.fd = fd
+        self.pending: Optional[List[str]] = None
+        self.ancestry = ancestry
+        self.ignore = ignore
+        self._path = path
+
+    def path(self) -> str:
+        """Full path of this directory (joined on first use)."""
+
+        if self._path is None:
+            # Walk up to the nearest ancestor that knows its path (iteratively,
+            # so very deep trees don't hit the recursion limit)
+            chain: List[_FdDirectory] = []
+            node: _FdDirectory = self
+            while node._path is None:
+                chain.append(node)
+                node = node.parent  # type: ignore[assignment]
+            path = node._path
+            for node in reversed(chain):
+                path = os.path.join(path, node.name)
+                node._path = path
+        return self._path  # type: ignore[return-value]
+
+
+# Most directory descriptors the fd walker keeps open at once. Deeper
+# ancestors are closed and reopened by path when they are needed again.
+FD_WALK_MAX_OPEN = 64
+
+
+def _open_directory(name: str, dir_fd: Optional[int], follow_symlinks: bool) -> int:
+    """Open a directory for listing, relative to `dir_fd` when given."""
+
+    flags = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0)
+    if not follow_symlinks:
+        # It was a real directory when listed; don't follow a symlink that
+        # replaced it in the meantime
+        flags |= getattr(os, "O_NOFOLLOW", 0)
+    return os.open(name, flags, dir_fd=dir_fd)
+
+
+def fd_backend_available() -> bool:
+    """True if this platform supports the descriptor-relative calls we need."""
+
+    return os.scandir in os.supports_fd and os.open in os.supports_dir_fd
+
+
+def iter_directory_stats_fd(
+    root: Path,
+    excluded_dirs: Set[str],
+    include_hidden: bool,
+    follow_symlinks: bool,
+    visited: Optional[VisitedDirectories] = None,
+    ignore: Optional[IgnoreState] = None,
+    stats: Optional[ScanStats] = None,
+    one_file_system: bool = False,
+    hardlinks: Optional[HardlinkTracker] = None,
+    on_directory: Optional[Callable[[], None]] = None,
+) -> Iterator[Tuple[_FdDirectory, List[Tuple[str, os.stat_result]]]]:
+    """The --backend fd walker: yield (directory, [(file name, stat result)]).
+
+    Why another walker?
+    - The default walker hands a full path to every system call, so the
+      kernel re-resolves each path component every time, and Python builds
+      path strings and objects for every directory and file.
+    - Here each directory is opened once and everything inside it is
+      listed, stat'ed and opened *relative to that descriptor* (`dir_fd`),
+      like `os.fwalk`. Files are reported as (name, stat) pairs; a full path
+      is only joined when a record is actually needed (`directory.path()`,
+      e.g. for --top), via `ScanAggregator.add_directory`.
+
+    Traversal rules and order are exactly those of `iter_file_entries` (it
+    shares `_scan_directory`), so results are identical. Each file is
+    stat'ed once (and dropped here if `hardlinks` says it was counted
+    already), and only directories with at least one file are yielded;
+    `on_directory()` is still called after every directory, as in
+    `iter_file_entries`. Descriptors are only kept open for the current chain of ancestors, and at
+    most FD_WALK_MAX_OPEN of those.
+    """
+
+    guard: Optional[VisitedDirectories] = None
+    if follow_symlinks:
+        guard = visited if visited is not None else VisitedDirectories()
+
+    try:
+        root_fd = _open_directory(str(root), None, True)
+    except OSError as exc:
+        if stats is not None:
+            stats.record_error("scandir", exc)
+        return
+    root_st = os.fstat(root_fd)
+    if stats is not None:
+        stats.record_stat_calls(1)
+    device = root_st.st_dev if one_file_system else None
+    ancestry: Ancestry = None
+    if guard is not None:
+        ancestry = guard.enter((root_st.st_dev << 64) | root_st.st_ino, None)
+    stack: List[_FdDirectory] = [_FdDirectory(None, "", root_fd, ancestry, ignore, path=str(root))]
+
+    try:
+        while stack:
+            frame = stack[-1]
+            if frame.pending is None:
+                # First visit: list the directory and stat its files
+                files, subdirs, frame.ignore = _scan_directory(
+                    frame.path() if frame.ignore is not None else "",
+                    excluded_dirs,
+                    include_hidden,
+                    follow_symlinks,
+                    frame.ignore,
+                    stats,
+                    device,
+                    fd=frame.fd,
+                )
+                frame.pending = subdirs  # type: ignore[assignment]
+                records: List[Tuple[str, os.stat_result]] = []
+                for entry in files:
+                    try:
+                        st = entry.stat()  # fstatat() relative to frame.fd
+                    except OSError as exc:
+                        if stats is not None:
+                            stats.record_error("stat", exc)
+                        continue
+                    if hardlinks is not None and not hardlinks.first_time(st):
+                        continue
+                    records.append((entry.name, st))
+                if stats is not None:
+                    stats.record_stat_calls(len(files))
+                if records:
+                    yield frame, records
+                if on_directory is not None:
+                    on_directory()
+
+            if not frame.pending:
+                # Directory finished: release its descriptor
+                stack.pop()
+                if frame.fd is not None:
+                    os.close(frame.fd)
+                continue
+
+            # Same order as the path walker: last listed subdirectory first
+            name = frame.pending.pop()
+            try:
+                if frame.fd is None:
+                    frame.fd = _open_directory(frame.path(), None, True)
+                child_fd = _open_directory(name, frame.fd, follow_symlinks)
+            except OSError as exc:
+                # Gone, unreadable, or replaced since it was listed: a symlink
+                # (ELOOP with O_NOFOLLOW) or a file (ENOTDIR). Skip it, like
+                # the path walker skips a directory it can't list.
+                if stats is not None:
+                    stats.record_error("scandir", exc)
+                continue
+            ancestry = None
+            if guard is not None:
+                child_st = os.fstat(child_fd)
+                if stats is not None:
+                    stats.record_stat_calls(1)
+                ancestry = guard.enter((child_st.st_dev << 64) | child_st.st_ino, frame.ancestry)
+                if ancestry is None:
+                    os.close(child_fd)
+                    continue
+            child_ignore = frame.ignore.child(name) if frame.ignore is not None else None
+            stack.append(_FdDirectory(frame, name, child_fd, ancestry, child_ignore))
+            if len(stack) > FD_WALK_MAX_OPEN:
+                oldest = stack[-FD_WALK_MAX_OPEN - 1]
+                if oldest.fd is not None:
+                    os.close(oldest.fd)
+                    oldest.fd = None
+    finally:
+        for frame in stack:
+            if frame.fd is not None:
+                os.close(frame.fd)
+
+
+def fd_file_infos(
+    directory: _FdDirectory, records: List[Tuple[str, os.stat_result]], disk_usage: bool = False
+) -> Iterator[FileInfo]:
+    """FileInfo objects for one batch from `iter_directory_stats_fd`.
+
+    Only needed when every file must be seen individually (listeners such as
+    --tree or --duplicates); plain totals use `ScanAggregator.add_directory`.
+    """
+
+    base = directory.path()
+    for name, st in records:
+        yield FileInfo(
+            path=os.path.join(base, name),
+            size_bytes=st.st_size,
+            extension=file_extension(name),
+            allocated_bytes=allocated_size(st) if disk_usage else None,
+            device=st.st_dev,
+            inode=st.st_ino,
+        )
+
+
+def file_extension(name: str) -> str:
+    """Return the lowercased extension of a file name ("" if none).
+
+    Mirrors `Path(name).suffix` exactly (".bashrc" and "notes." have no
+    extension) without building a Path object for every file we see.
+    """
+
+    dot = name.rfind(".")
+    if 0 < dot < len(name) - 1:
+        return name[dot:].lower()
+    return ""
+
+
+def allocated_size(st: os.stat_result) -> int:
+    """Bytes a file really occupies on disk, according to its stat result.
+
+    POSIX systems report allocated space in 512-byte units (st_blocks), which
+    is smaller than st_size for sparse files and usually a little larger for
+    ordinary files (the last block is only partly used). Windows has no
+    st_blocks, so there we fall back to the apparent size.
+    """
+
+    blocks = getattr(st, "st_blocks", None)
+    if blocks is None:
+        return st.st_size
+    return blocks * 512
+
+
+class HardlinkTracker:
+    """Remember which multiply-linked inodes we've already counted.
+
+    A hardlinked file has several directory entries but only one copy of its
+    data, identified by (st_dev, st_ino). To count it once, we only need to
+    remember inodes whose link count is greater than 1 - ordinary files (the
+    vast majority) never enter the set. That is the same trick `du` uses, and
+    it keeps the set small even for trees with tens of millions of inodes.
+
+    Each key is packed into one Python int (device in the high bits, inode in
+    the low bits), which is cheaper than storing a tuple per inode.
+    """
+
+    def __init__(self) -> None:
+        self._seen: Set[int] = set()
+        self.skipped = 0
+
+    def first_time(self, st: os.stat_result) -> bool:
+        """True the first time an inode is seen; False for repeat links."""
+
+        if st.st_nlink <= 1 or not st.st_ino:
+            # Single link (or a platform without inode numbers): always unique
+            return True
+        key = (st.st_dev << 64) | st.st_ino
+        if key in self._seen:
+            self.skipped += 1
+            return False
+        self._seen.add(key)
+        return True
+
+
+def collect_file_info(
+    paths: Iterable[Union[Path, os.DirEntry]],
+    hardlinks: Optional[HardlinkTracker] = None,
+    stats: Optional[ScanStats] = None,
+) -> Iterator[FileInfo]:
+    """Map Path or os.DirEntry objects to FileInfo with size and extension.
+
+    Passing DirEntry objects (from `iter_file_entries`) is the fast path:
+    their stat() result is cached from the directory listing, so we never
+    stat the same file twice. Path objects still work for callers that have
+    plain paths.
+
+    When `hardlinks` is given we are in disk-usage mode: every FileInfo also
+    carries `allocated_bytes`, and repeat links to an already-counted inode
+    are dropped so shared data is counted once.
+
+    We keep errors localized; unreadable files are skipped gracefully. With
+    `stats`, stat calls and skipped errors are counted there.
+    """
+
+    calls = 0
+    try:
+        for item in paths:
+            calls += 1
+            try:
+                st = item.stat()
+                ext = file_extension(item.name)  # ".py", ".md", or "" if none
+                if hardlinks is None:
+                    yield FileInfo(
+                        os.fspath(item), st.st_size, ext, device=st.st_dev, inode=st.st_ino
+                    )
+                    continue
+                if not hardlinks.first_time(st):
+                    continue
+                yield FileInfo(
+                    path=os.fspath(item),
+                    size_bytes=st.st_size,
+                    extension=ext,
+                    allocated_bytes=allocated_size(st),
+                    device=st.st_dev,
+                    inode=st.st_ino,
+                )
+            except (PermissionError, FileNotFoundError, OSError) as exc:
+                # If file vanishes or can't be read, we skip it
+                if stats is not None:
+                    stats.record_error("stat", exc)
+                continue
+    finally:
+        # Counted locally and added once, so per-file cost stays negligible
+        if stats is not None:
+            stats.record_stat_calls(calls)
+
+
+def summarize_by_extension(files: Iterable[FileInfo]) -> Dict[str, int]:
+    """Return a dict mapping file extension -> total size in bytes.
+
+    Empty-extension files are grouped under "<no_ext>" to avoid empty keys.
+    A FileStore is summarized straight from its columns, without creating a
+    FileInfo object per file.
+    """
+
+    if isinstance(files, FileStore):
+        per_code = [0] * len(files.extensions)
+        for code, size in zip(files.ext_codes, files.sizes):
+            per_code[code] += size
+        # Codes are assigned in first-seen order, so key order matches the
+        # generic loop below
+        return {
+            (ext if ext else "<no_ext>"): size
+            for ext, size in zip(files.extensions, per_code)
+        }
+
+    totals: Dict[str, int] = defaultdict(int)
+    for info in files:
+        key = info.extension if info.extension else "<no_ext>"
+        totals[key] += info.size_bytes
+    return dict(totals)
+
+
+def top_n_largest(files: Iterable[FileInfo], n: int) -> List[FileInfo]:
+    """Return the N largest files, sorted descending by size.
+
+    heapq.nlargest keeps only N items in memory while it streams through
+    `files`, instead of copying and sorting everything. It gives exactly the
+    same answer as a full sort (ties keep their original order). For a
+    FileStore only the winning records are turned into FileInfo objects.
+    """
+
+    if isinstance(files, FileStore):
+        winners = heapq.nlargest(n, range(len(files)), key=files.sizes.__getitem__)
+        return [files[index] for index in winners]
+
+    return heapq.nlargest(n, files, key=lambda f: f.size_bytes)
+
+
+class ScanAggregator:
+    """Compute every summary the CLI prints in ONE pass over the files.
+
+    Why a class?
+    - The scan produces files one at a time. Instead of storing them all in a
+      list (memory grows with the number of files), we fold each file into a
+      few running results as it streams past:
+        * the grand total and file count,
+        * per-extension totals (one number per extension),
+        * a bounded min-heap holding only the current `top_n` largest files.
+    - Memory therefore depends on the number of extensions and on `top_n`,
+      not on how many files the tree contains.
+
+    The results match `summarize_by_extension` and `top_n_largest` exactly,
+    including the order of files with equal sizes.
+
+    In disk-usage mode (FileInfo.allocated_bytes is set) allocated bytes are
+    totalled alongside the apparent sizes, overall and per extension.
+    """
+
+    def __init__(self, top_n: int = 0) -> None:
+        self.top_n = top_n
+        self.total_bytes = 0
+        self.allocated_bytes = 0
+        self.file_count = 0
+        self._by_ext: Dict[str, int] = defaultdict(int)
+        self._by_ext_allocated: Dict[str, int] = defaultdict(int)
+        # Heap items are (size, -sequence, FileInfo). The smallest item sits at
+        # heap[0]; for equal sizes the most recently seen file is "smaller", so
+        # earlier files win ties just like a stable sort would.
+        self._heap: List[Tuple[int, int, FileInfo]] = []
+
+    def add(self, info: FileInfo) -> None:
+        """Fold one file into the running totals."""
+
+        size = info.size_bytes
+        key = info.extension or "<no_ext>"
+        self.total_bytes += size
+        self.file_count += 1
+        self._by_ext[key] += size
+        if info.allocated_bytes is not None:
+            self.allocated_bytes += info.allocated_bytes
+            self._by_ext_allocated[key] += info.allocated_bytes
+
+        if self.top_n > 0:
+            item = (size, -self.file_count, info)
+            if len(self._heap) < self.top_n:
+                heapq.heappush(self._heap, item)
+            elif size > self._heap[0][0]:
+                # Replace the smallest of the current top N
+                heapq.heapreplace(self._heap, item)
+
+    def add_directory(
+        self,
+        directory: "_FdDirectory",
+        records: List[Tuple[str, os.stat_result]],
+        disk_usage: bool = False,
+    ) -> None:
+        """Fold in one directory's files from the fd walker, without FileInfo.
+
+        Same result as calling `add()` for each file, but a full path (and a
+        FileInfo) is only built for files that enter the top-N list - for all
+        the others we never join a path string at all.
+        """
+
+        by_ext = self._by_ext
+        heap = self._heap
+        top_n = self.top_n
+        for name, st in records:
+            size = st.st_size
+            ext = file_extension(name)
+            key = ext or "<no_ext>"
+            self.total_bytes += size
+            self.file_count += 1
+            by_ext[key] += size
+            allocated: Optional[int] = None
+            if disk_usage:
+                allocated = allocated_size(st)
+                self.allocated_bytes += allocated
+                self._by_ext_allocated[key] += allocated
+            if top_n > 0 and (len(heap) < top_n or size > heap[0][0]):
+                info = FileInfo(
+                    path=os.path.join(directory.path(), name),
+                    size_bytes=size,
+                    extension=ext,
+                    allocated_bytes=allocated,
+                )
+                if len(heap) < top_n:
+                    heapq.heappush(heap, (size, -self.file_count, info))
+                else:
+                    heapq.heapreplace(heap, (size, -self.file_count, info))
+
+    def consume(self, files: Iterable[FileInfo]) -> "ScanAggregator":
+        """Add every file from an iterable; returns self for chaining."""
+
+        for info in files:
+            self.add(info)
+        return self
+
+    def add_subtotal(self, by_ext: Dict[str, int], file_count: int) -> None:
+        """Fold in pre-aggregated totals (e.g. from the scan cache).
+
+        Only valid when no per-file results are needed (`top_n == 0`); the
+        caller must replay individual files with `add()` otherwise.
+        """
+
+        for ext, size in by_ext.items():
+            self._by_ext[ext] += size
+            self.total_bytes += size
+        self.file_count += file_count
+
+    def merge(self, other: "ScanAggregator") -> "ScanAggregator":
+        """Fold in another aggregator's results (e.g. from another process).
+
+        The result is the same as if `other`'s files had been added after
+        ours: its sequence numbers are shifted past our file count, so ties
+        in the top-N list still go to the file that was seen first.
+        """
+
+        self.total_bytes += other.total_bytes
+        self.allocated_bytes += other.allocated_bytes
+        for ext, size in other._by_ext.items():
+            self._by_ext[ext] += size
+        for ext, size in other._by_ext_allocated.items():
+            self._by_ext_allocated[ext] += size
+        if self.top_n > 0:
+            offset = self.file_count
+            for size, neg_seq, info in other._heap:
+                item = (size, neg_seq - offset, info)
+                if len(self._heap) < self.top_n:
+                    heapq.heappush(self._heap, item)
+                elif item[:2] > self._heap[0][:2]:
+                    heapq.heapreplace(self._heap, item)
+        self.file_count += other.file_count
+        return self
+
+    def by_extension(self) -> Dict[str, int]:
+        """Per-extension totals (same shape as `summarize_by_extension`)."""
+
+        return dict(self._by_ext)
+
+    def by_extension_allocated(self) -> Dict[str, int]:
+        """Per-extension allocated bytes (disk-usage mode only)."""
+
+        return dict(self._by_ext_allocated)
+
+    def top_files(self) -> List[FileInfo]:
+        """The largest files seen so far, sorted descending by size."""
+
+        return [item[2] for item in sorted(self._heap, reverse=True)]
+
+
+# ------------------------------ Size Distribution ----------------------------
+
+
+class SizeSketch:
+    """Constant-memory summary of a stream of file sizes.
+
+    Two structures are filled at the same time:
+    - Power-of-two buckets: bucket k counts sizes in [2^(k-1), 2^k) (bucket 0
+      holds empty files). At most 65 buckets, whatever the number of files.
+    - A quantile sketch in the style of DDSketch: sizes are counted in
+      logarithmic buckets whose bounds grow by a factor `gamma`, chosen so
+      that any reported quantile is within `relative_accuracy` (1% by
+      default) of a real file size at that rank. Even a petabyte needs only
+      a few thousand buckets, so memory is bounded per extension.
+
+    Both are plain counters, so two sketches (from parallel workers or from
+    separate roots) merge by adding counts - the result is exactly the
+    sketch a single scan of all the files would have built.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01) -> None:
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.count = 0
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+        self.zeros = 0
+        self.pow2: Dict[int, int] = defaultdict(int)
+        self.log_buckets: Dict[int, int] = defaultdict(int)
+
+    def add(self, size: int) -> None:
+        """Count one file size."""
+
+        self.count += 1
+        self.total += size
+        if self.min is None or size < self.min:
+            self.min = size
+        if self.max is None or size > self.max:
+            self.max = size
+        self.pow2[size.bit_length()] += 1
+        if size == 0:
+            self.zeros += 1
+        else:
+            self.log_buckets[math.ceil(math.log(size) / self._log_gamma)] += 1
+
+    def merge(self, other: "SizeSketch") -> "SizeSketch":
+        """Add another sketch's counts into this one (same accuracy required)."""
+
+        if other.gamma != self.gamma:
+            raise ValueError("cannot merge sketches with different accuracy")
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        self.zeros += other.zeros
+        for key, value in other.pow2.items():
+            self.pow2[key] += value
+        for key, value in other.log_buckets.items():
+            self.log_buckets[key] += value
+        return self
+
+    def quantile(self, q: float) -> Optional[int]:
+        """Approximate size at quantile `q` (0.5 = median), None if empty."""
+
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0
+        for key in sorted(self.log_buckets):
+            seen += self.log_buckets[key]
+            if rank < seen:
+                # Bucket `key` holds sizes in (gamma^(key-1), gamma^key]; this
+                # point is within relative_accuracy of both ends
+                estimate = 2 * self.gamma ** key / (self.gamma + 1)
+                return max(self.min or 0, min(self.max or 0, round(estimate)))
+        return self.max
+
+    def as_dict(self) -> Dict[str, object]:
+        """JSON-friendly summary; buckets are keyed by their lower bound."""
+
+        return {
+            "count": self.count,
+            "total_bytes": self.total,
+            "min": self.min,
+            "max": self.max,
+            "mean": round(self.total / self.count, 2) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "pow2_buckets": {
+                str(1 << (k - 1) if k else 0): self.pow2[k] for k in sorted(self.pow2)
+            },
+        }
+
+
+class SizeHistogram:
+    """One SizeSketch per extension plus one for all files (--histogram).
+
+    `add` can be used directly as a scan listener; `merge` combines results
+    from several roots or worker processes.
+    """
+
+    ALL = "<all>"
+
+    def __init__(self) -> None:
+        self.sketches: Dict[str, SizeSketch] = {}
+
+    def _sketch(self, key: str) -> SizeSketch:
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = SizeSketch()
+        return sketch
+
+    def add(self, info: FileInfo) -> None:
+        """Count one file under its extension and under "<all>"."""
+
+        self._sketch(self.ALL).add(info.size_bytes)
+        self._sketch(info.extension or "<no_ext>").add(info.size_bytes)
+
+    def merge(self, other: "SizeHistogram") -> "SizeHistogram":
+        for key, sketch in other.sketches.items():
+            self._sketch(key).merge(sketch)
+        return self
+
+    def as_dict(self) -> Dict[str, Dict[str, object]]:
+        """Per-extension summaries, "<all>" first, then by file count."""
+
+        keys = sorted(
+            (key for key in self.sketches if key != self.ALL),
+            key=lambda key: self.sketches[key].count,
+            reverse=True,
+        )
+        if self.ALL in self.sketches:
+            keys.insert(0, self.ALL)
+        return {key: self.sketches[key].as_dict() for key in keys}
+
+    def lines(self) -> Iterator[str]:
+        """Human-readable table in bytes (MB would round most files to 0)."""
+
+        yield f"  {'extension':>10} {'files':>9} {'p50':>15} {'p90':>15} {'p99':>15} {'max':>15}"
+        rows = self.as_dict()
+        for key, row in rows.items():
+            cells = [
+                f"{row[name]:,}" if row[name] is not None else "-"
+                for name in ("p50", "p90", "p99", "max")
+            ]
+            yield f"  {key:>10} {row['count']:>9} " + " ".join(f"{cell:>15}" for cell in cells)
+        if self.ALL in rows:
+            yield ""
+            yield "  Files per size bucket (all extensions):"
+            for lower, count in rows[self.ALL]["pow2_buckets"].items():  # type: ignore[union-attr]
+                low = int(lower)
+                label = "0 bytes" if low == 0 else f"{low:,} - {2 * low - 1:,} bytes"
+                yield f"  {label:>34}: {count}"
+
+
+# ------------------------------ Directory Rollup -----------------------------
+
+
+# Deepest nesting --tree puts in JSON output. json.dumps recurses once or
+# twice per level, so much deeper trees would hit the recursion limit.
+TREE_JSON_MAX_LEVELS = 200
+
+
+class DirectoryRollup:
+    """du-style cumulative size of every directory, built during the scan.
+
+    How it works:
+    - While files stream past, each file's size is added to its directory's
+      "direct" total. Directories deeper than `max_depth` are folded into
+      their ancestor at `max_depth`, so memory grows with the number of
+      directories we report on - never with the number of files.
+    - `finish()` then makes ONE post-order pass: directories are visited from
+      the deepest level up, and each adds its cumulative total to its parent.
+      No second walk of the file system is needed.
+
+    Paths are stored relative to the scan root ("" is the root itself).
+    """
+
+    def __init__(self, root: Path, max_depth: Optional[int] = None) -> None:
+        self.root = str(root)
+        self.max_depth = max_depth
+        # relative dir -> [bytes, file count] for files directly inside it
+        self._direct: Dict[str, List[int]] = {}
+        # Files arrive grouped by directory, so cache the last lookup
+        self._last_dir: Optional[str] = None
+        self._last_node: List[int] = [0, 0]
+        self._prefix_len = len(self.root.rstrip(os.sep)) + 1
+        self.sizes: Dict[str, int] = {}
+        self.counts: Dict[str, int] = {}
+        self.children: Dict[str, List[str]] = {}
+
+    def _key_for(self, directory: str) -> str:
+        """Relative key for a directory, truncated to `max_depth` levels."""
+
+        if len(directory) < self._prefix_len:
+            return ""  # the root itself
+        rel = directory[self._prefix_len:]
+        if self.max_depth is not None:
+            if self.max_depth == 0:
+                return ""
+            parts = rel.split(os.sep, self.max_depth)
+            if len(parts) > self.max_depth:
+                rel = os.sep.join(parts[: self.max_depth])
+        return rel
+
+    def add(self, info: FileInfo) -> None:
+        """Attribute one file's size to its (possibly truncated) directory."""
+
+        directory = os.path.dirname(info.path)
+        if directory != self._last_dir:
+            key = self._key_for(directory)
+            node = self._direct.get(key)
+            if node is None:
+                node = self._direct[key] = [0, 0]
+            self._last_dir = directory
+            self._last_node = node
+        self._last_node[0] += info.size_bytes
+        self._last_node[1] += 1
+
+    @staticmethod
+    def _parent(key: str) -> str:
+        return key.rpartition(os.sep)[0]
+
+    @staticmethod
+    def _depth(key: str) -> int:
+        return key.count(os.sep) + 1 if key else 0
+
+    def finish(self) -> "DirectoryRollup":
+        """Roll direct totals up into cumulative totals (post-order pass)."""
+
+        sizes = {key: node[0] for key, node in self._direct.items()}
+        counts = {key: node[1] for key, node in self._direct.items()}
+        sizes.setdefault("", 0)
+        counts.setdefault("", 0)
+
+        # Bucket directories by depth; parents discovered on the way up are
+        # added to their (shallower) bucket before that bucket is processed.
+        by_depth: Dict[int, List[str]] = defaultdict(list)
+        for key in sizes:
+            by_depth[self._depth(key)].append(key)
+        children: Dict[str, List[str]] = defaultdict(list)
+        for depth in range(max(by_depth), 0, -1):
+            for key in by_depth.get(depth, []):
+                parent = self._parent(key)
+                if parent not in sizes:
+                    sizes[parent] = 0
+                    counts[parent] = 0
+                    by_depth[depth - 1].append(parent)
+                sizes[parent] += sizes[key]
+                counts[parent] += counts[key]
+                children[parent].append(key)
+
+        self.sizes = sizes
+        self.counts = counts
+        self.children = dict(children)
+        return self
+
+    def top_children(self, key: str, k: int) -> List[str]:
+        """The `k` largest subdirectories of `key` (largest first)."""
+
+        kids = self.children.get(key, [])
+        return heapq.nlargest(k, kids, key=lambda child: self.sizes[child])
+
+    def _node(self, key: str) -> Dict[str, object]:
+        return {
+            "path": key or ".",
+            "size_bytes": self.sizes[key],
+            "file_count": self.counts[key],
+            "children": [],
+        }
+
+    def as_dict(
+        self, top_k: int, key: str = "", max_levels: int = TREE_JSON_MAX_LEVELS
+    ) -> Dict[str, object]:
+        """Nested JSON-friendly tree starting at `key`.
+
+        Built with an explicit stack (no recursion), so very deep trees don't
+        hit Python's recursion limit. Nesting stops after `max_levels`
+        levels, because json.dumps recurses too: a directory at that level
+        keeps its cumulative totals, but its subdirectories are counted in
+        "children_omitted" and it is marked "depth_limited". (--max-depth or
+        --ndjson give every directory without nesting.)
+        """
+
+        root = self._node(key)
+        stack: List[Tuple[str, Dict[str, object], int]] = [(key, root, 0)]
+        while stack:
+            current, node, level = stack.pop()
+            kids = self.children.get(current, [])
+            if level < max_levels:
+                shown = self.top_children(current, top_k)
+            else:
+                shown = []
+                if kids:
+                    node["depth_limited"] = True
+            children: List[Dict[str, object]] = node["children"]  # type: ignore[assignment]
+            for child in shown:
+                child_node = self._node(child)
+                children.append(child_node)
+                stack.append((child, child_node, level + 1))
+            if len(kids) > len(shown):
+                node["children_omitted"] = len(kids) - len(shown)
+        return root
+
+    def records(self) -> Iterator[Dict[str, object]]:
+        """One flat record per directory (every directory, not just the top K).
+
+        Sorted by path, so each directory comes right before its subtree.
+        """
+
+        for key in sorted(self.sizes):
+            yield {
+                "type": "dir",
+                "path": key or ".",
+                "size_bytes": self.sizes[key],
+                "file_count": self.counts[key],
+            }
+
+    def lines(self, top_k: int) -> Iterator[str]:
+        """Indented text rendering, one directory per line."""
+
+        # Stack items are (directory key, level) or (None, hidden count, level)
+        # for the "... N more" line. The marker is pushed BEFORE the children,
+        # so it pops only after every shown child's subtree has been printed.
+        stack: List[Tuple] = [("", 0)]
+        while stack:
+            item = stack.pop()
+            if item[0] is None:
+                _, hidden, level = item
+                yield f"{'  ' * (level + 1)}{'':>12}  ... {hidden} more"
+                continue
+            key, level = item
+            name = os.path.basename(key) if key else "."
+            yield f"{'  ' * (level + 1)}{human_readable_size(self.sizes[key]):>12}  {name}"
+            shown = self.top_children(key, top_k)
+            hidden = len(self.children.get(key, [])) - len(shown)
+            if hidden > 0:
+                stack.append((None, hidden, level + 1))
+            stack.extend((child, level + 1) for child in reversed(shown))
+
+
+# ----------------------------- Duplicate Detection ----------------------------
+
+# Bytes read from each end of a file for the cheap "partial" hash
+PARTIAL_HASH_BLOCK = 64 * 1024
+# Read size for full-content hashing
+FULL_HASH_CHUNK = 1024 * 1024
+
+
+def _hash_file(job: Tuple[str, int, bool]) -> Tuple[str, Optional[str], int]:
+    """Hash one file for duplicate detection; runs inside worker processes.
+
+    `job` is (path, size, partial). A partial hash covers only the first and
+    last PARTIAL_HASH_BLOCK bytes; a full hash covers every byte. The size is
+    not hashed - files are only ever compared with others of the same size.
+    Returns (path, hex digest, bytes read); the digest is None if the file
+    could not be read, and it then simply drops out of its duplicate group.
+
+    This is a module-level function (not a method or lambda) because
+    multiprocessing has to pickle it to send it to the worker processes.
+    """
+
+    path, size, partial = job
+    digest = hashlib.blake2b(digest_size=16)
+    nread = 0
+    try:
+        with open(path, "rb") as handle:
+            if partial:
+                chunk = handle.read(PARTIAL_HASH_BLOCK)
+                nread += len(chunk)
+                digest.update(chunk)
+                if size > PARTIAL_HASH_BLOCK:
+                    # Jump to the tail (overlaps the head for mid-sized files)
+                    handle.seek(max(size - PARTIAL_HASH_BLOCK, PARTIAL_HASH_BLOCK))
+                    chunk = handle.read(PARTIAL_HASH_BLOCK)
+                    nread += len(chunk)
+                    digest.update(chunk)
+            else:
+                while True:
+                    chunk = handle.read(FULL_HASH_CHUNK)
+                    if not chunk:
+                        break
+                    nread += len(chunk)
+                    digest.update(chunk)
+    except OSError:
+        return path, None, nread
+    return path, digest.hexdigest(), nread
+
+
+@dataclass
+class DuplicateGroup:
+    """A set of files with identical content.
+
+    Attributes:
+        size_bytes: Size of each file in the group.
+        paths: The identical files, in the order they were found. Each one
+            is a different file on disk.
+        same_file: Other paths to a file in `paths` (hardlinks, or the same
+            file reached twice via --follow-symlinks). Deleting those frees
+            nothing, so they are listed here rather than counted.
+    """
+
+    size_bytes: int
+    paths: List[str]
+    same_file: Dict[str, List[str]] = field(default_factory=dict)
+
+    @property
+    def reclaimable_bytes(self) -> int:
+        """Space freed by keeping one copy and deleting the rest."""
+
+        return self.size_bytes * (len(self.paths) - 1)
+
+
+class DuplicateFinder:
+    """Find files with identical content, reading as few bytes as possible.
+
+    Files are checked in three stages; each stage only looks at files that are
+    still "possibly duplicate" after the previous one:
+      1) Same size. Free - we already know every size from the scan. A file
+         whose size is unique cannot have a duplicate and is never opened.
+      2) Same partial hash of the first and last 64 KiB. Cheap, and it rules
+         out most same-sized files (different headers or trailers). For files
+         that fit entirely in those two blocks this already is a full
+         comparison, so they skip stage 3.
+      3) Same full-content hash. Only for large files that survived stage 2.
+
+    Before stage 2, paths that are really the same file (same st_dev and
+    st_ino: hardlinks, or one file reached through two symlinked paths) are
+    collapsed to the first one seen. They are never hashed twice and never
+    counted as reclaimable; `DuplicateGroup.same_file` lists them instead.
+
+    Hashing is spread over a process pool (hashing is CPU work, so threads
+    would fight over the GIL). Empty files are ignored: deleting them frees
+    nothing.
+    """
+
+    def __init__(self, workers: int = 1) -> None:
+        self.workers = workers
+        # Every non-empty file, kept in compact columns until `find()`
+        self._files = FileStore(track_ids=True)
+        # Bytes actually read while hashing (useful to see the savings)
+        self.bytes_read = 0
+        # First path of a file -> its other paths (filled by _size_groups)
+        self._aliases: Dict[str, List[str]] = {}
+        self.same_file_paths = 0
+
+    def add(self, info: FileInfo) -> None:
+        """Record one file from the scan."""
+
+        if info.size_bytes > 0:
+            self._files.append(info)
+
+    def _size_groups(self) -> List[Tuple[int, List[str]]]:
+        """Stage 1: sizes shared by 2+ distinct files, with their paths.
+
+        Counting runs over the compact size column; full paths are only
+        rebuilt for files whose size is not unique. A path to a file we have
+        already seen becomes an alias of the first path instead.
+        """
+
+        files = self._files
+        counts = Counter(files.sizes)
+        groups: Dict[int, List[str]] = {}
+        first_path: Dict[Tuple[int, int], str] = {}
+        for index, size in enumerate(files.sizes):
+            if counts[size] < 2:
+                continue
+            path = files.path(index)
+            file_id = files.file_id(index)
+            if file_id is not None:
+                first = first_path.setdefault(file_id, path)
+                if first != path:
+                    self._aliases.setdefault(first, []).append(path)
+                    self.same_file_paths += 1
+                    continue
+            groups.setdefault(size, []).append(path)
+        return [(size, paths) for size, paths in groups.items() if len(paths) > 1]
+
+    def _hash_all(
+        self, jobs: List[Tuple[str, int, bool]], pool: Optional[ProcessPoolExecutor]
+    ) -> Iterator[Tuple[str, Optional[str], int]]:
+        """Run `_hash_file` over jobs, in the pool if we have one."""
+
+        if pool is None:
+            return map(_hash_file, jobs)
+        # Chunking keeps inter-process overhead low for many small files
+        chunksize = max(1, min(256, len(jobs) // (self.workers * 4) or 1))
+        return pool.map(_hash_file, jobs, chunksize=chunksize)
+
+    def _refine(
+        self,
+        groups: List[Tuple[int, List[str]]],
+        partial: bool,
+        pool: Optional[ProcessPoolExecutor],
+    ) -> List[Tuple[int, List[str]]]:
+        """Split each group by hash and keep only sub-groups with 2+ files."""
+
+        jobs = [(path, size, partial) for size, paths in groups for path in paths]
+        digests: Dict[str, Optional[str]] = {}
+        for path, digest, nread in self._hash_all(jobs, pool):
+            # Counted after the fact, so failed and short reads add what they read
+            self.bytes_read += nread
+            digests[path] = digest
+        refined: List[Tuple[int, List[str]]] = []
+        for size, paths in groups:
+            by_digest: Dict[str, List[str]] = defaultdict(list)
+            for path in paths:
+                digest = digests.get(path)
+                if digest is not None:
+                    by_digest[digest].append(path)
+            refined.extend((size, same) for same in by_digest.values() if len(same) > 1)
+        return refined
+
+    def find(self) -> List[DuplicateGroup]:
+        """Run stages 2 and 3; return groups sorted by reclaimable space."""
+
+        candidates = self._size_groups()
+        pool = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        try:
+            candidates = self._refine(candidates, partial=True, pool=pool)
+            small = [g for g in candidates if g[0] <= 2 * PARTIAL_HASH_BLOCK]
+            large = [g for g in candidates if g[0] > 2 * PARTIAL_HASH_BLOCK]
+            confirmed = small + self._refine(large, partial=False, pool=pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        groups = [
+            DuplicateGroup(
+                size_bytes=size,
+                paths=paths,
+                same_file={p: self._aliases[p] for p in paths if p in self._aliases},
+            )
+            for size, paths in confirmed
+        ]
+        groups.sort(key=lambda g: g.reclaimable_bytes, reverse=True)
+        return groups
+
+
+# -------------------------------- Line Counting -------------------------------
+
+# Read size for line counting (one reusable buffer per batch)
+LINE_COUNT_CHUNK = 256 * 1024
+# A NUL byte in this many leading bytes marks a file as binary (like git)
+BINARY_SNIFF_BYTES = 8 * 1024
+# With a process pool, files larger than this are counted in ranges of this
+# size by several workers at once
+LINE_SPLIT_BYTES = 64 * 1024 * 1024
+# A batch (one task for a worker process) closes at this many files or bytes
+LINE_BATCH_FILES = 256
+LINE_BATCH_BYTES = 16 * 1024 * 1024
+
+# One piece of counting work: (path, extension, start, length, whole_file)
+LineJob = Tuple[str, str, int, int, bool]
+
+
+def _count_newlines(path: str, start: int, length: int, whole: bool, buffer: bytearray) -> Tuple[Optional[int], int]:
+    """Count b"\\n" bytes in `length` bytes of a file from offset `start`.
+
+    Returns (lines, bytes read). For a whole file (`whole=True`), a binary
+    file (NUL byte near the start) gives lines=None, and a last line without
+    a trailing newline is counted too - so "a\\nb" has 2 lines, "" has 0.
+
+    Why raw bytes?
+    - Text mode would decode every byte and build a str per line. Counting
+      one byte value in a bytes buffer runs in C over the whole chunk, and
+      readinto() refills the same buffer, so nothing is allocated per chunk.
+    - `length` is the size seen by the scan, so we stop without an extra
+      read() to discover the end of the file (one fewer system call per
+      small file).
+    """
+
+    view = memoryview(buffer)
+    lines = done = 0
+    last = b"\n"[0]
+    with open(path, "rb", buffering=0) as handle:
+        if start:
+            handle.seek(start)
+        while done < length:
+            n = handle.readinto(view[: min(len(buffer), length - done)])
+            if not n:
+                break  # the file shrank since the scan
+            if whole and done == 0 and buffer.find(b"\0", 0, min(n, BINARY_SNIFF_BYTES)) >= 0:
+                return None, n
+            lines += buffer.count(b"\n", 0, n)
+            last = buffer[n - 1]
+            done += n
+    if whole and last != b"\n"[0]:
+        lines += 1
+    return lines, done
+
+
+def _count_lines_batch(jobs: List[LineJob]) -> Tuple[Dict[str, int], int, int, int, int]:
+    """Count lines for a batch of jobs; runs inside worker processes.
+
+    Returns (lines per extension, text files, binary files skipped, bytes
+    read, read errors); ranges of a split file don't count as text files.
+    Like `_hash_file`, it is module-level so it can be pickled.
+    """
+
+    buffer = bytearray(LINE_COUNT_CHUNK)
+    lines_by_ext: Dict[str, int] = defaultdict(int)
+    text = binary = bytes_read = errors = 0
+    for path, ext, start, length, whole in jobs:
+        try:
+            lines, done = _count_newlines(path, start, length, whole, buffer)
+        except OSError:
+            errors += 1
+            continue
+        bytes_read += done
+        if lines is None:
+            binary += 1
+        else:
+            lines_by_ext[ext or "<no_ext>"] += lines
+            text += whole
+    return dict(lines_by_ext), text, binary, bytes_read, errors
+
+
+class LineCounter:
+    """Count lines of text per extension (the --lines report).
+
+    Files are recorded during the scan (compactly, in a FileStore) and read
+    afterwards by `count()`:
+    - Binary files are skipped: a NUL byte in the first 8 KiB marks a file
+      as binary, the same rule git uses. Empty files are never opened.
+    - Work goes to a process pool in batches of up to 256 files or 16 MiB,
+      so small files don't pay one inter-process round trip each, and a
+      bounded number of batches is in flight at a time.
+    - Counting newlines is CPU work (roughly 0.5 GB/s per core), so one core
+      cannot keep up with a fast disk. With a pool, files over 64 MiB are
+      split into ranges that several workers count at once.
+    """
+
+    def __init__(self, workers: int = 1) -> None:
+        self.workers = workers
+        self._files = FileStore()
+        self._lines_by_ext: Dict[str, int] = defaultdict(int)
+        self.text_files = 0
+        self.binary_files = 0
+        self.bytes_read = 0
+        self.errors = 0
+
+    def add(self, info: FileInfo) -> None:
+        """Record one file from the scan."""
+
+        if info.size_bytes > 0:
+            self._files.append(info)
+        else:
+            self.text_files += 1  # empty: zero lines, nothing to read
+
+    @property
+    def total_lines(self) -> int:
+        return sum(self._lines_by_ext.values())
+
+    def by_extension(self) -> Dict[str, int]:
+        """Lines per extension (keys match `ScanAggregator.by_extension`)."""
+
+        return dict(self._lines_by_ext)
+
+    def _split(self, path: str, ext: str, size: int) -> Iterator[LineJob]:
+        """Range jobs for one large file; sniffing and the last byte are
+        handled here so each range is a plain newline count."""
+
+        try:
+            with open(path, "rb") as handle:
+                head = handle.read(BINARY_SNIFF_BYTES)
+                handle.seek(size - 1)
+                tail = handle.read(1)
+        except OSError:
+            self.errors += 1
+            return
+        if b"\0" in head:
+            self.binary_files += 1
+            return
+        self.text_files += 1
+        if tail != b"\n":
+            self._lines_by_ext[ext or "<no_ext>"] += 1
+        for start in range(0, size, LINE_SPLIT_BYTES):
+            yield (path, ext, start, min(LINE_SPLIT_BYTES, size - start), False)
+
+    def _batches(self, split: bool) -> Iterator[List[LineJob]]:
+        files = self._files
+        batch: List[LineJob] = []
+        batch_bytes = 0
+        for index, size in enumerate(files.sizes):
+            path = files.path(index)
+            ext = files.extensions[files.ext_codes[index]]
+            if split and size > LINE_SPLIT_BYTES:
+                for job in self._split(path, ext, size):
+                    yield [job]
+                continue
+            batch.append((path, ext, 0, size, True))
+            batch_bytes += size
+            if len(batch) >= LINE_BATCH_FILES or batch_bytes >= LINE_BATCH_BYTES:
+                yield batch
+                batch, batch_bytes = [], 0
+        if batch:
+            yield batch
+
+    def _merge(self, result: Tuple[Dict[str, int], int, int, int, int]) -> None:
+        lines_by_ext, text, binary, bytes_read, errors = result
+        for ext, lines in lines_by_ext.items():
+            self._lines_by_ext[ext] += lines
+        self.text_files += text
+        self.binary_files += binary
+        self.bytes_read += bytes_read
+        self.errors += errors
+
+    def count(self) -> "LineCounter":
+        """Read every recorded file and count its lines."""
+
+        if self.workers <= 1:
+            for jobs in self._batches(split=False):
+                self._merge(_count_lines_batch(jobs))
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                running: Set[Future] = set()
+                for jobs in self._batches(split=True):
+                    if len(running) >= self.workers * 4:
+                        done, running = wait(running, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self._merge(future.result())
+                    running.add(pool.submit(_count_lines_batch, jobs))
+                for future in running:
+                    self._merge(future.result())
+        self._files = FileStore()  # counted; free the records
+        return self
+
+
+# ------------------------------ Multi-Root Scans -----------------------------
+
+
+@dataclass
+class RootScanJob:
+    """Everything a worker process needs to scan one root (must be picklable)."""
+
+    root: str
+    excluded_dirs: Set[str]
+    include_hidden: bool
+    follow_symlinks: bool
+    workers: int
+    one_file_system: bool
+    exclude_glob: List[str]
+    respect_gitignore: bool
+    top_n: int
+    backend: str = "scandir"
+    histogram: bool = False
+
+
+@dataclass
+class RootScanResult:
+    """One root's partial results, sent back from its worker process."""
+
+    root: str
+    aggregator: ScanAggregator
+    cycles_skipped: int = 0
+    duplicates_skipped: int = 0
+    histogram: Optional[SizeHistogram] = None
+
+
+def _scan_root(job: RootScanJob) -> RootScanResult:
+    """Scan one root (runs in a worker process; module-level so it pickles)."""
+
+    visited = VisitedDirectories() if job.follow_symlinks else None
+    ignore = IgnoreState.for_root(job.exclude_glob, job.respect_gitignore)
+    histogram = SizeHistogram() if job.histogram else None
+    if job.backend == "fd":
+        aggregator = ScanAggregator(top_n=job.top_n)
+        for directory, records in iter_directory_stats_fd(
+            Path(job.root),
+            job.excluded_dirs,
+            job.include_hidden,
+            job.follow_symlinks,
+            visited=visited,
+            ignore=ignore,
+            one_file_system=job.one_file_system,
+        ):
+            aggregator.add_directory(directory, records)
+            if histogram is not None:
+                for name, st in records:
+                    histogram.add(FileInfo("", st.st_size, file_extension(name)))
+        return RootScanResult(
+            root=job.root,
+            aggregator=aggregator,
+            cycles_skipped=visited.cycles_skipped if visited else 0,
+            duplicates_skipped=visited.duplicates_skipped if visited else 0,
+            histogram=histogram,
+        )
+    entries = iter_file_entries(
+        root=Path(job.root),
+        excluded_dirs=job.excluded_dirs,
+        include_hidden=job.include_hidden,
+        follow_symlinks=job.follow_symlinks,
+        workers=job.workers,
+        visited=visited,
+        ignore=ignore,
+        one_file_system=job.one_file_system,
+    )
+    aggregator = ScanAggregator(top_n=job.top_n)
+    for info in collect_file_info(entries):
+        aggregator.add(info)
+        if histogram is not None:
+            histogram.add(info)
+    return RootScanResult(
+        root=job.root,
+        aggregator=aggregator,
+        cycles_skipped=visited.cycles_skipped if visited else 0,
+        duplicates_skipped=visited.duplicates_skipped if visited else 0,
+        histogram=histogram,
+    )
+
+
+def scan_roots(jobs: List[RootScanJob], device_workers: int = 1) -> List[RootScanResult]:
+    """Scan several roots concurrently, one worker process per root.
+
+    Why processes?
+    - Each root is an independent walk, so separate processes share nothing
+      and use several CPU cores (threads would share one GIL).
+
+    Why per-device limits?
+    - Roots on the same device (disk, NFS export) compete for the same I/O,
+      and a slow mount would otherwise tie up every worker. At most
+      `device_workers` roots per device run at once, and the pool has exactly
+      enough processes for every device's share, so a slow device only ever
+      delays its own queue.
+
+    Results are returned in the order of `jobs`, whatever order they finish in.
+    """
+
+    queues: Dict[int, List[int]] = defaultdict(list)
+    for index, job in enumerate(jobs):
+        queues[os.stat(job.root).st_dev].append(index)
+    slots = sum(min(len(queue), device_workers) for queue in queues.values())
+
+    results: Dict[int, RootScanResult] = {}
+    with ProcessPoolExecutor(max_workers=max(slots, 1)) as pool:
+        running: Dict["Future[RootScanResult]", Tuple[int, int]] = {}
+
+        def start_next(device: int) -> None:
+            queue = queues[device]
+            if queue:
+                index = queue.pop(0)
+                running[pool.submit(_scan_root, jobs[index])] = (index, device)
+
+        for device, queue in list(queues.items()):
+            for _ in range(min(len(queue), device_workers)):
+                start_next(device)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, device = running.pop(future)
+                results[index] = future.result()
+                start_next(device)
+    return [results[index] for index in range(len(jobs))]
+
+
+# --------------------------------- Scan Cache --------------------------------
+
+
+class ScanCache:
+    """On-disk index of a previous scan, used to skip unchanged directories.
+
+    How it works:
+    - Adding, removing or renaming an entry inside a directory updates that
+      directory's modification time (mtime). So if a directory's mtime is the
+      same as last time, its list of files and subdirectories is too.
+    - For every directory we store its mtime, the names of the subdirectories
+      we descended into, its per-extension subtotals and its files (name,
+      size, device and inode). A rescan stats every directory once, but only
+      lists (os.scandir) and stats the files of directories whose mtime
+      changed; unchanged ones just add their stored subtotals (or, when each
+      file is needed, e.g. for --top, replay the stored rows).
+    - Cached directories are replayed in the same order as a live scan, so
+      totals, extension order and top-N ties match a full scan exactly.
+
+    Limitations (worth knowing!):
+    - Rewriting a file in place (e.g. appending to a log) changes the file's
+      size but NOT its directory's mtime, so the cache keeps the old size.
+      With `verify=True` (--cache-verify) every cached file is stat'ed again
+      and changed sizes are written back: no directory is listed, but each
+      file costs a stat, so most of the speedup is gone.
+    - Directories modified within the last couple of seconds are never trusted
+      from the cache, because a change in the same clock tick could otherwise
+      go unnoticed (the "racy timestamp" problem).
+
+    Why SQLite? It ships with Python, gives us indexed lookups per directory
+    without loading the whole index into memory, and updates atomically.
+    """
+
+    SCHEMA_VERSION = "2"
+    # Directories modified this recently are rescanned rather than trusted
+    RACY_WINDOW_NS = 2_000_000_000
+
+    def __init__(self, db_path: Path, settings: Dict[str, object], verify: bool = False) -> None:
+        self.db_path = db_path
+        self.verify = verify
+        self.conn = sqlite3.connect(str(db_path))
+        self.dirs_reused = 0
+        self.dirs_rescanned = 0
+        self._prepare(json.dumps(settings, sort_keys=True))
+
+    def _prepare(self, fingerprint: str) -> None:
+        """Create tables, wiping the cache if it was built with other settings."""
+
+        conn = self.conn
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        stored = dict(conn.execute("SELECT key, value FROM meta"))
+        if stored.get("schema") != self.SCHEMA_VERSION or stored.get("settings") != fingerprint:
+            # Different root/excludes/flags mean different results: start over
+            conn.execute("DROP TABLE IF EXISTS dirs")
+            conn.execute("DROP TABLE IF EXISTS files")
+            conn.execute("DELETE FROM meta")
+            conn.executemany(
+                "INSERT INTO meta (key, value) VALUES (?, ?)",
+                [("schema", self.SCHEMA_VERSION), ("settings", fingerprint)],
+            )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS dirs ("
+            " id INTEGER PRIMARY KEY,"
+            " path TEXT UNIQUE NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " subdirs TEXT NOT NULL,"    # JSON list of subdirectory names
+            " by_ext TEXT NOT NULL,"     # JSON object: extension -> bytes
+            " file_count INTEGER NOT NULL,"
+            " run INTEGER NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " dir_id INTEGER NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " name TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " device INTEGER,"
+            " inode INTEGER,"
+            " PRIMARY KEY (dir_id, seq)) WITHOUT ROWID"
+        )
+        conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "ScanCache":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def scan(
+        self,
+        root: Path,
+        excluded_dirs: Set[str],
+        include_hidden: bool,
+        follow_symlinks: bool,
+        aggregator: ScanAggregator,
+        listeners: Iterable[Callable[[FileInfo], None]] = (),
+        visited: Optional[VisitedDirectories] = None,
+        stats: Optional[ScanStats] = None,
+        one_file_system: bool = False,
+        on_directory: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """Walk `root` like `iter_file_entries`, feeding `aggregator`.
+
+        Unchanged directories are answered from the cache; changed ones are
+        scanned and written back. Directories that no longer exist are removed
+        from the cache at the end. Every file is also passed to each callable
+        in `listeners` (e.g. `DuplicateFinder.add`). With `follow_symlinks`,
+        cycles and duplicate directories are skipped exactly like the live
+        walker does. `stats` counts listings only for the directories that
+        were rescanned, but counts every stat call. `on_directory()` is called
+        after each directory's files, as in `iter_file_entries`.
+        """
+
+        conn = self.conn
+        listeners = list(listeners)
+        need_files = aggregator.top_n > 0 or bool(listeners)
+        run = int(conn.execute("SELECT COALESCE(MAX(run), 0) + 1 FROM dirs").fetchone()[0])
+        racy_after = time.time_ns() - self.RACY_WINDOW_NS
+
+        guard: Optional[VisitedDirectories] = None
+        if follow_symlinks:
+            guard = visited if visited is not None else VisitedDirectories()
+        device = os.stat(root).st_dev if one_file_system else None
+        if stats is not None and one_file_system:
+            stats.record_stat_calls(1)
+
+        stack: List[Tuple[Path, Ancestry]] = [(root, None)]
+        with conn:  # one transaction for the whole scan (much faster)
+            while stack:
+                current, ancestry = stack.pop()
+                current_str = str(current)
+                if stats is not None:
+                    stats.record_stat_calls(1)
+                try:
+                    st = os.stat(current)
+                except (PermissionError, FileNotFoundError, OSError):
+                    continue
+                mtime_ns = st.st_mtime_ns
+                if guard is not None:
+                    ancestry = guard.enter((st.st_dev << 64) | st.st_ino, ancestry)
+                    if ancestry is None:
+                        continue
+
+                row = conn.execute(
+                    "SELECT id, mtime_ns, subdirs, by_ext, file_count FROM dirs WHERE path = ?",
+                    (current_str,),
+                ).fetchone()
+
+                if row is not None and row[1] == mtime_ns:
+                    # Unchanged directory: replay it from the cache
+                    dir_id = row[0]
+                    self.dirs_reused += 1
+                    if self.verify:
+                        # Stat each file again: an in-place edit changes its
+                        # size without touching the directory's mtime
+                        infos, by_ext = self._restat_files(conn, dir_id, current_str, run, stats)
+                        if need_files:
+                            self._replay(infos, aggregator, listeners)
+                        else:
+                            aggregator.add_subtotal(by_ext, len(infos))
+                    else:
+                        conn.execute("UPDATE dirs SET run = ? WHERE id = ?", (run, dir_id))
+                        if need_files:
+                            infos = [
+                                FileInfo(
+                                    os.path.join(current_str, name), size, file_extension(name),
+                                    device=device_id, inode=inode,
+                                )
+                                for name, size, device_id, inode in conn.execute(
+                                    "SELECT name, size, device, inode FROM files"
+                                    " WHERE dir_id = ? ORDER BY seq",
+                                    (dir_id,),
+                                )
+                            ]
+                            self._replay(infos, aggregator, listeners)
+                        else:
+                            aggregator.add_subtotal(json.loads(row[3]), row[4])
+                    subdir_names = json.loads(row[2])
+                else:
+                    # New or changed directory: scan it for real
+                    self.dirs_rescanned += 1
+                    entries, subdirs, _ = _scan_directory(
+                        current, excluded_dirs, include_hidden, follow_symlinks,
+                        stats=stats, device=device,
+                    )
+                    infos = list(collect_file_info(entries, stats=stats))
+                    subdir_names = [sub.name for sub in subdirs]
+                    by_ext = {}
+                    for info in infos:
+                        key = info.extension or "<no_ext>"
+                        by_ext[key] = by_ext.get(key, 0) + info.size_bytes
+                        aggregator.add(info)
+                        for listener in listeners:
+                            listener(info)
+
+                    # A directory changed "just now" may change again within the
+                    # same timestamp tick; store an impossible mtime so the next
+                    # run rescans it instead of trusting it.
+                    stored_mtime = mtime_ns if mtime_ns < racy_after else -1
+                    if row is None:
+                        dir_id = conn.execute(
+                            "INSERT INTO dirs (path, mtime_ns, subdirs, by_ext, file_count, run)"
+                            " VALUES (?, ?, ?, ?, ?, ?)",
+                            (current_str, stored_mtime, json.dumps(subdir_names),
+                             json.dumps(by_ext), len(infos), run),
+                        ).lastrowid
+                    else:
+                        dir_id = row[0]
+                        conn.execute(
+                            "UPDATE dirs SET mtime_ns = ?, subdirs = ?, by_ext = ?,"
+                            " file_count = ?, run = ? WHERE id = ?",
+                            (stored_mtime, json.dumps(subdir_names), json.dumps(by_ext),
+                             len(infos), run, dir_id),
+                        )
+                        conn.execute("DELETE FROM files WHERE dir_id = ?", (dir_id,))
+                    conn.executemany(
+                        "INSERT INTO files (dir_id, seq, name, size, device, inode)"
+                        " VALUES (?, ?, ?, ?, ?, ?)",
+                        [
+                            (dir_id, seq, os.path.basename(info.path), info.size_bytes,
+                             info.device, info.inode)
+                            for seq, info in enumerate(infos)
+                        ],
+                    )
+
+                if on_directory is not None:
+                    on_directory()
+                # Same push order as the live walker, so output order matches
+                stack.extend(
+                    (Path(os.path.join(current_str, name)), ancestry) for name in subdir_names
+                )
+
+            # Forget directories that were not reached this time (deleted,
+            # newly excluded, or now unreadable)
+            conn.execute(
+                "DELETE FROM files WHERE dir_id IN (SELECT id FROM dirs WHERE run != ?)",
+                (run,),
+            )
+            conn.execute("DELETE FROM dirs WHERE run != ?", (run,))
+
+    @staticmethod
+    def _replay(
+        infos: List[FileInfo],
+        aggregator: ScanAggregator,
+        listeners: List[Callable[[FileInfo], None]],
+    ) -> None:
+        for info in infos:
+            aggregator.add(info)
+            for listener in listeners:
+                listener(info)
+
+    @staticmethod
+    def _restat_files(
+        conn: sqlite3.Connection,
+        dir_id: int,
+        current_str: str,
+        run: int,
+        stats: Optional[ScanStats],
+    ) -> Tuple[List[FileInfo], Dict[str, int]]:
+        """Stat the cached files of an unchanged directory again (--cache-verify).
+
+        Returns the fresh FileInfo list (in cached order) and its per-extension
+        subtotals. Rows whose size (or device/inode) differ are written back,
+        so the next run starts from the new sizes; a file that can no longer
+        be stat'ed is dropped, just like the live walker skips it.
+        """
+
+        infos: List[FileInfo] = []
+        by_ext: Dict[str, int] = {}
+        updates: List[Tuple[int, int, int, int, int]] = []
+        removed: List[Tuple[int, int]] = []
+        rows = conn.execute(
+            "SELECT seq, name, size, device, inode FROM files WHERE dir_id = ? ORDER BY seq",
+            (dir_id,),
+        ).fetchall()
+        for seq, name, size, device, inode in rows:
+            path = os.path.join(current_str, name)
+            try:
+                # Follows symlinks, like DirEntry.stat() in collect_file_info
+                st = os.stat(path)
+            except OSError as exc:
+                if stats is not None:
+                    stats.record_error("stat", exc)
+                removed.append((dir_id, seq))
+                continue
+            if (st.st_size, st.st_dev, st.st_ino) != (size, device, inode):
+                updates.append((st.st_size, st.st_dev, st.st_ino, dir_id, seq))
+            info = FileInfo(path, st.st_size, file_extension(name), device=st.st_dev, inode=st.st_ino)
+            infos.append(info)
+            key = info.extension or "<no_ext>"
+            by_ext[key] = by_ext.get(key, 0) + info.size_bytes
+        if stats is not None:
+            stats.record_stat_calls(len(rows))
+        if updates:
+            conn.executemany(
+                "UPDATE files SET size = ?, device = ?, inode = ? WHERE dir_id = ? AND seq = ?",
+                updates,
+            )
+        if removed:
+            conn.executemany("DELETE FROM files WHERE dir_id = ? AND seq = ?", removed)
+        if updates or removed:
+            conn.execute(
+                "UPDATE dirs SET by_ext = ?, file_count = ?, run = ? WHERE id = ?",
+                (json.dumps(by_ext), len(infos), run, dir_id),
+            )
+        else:
+            conn.execute("UPDATE dirs SET run = ? WHERE id = ?", (run, dir_id))
+        return infos, by_ext
+
+
+# --------------------------------- Watch Mode --------------------------------
+
+
+class WatchIndex:
+    """In-memory file index that can be updated one path at a time.
+
+    A one-off scan only needs running totals, but watch mode must be able to
+    *undo* a file's contribution when it shrinks or disappears, so here we do
+    keep one small record per file: directory -> {name: (size, extension)}.
+    Totals and per-extension buckets are adjusted by the difference whenever a
+    single entry is re-stat'ed, so an update costs O(1), not a rescan.
+
+    The traversal rules (hidden names, excluded directories, ignore patterns,
+    symlinks) are the same as for a normal scan.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        excluded_dirs: Set[str],
+        include_hidden: bool,
+        follow_symlinks: bool,
+        ignore: Optional[IgnoreState] = None,
+        on_dir_added: Callable[[str], None] = lambda path: None,
+        on_dir_removed: Callable[[str], None] = lambda path: None,
+        one_file_system: bool = False,
+    ) -> None:
+        self.root = str(root)
+        self.excluded_dirs = excluded_dirs
+        self.include_hidden = include_hidden
+        self.follow_symlinks = follow_symlinks
+        self.device = os.stat(root).st_dev if one_file_system else None
+        self.root_ignore = ignore
+        self.on_dir_added = on_dir_added
+        self.on_dir_removed = on_dir_removed
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget everything (used before a full resync)."""
+
+        self.files: Dict[str, Dict[str, Tuple[int, str]]] = {}
+        # directory -> IgnoreState for its contents (None without patterns)
+        self.dirs: Dict[str, Optional[IgnoreState]] = {}
+        # directory -> (device, inode) identity, only when following symlinks
+        self._identities: Dict[str, int] = {}
+        self.total_bytes = 0
+        self.file_count = 0
+        self.by_ext: Dict[str, int] = defaultdict(int)
+        self.visited = VisitedDirectories() if self.follow_symlinks else None
+
+    # -- bookkeeping helpers --------------------------------------------------
+
+    def _set_file(self, directory: str, name: str, size: int) -> None:
+        bucket = self.files.setdefault(directory, {})
+        old = bucket.get(name)
+        key = file_extension(name) or "<no_ext>"
+        if old is not None:
+            self.total_bytes -= old[0]
+            self.by_ext[key] -= old[0]
+        else:
+            self.file_count += 1
+        bucket[name] = (size, key)
+        self.total_bytes += size
+        self.by_ext[key] += size
+
+    def _drop_file(self, directory: str, name: str) -> None:
+        bucket = self.files.get(directory)
+        if not bucket or name not in bucket:
+            return
+        size, key = bucket.pop(name)
+        self.total_bytes -= size
+        self.file_count -= 1
+        self.by_ext[key] -= size
+        if not self.by_ext[key]:
+            del self.by_ext[key]
+
+    # -- scanning ---------------------------------------------------------------
+
+    def scan_tree(self, top: str, state: Optional[IgnoreState]) -> None:
+        """Walk `top` (a new or resynced directory) and index everything in it."""
+
+        stack: List[Tuple[str, Optional[IgnoreState]]] = [(top, state)]
+        while stack:
+            current, current_state = stack.pop()
+            if self.visited is not None:
+                identity = VisitedDirectories.identity(current)
+                if identity is None or self.visited.enter(identity, None) is None:
+                    continue
+                self._identities[current] = identity
+            # Watch BEFORE listing, so nothing created in between is missed
+            self.on_dir_added(current)
+            entries, subdirs, inner = _scan_directory(
+                Path(current),
+                self.excluded_dirs,
+                self.include_hidden,
+                self.follow_symlinks,
+                current_state,
+                device=self.device,
+            )
+            self.dirs[current] = inner
+            for entry in entries:
+                try:
+                    self._set_file(current, entry.name, entry.stat().st_size)
+                except OSError:
+                    continue
+            for sub in subdirs:
+                stack.append((str(sub), inner.child(sub.name) if inner is not None else None))
+
+    def remove_tree(self, top: str) -> None:
+        """Drop a directory and everything indexed below it."""
+
+        prefix = top + os.sep
+        for directory in [d for d in self.dirs if d == top or d.startswith(prefix)]:
+            for name in list(self.files.get(directory, {})):
+                self._drop_file(directory, name)
+            self.files.pop(directory, None)
+            del self.dirs[directory]
+            identity = self._identities.pop(directory, None)
+            if identity is not None and self.visited is not None:
+                # It may be walked again (e.g. via another symlink) later
+                self.visited.release(identity)
+            self.on_dir_removed(directory)
+
+    def refresh_entry(self, directory: str, name: str) -> None:
+        """Re-stat ONE changed entry of a watched directory and fix the totals."""
+
+        if directory not in self.dirs:
+            return
+        state = self.dirs[directory]
+        path = os.path.join(directory, name)
+
+        if name == ".gitignore" and state is not None and state.respect_gitignore:
+            # The rules for this whole subtree changed: re-index it
+            parent_state = self._state_for_rescan(directory)
+            self.remove_tree(directory)
+            self.scan_tree(directory, parent_state)
+            return
+
+        if not self.include_hidden and name.startswith("."):
+            return
+        try:
+            st = os.stat(path) if self.follow_symlinks else os.lstat(path)
+        except OSError:
+            st = None
+
+        if st is not None and stat.S_ISDIR(st.st_mode):
+            self._drop_file(directory, name)
+            if path in self.dirs:
+                return  # already watched; its own events keep it current
+            if name in self.excluded_dirs or (state is not None and state.is_ignored(name, True)):
+                return
+            if self.device is not None and st.st_dev != self.device:
+                return  # a new mount point (--one-file-system)
+            self.scan_tree(path, state.child(name) if state is not None else None)
+            return
+
+        if path in self.dirs:
+            # It used to be a directory (deleted, moved away or replaced)
+            self.remove_tree(path)
+        if st is not None and stat.S_ISREG(st.st_mode):
+            if state is not None and state.is_ignored(name, False):
+                self._drop_file(directory, name)
+            else:
+                self._set_file(directory, name, st.st_size)
+        else:
+            self._drop_file(directory, name)
+
+    def _state_for_rescan(self, directory: str) -> Optional[IgnoreState]:
+        """IgnoreState to pass to scan_tree() when re-indexing `directory`."""
+
+        if directory == self.root:
+            return self.root_ignore
+        parent, _, name = directory.rpartition(os.sep)
+        parent_state = self.dirs.get(parent)
+        return parent_state.child(name) if parent_state is not None else None
+
+    def rescan_dir(self, directory: str) -> None:
+        """Re-list one directory and refresh every entry that may have changed."""
+
+        try:
+            names = set(os.listdir(directory))
+        except OSError:
+            names = set()
+        names |= set(self.files.get(directory, {}))
+        prefix = directory + os.sep
+        names |= {
+            d[len(prefix):] for d in self.dirs if d.startswith(prefix) and os.sep not in d[len(prefix):]
+        }
+        for name in names:
+            self.refresh_entry(directory, name)
+
+    # -- reporting ------------------------------------------------------------
+
+    def snapshot(self, top_n: int, by_ext: bool) -> Dict[str, object]:
+        """Current totals in the same shape as the --json output."""
+
+        output: Dict[str, object] = {
+            "timestamp": time.time(),
+            "path": self.root,
+            "total_size_bytes": self.total_bytes,
+            "total_size_human": human_readable_size(self.total_bytes),
+            "file_count": self.file_count,
+        }
+        if by_ext:
+            output["by_extension_bytes"] = dict(
+                sorted(self.by_ext.items(), key=lambda kv: kv[1], reverse=True)
+            )
+        if top_n > 0:
+            largest = heapq.nlargest(
+                top_n,
+                (
+                    (size, directory, name, key)
+                    for directory, bucket in self.files.items()
+                    for name, (size, key) in bucket.items()
+                ),
+                key=lambda item: item[0],
+            )
+            output["top_files"] = [
+                {
+                    "path": os.path.join(directory, name),
+                    "size_bytes": size,
+                    "size_human": human_readable_size(size),
+                    "extension": "" if key == "<no_ext>" else key,
+                }
+                for size, directory, name, key in largest
+            ]
+        return output
+
+
+# Marker returned by watchers when the event stream can't be trusted any more
+RESYNC = ("", "")
+
+
+class InotifyWatcher:
+    """Linux inotify, used through ctypes (no third-party packages needed).
+
+    The kernel tells us which names changed in which watched directory, so
+    after the initial scan we only ever re-stat those paths. Between events
+    the process sleeps in select(), so a quiet tree costs no CPU at all.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_EXCL_UNLINK = 0x04000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    WATCH_MASK = (
+        IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+        | IN_CREATE | IN_DELETE | IN_ONLYDIR | IN_EXCL_UNLINK
+    )
+    _EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+    def __init__(self) -> None:
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.fd = fd
+        self._wd_to_dir: Dict[int, str] = {}
+        self._dir_to_wd: Dict[str, int] = {}
+
+    def add(self, directory: str) -> None:
+        """Start watching `directory`.
+
+        A directory that was removed (ENOENT) or replaced by a file (ENOTDIR)
+        before we got to it is skipped: its parent's event already tells the
+        index about that change. Other errors - above all ENOSPC, the
+        per-user watch limit - are raised for the caller to handle.
+        """
+
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), self.WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(err, f"inotify_add_watch({directory}): {os.strerror(err)}")
+        self._wd_to_dir[wd] = directory
+        self._dir_to_wd[directory] = wd
+
+    def remove(self, directory: str) -> None:
+        wd = self._dir_to_wd.pop(directory, None)
+        if wd is not None:
+            self._wd_to_dir.pop(wd, None)
+            self._libc.inotify_rm_watch(self.fd, wd)  # may already be gone
+
+    def wait(self, timeout: float) -> Set[Tuple[str, str]]:
+        """Block up to `timeout` seconds; return the (directory, name) pairs
+        that changed (duplicates coalesced), or {RESYNC} after an overflow."""
+
+        changed: Set[Tuple[str, str]] = set()
+        ready, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        while ready:
+            try:
+                data = os.read(self.fd, 256 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            header = self._EVENT_HEADER
+            while offset + header.size <= len(data):
+                wd, mask, _cookie, length = header.unpack_from(data, offset)
+                offset += header.size
+                raw_name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if mask & self.IN_Q_OVERFLOW:
+                    return {RESYNC}
+                if mask & self.IN_IGNORED:
+                    continue
+                directory = self._wd_to_dir.get(wd)
+                if directory is not None and raw_name:
+                    changed.add((directory, os.fsdecode(raw_name)))
+            ready, _, _ = select.select([self.fd], [], [], 0)
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Portable fallback: compare stat() results at every interval.
+
+    Every poll checks each directory's mtime (cheap: one stat per directory)
+    to find added, removed or renamed entries, and re-stats the indexed files
+    to catch in-place size changes. It needs no OS support, but unlike
+    inotify it costs CPU and I/O proportional to the tree size on every poll.
+    """
+
+    def __init__(self, index: WatchIndex, poll_interval: float) -> None:
+        self.index = index
+        self.poll_interval = poll_interval
+        self._mtimes: Dict[str, int] = {}
+
+    def add(self, directory: str) -> None:
+        try:
+            self._mtimes[directory] = os.stat(directory).st_mtime_ns
+        except OSError:
+            self._mtimes[directory] = -1
+
+    def remove(self, directory: str) -> None:
+        self._mtimes.pop(directory, None)
+
+    def wait(self, timeout: float) -> Set[Tuple[str, str]]:
+        time.sleep(max(min(timeout, self.poll_interval), 0))
+        changed: Set[Tuple[str, str]] = set()
+        for directory, old_mtime in list(self._mtimes.items()):
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                mtime = -1
+            if mtime != old_mtime:
+                self._mtimes[directory] = mtime
+                changed.add((directory, ""))  # "" = re-list the directory
+        for directory, bucket in list(self.index.files.items()):
+            for name, (size, _key) in list(bucket.items()):
+                try:
+                    if os.stat(os.path.join(directory, name)).st_size != size:
+                        changed.add((directory, name))
+                except OSError:
+                    changed.add((directory, name))
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+def watch_command(
+    root: Path,
+    excluded_dirs: Set[str],
+    include_hidden: bool,
+    follow_symlinks: bool,
+    ignore: Optional[IgnoreState],
+    interval: float,
+    top_n: int,
+    by_ext: bool,
+    force_polling: bool = False,
+    out: Optional[IO[str]] = None,
+    one_file_system: bool = False,
+) -> int:
+    """Scan once, then keep totals current from change events.
+
+    A compact JSON snapshot (one per line) is written at start-up and then
+    at most once per `interval` seconds, only when something changed. Stop
+    with Ctrl+C.
+
+    If inotify runs out of watches (ENOSPC) - at start-up or later, when a
+    new directory appears - we switch to the polling watcher and re-index
+    the tree, instead of stopping.
+    """
+
+    out = out if out is not None else sys.stdout
+    watcher: Optional[Union[InotifyWatcher, PollingWatcher]] = None
+    index = WatchIndex(
+        root,
+        excluded_dirs,
+        include_hidden,
+        follow_symlinks,
+        ignore,
+        on_dir_added=lambda path: watcher.add(path) if watcher is not None else None,
+        on_dir_removed=lambda path: watcher.remove(path) if watcher is not None else None,
+        one_file_system=one_file_system,
+    )
+    if not force_polling:
+        try:
+            watcher = InotifyWatcher()
+        except (OSError, AttributeError):
+            watcher = None
+
+    def fall_back_to_polling(exc: OSError) -> None:
+        nonlocal watcher
+        # Usually the inotify watch limit (fs.inotify.max_user_watches)
+        print(f"Warning: inotify unavailable ({exc}); falling back to polling", file=sys.stderr)
+        if watcher is not None:
+            watcher.close()
+        watcher = None
+        # A scan_tree() cut short by the error left the index half-updated
+        index.reset()
+        index.scan_tree(str(root), ignore)
+        watcher = PollingWatcher(index, poll_interval=interval)
+        for directory in index.dirs:
+            watcher.add(directory)
+
+    try:
+        try:
+            index.scan_tree(str(root), ignore)
+        except OSError as exc:
+            fall_back_to_polling(exc)
+        if watcher is None:
+            watcher = PollingWatcher(index, poll_interval=interval)
+            for directory in index.dirs:
+                watcher.add(directory)
+
+        def emit() -> None:
+            out.write(json.dumps(index.snapshot(top_n, by_ext), ensure_ascii=False) + "\n")
+            out.flush()
+
+        emit()
+        dirty = False
+        next_emit = time.monotonic() + interval
+        while True:
+            changed = watcher.wait(next_emit - time.monotonic() if dirty else interval)
+            try:
+                if RESYNC in changed:
+                    # The kernel dropped events: rebuild the index from scratch
+                    for directory in list(index.dirs):
+                        watcher.remove(directory)
+                    index.reset()
+                    index.scan_tree(str(root), ignore)
+                    dirty = True
+                else:
+                    for directory, name in changed:
+                        if name:
+                            index.refresh_entry(directory, name)
+                        else:
+                            index.rescan_dir(directory)
+                    dirty = dirty or bool(changed)
+            except OSError as exc:
+                if not isinstance(watcher, InotifyWatcher):
+                    raise
+                fall_back_to_polling(exc)
+                dirty = True
+            now = time.monotonic()
+            if dirty and now >= next_emit:
+                emit()
+                dirty = False
+                next_emit = now + interval
+            elif not dirty:
+                next_emit = max(next_emit, now)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        if watcher is not None:
+            watcher.close()
+
+
+# ------------------------------ Sampling Estimator ----------------------------
+
+
+class _DirListing:
+    """Totals of the files directly inside one directory, plus its subdirectories."""
+
+    __slots__ = ("size_bytes", "file_count", "by_ext", "subdirs")
+
+    def __init__(self) -> None:
+        self.size_bytes = 0
+        self.file_count = 0
+        self.by_ext: Dict[str, int] = defaultdict(int)
+        # (path, ignore state for its contents)
+        self.subdirs: List[Tuple[Path, Optional[IgnoreState]]] = []
+
+
+class SizeEstimator:
+    """Estimate a tree's total size within a time budget (--estimate).
+
+    How it works - two things run in alternating rounds:
+    - Exact expansion: directories are scanned for real, breadth-first,
+      starting at the root. Their files are counted exactly, and their
+      subdirectories join the "frontier" of unexplored directories.
+    - Random probes (Knuth's estimator): to guess how much is hidden below
+      the frontier, pick a frontier directory at random and walk down from
+      it, choosing one random subdirectory at each level. Each directory on
+      the way counts with a weight equal to the product of the branching
+      factors above it (a directory reached by picking 1 of 5, then 1 of 3,
+      stands in for 15 similar ones). Averaged over many probes this is an
+      unbiased estimate, and the spread of the probes gives a 95%
+      confidence interval. Probe values are heavy-tailed (a rare probe
+      that lands in a huge subtree outweighs hundreds of small ones), so
+      with very short budgets the interval is approximate and tends to be
+      too narrow; it tightens quickly as the exact part grows.
+
+    The estimate is exact part + probe estimate of the frontier. As rounds
+    go by the exact part grows and the frontier shrinks; once the frontier
+    is empty the whole tree has been scanned and the answer is exact (the
+    interval collapses to a single number). Listings made by probes are
+    remembered, so expanding a probed directory later costs nothing.
+
+    Traversal rules match a normal scan (excluded names, hidden files,
+    ignore patterns, --one-file-system). With `follow_symlinks`, cycles are
+    skipped; directories reachable through two paths are deduplicated by the
+    exact expansion, but may be counted twice by probes until expanded.
+    """
+
+    Z_95 = 1.96
+
+    def __init__(
+        self,
+        root: Path,
+        excluded_dirs: Set[str],
+        include_hidden: bool,
+        follow_symlinks: bool,
+        ignore: Optional[IgnoreState] = None,
+        one_file_system: bool = False,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.root = root
+        self.excluded_dirs = excluded_dirs
+        self.include_hidden = include_hidden
+        self.follow_symlinks = follow_symlinks
+        self.root_ignore = ignore
+        self.device = os.stat(root).st_dev if one_file_system else None
+        self.rng = random.Random(seed)
+        self.guard = VisitedDirectories() if follow_symlinks else None
+        # Exact results from fully expanded directories
+        self.exact_bytes = 0
+        self.exact_files = 0
+        self.exact_by_ext: Dict[str, int] = defaultdict(int)
+        self.dirs_expanded = 0
+        # Unexplored directories: (path, ignore state, ancestry)
+        self.frontier: List[Tuple[Path, Optional[IgnoreState], Ancestry]] = [(root, ignore, None)]
+        self._next = 0  # frontier[:_next] are already expanded (FIFO = breadth-first)
+        self._listings: Dict[str, _DirListing] = {}
+        self.probes_total = 0
+        self._reset_epoch()
+
+    # -- scanning -------------------------------------------------------------
+
+    def _list(self, path: Path, state: Optional[IgnoreState]) -> _DirListing:
+        """List one directory (memoized: probes and expansion share listings)."""
+
+        key = str(path)
+        listing = self._listings.get(key)
+        if listing is None:
+            listing = _DirListing()
+            files, subdirs, inner = _scan_directory(
+                path, self.excluded_dirs, self.include_hidden, self.follow_symlinks,
+                state, device=self.device,
+            )
+            for info in collect_file_info(files):
+                listing.size_bytes += info.size_bytes
+                listing.file_count += 1
+                listing.by_ext[info.extension or "<no_ext>"] += info.size_bytes
+            listing.subdirs = [
+                (sub, inner.child(sub.name) if inner is not None else None) for sub in subdirs
+            ]
+            self._listings[key] = listing
+        return listing
+
+    def _expand_one(self) -> None:
+        """Scan the next frontier directory exactly."""
+
+        path, state, ancestry = self.frontier[self._next]
+        self._next += 1
+        if self.guard is not None:
+            identity = self.guard.identity(path)
+            if identity is None:
+                return
+            ancestry = self.guard.enter(identity, ancestry)
+            if ancestry is None:
+                return
+        listing = self._list(path, state)
+        # Exact now; drop the memo entry so memory doesn't keep growing
+        self._listings.pop(str(path), None)
+        self.dirs_expanded += 1
+        self.exact_bytes += listing.size_bytes
+        self.exact_files += listing.file_count
+        for ext, size in listing.by_ext.items():
+            self.exact_by_ext[ext] += size
+        self.frontier.extend((sub, sub_state, ancestry) for sub, sub_state in listing.subdirs)
+        if self._next > 4096 and self._next * 2 > len(self.frontier):
+            # Compact the list so expanded entries don't pile up
+            del self.frontier[: self._next]
+            self._next = 0
+
+    def _probe(self) -> Tuple[float, float, Dict[str, float]]:
+        """One Knuth probe below a random frontier directory.
+
+        Returns (bytes, files, bytes per extension), already scaled to stand
+        for the whole frontier.
+        """
+
+        unexplored = len(self.frontier) - self._next
+        path, state, ancestry = self.frontier[self._next + self.rng.randrange(unexplored)]
+        weight = float(unexplored)
+        size = files = 0.0
+        by_ext: Dict[str, float] = defaultdict(float)
+        while True:
+            if self.guard is not None:
+                identity = self.guard.identity(path)
+                if identity is None or self.guard.is_cycle(identity, ancestry):
+                    break
+                ancestry = (identity, ancestry)
+            listing = self._list(path, state)
+            size += weight * listing.size_bytes
+            files += weight * listing.file_count
+            for ext, ext_size in listing.by_ext.items():
+                by_ext[ext] += weight * ext_size
+            if not listing.subdirs:
+                break
+            weight *= len(listing.subdirs)
+            path, state = self.rng.choice(listing.subdirs)
+        return size, files, by_ext
+
+    # -- estimation -----------------------------------------------------------
+
+    def _reset_epoch(self) -> None:
+        """Forget probe results (they describe a frontier that has changed)."""
+
+        self._n = 0
+        self._sum = self._sumsq = self._files = 0.0
+        self._ext_sum: Dict[str, float] = defaultdict(float)
+        self._ext_sumsq: Dict[str, float] = defaultdict(float)
+
+    def _record_probe(self) -> None:
+        size, files, by_ext = self._probe()
+        self.probes_total += 1
+        self._n += 1
+        self._sum += size
+        self._sumsq += size * size
+        self._files += files
+        for ext, value in by_ext.items():
+            self._ext_sum[ext] += value
+            self._ext_sumsq[ext] += value * value
+
+    @property
+    def exact(self) -> bool:
+        """True once every directory has been scanned."""
+
+        return self._next >= len(self.frontier)
+
+    def run(self, time_budget: float, min_probes: int = 2) -> "SizeEstimator":
+        """Refine the estimate until `time_budget` seconds have passed.
+
+        Each round expands the frontier for a slice of time, then probes the
+        new frontier for a slice of time. When less than two slices are
+        left, the rest of the budget goes to probing the current frontier.
+        """
+
+        deadline = time.monotonic() + time_budget
+        slice_time = max(0.05, time_budget / 20)
+        while not self.exact:
+            now = time.monotonic()
+            if deadline - now > 2 * slice_time:
+                stop = now + slice_time
+                while not self.exact and time.monotonic() < stop:
+                    self._expand_one()
+                if self.exact:
+                    break
+                self._reset_epoch()
+                stop = time.monotonic() + slice_time
+            else:
+                stop = deadline
+            while self._n < min_probes or time.monotonic() < stop:
+                self._record_probe()
+            if stop == deadline:
+                break
+        return self
+
+    def _interval(self, exact: float, total: float, total_sq: float) -> Dict[str, float]:
+        """Point estimate and 95% interval from probe sums (plus the exact part)."""
+
+        if self.exact or self._n == 0:
+            return {"estimate": exact, "ci95_low": exact, "ci95_high": exact}
+        mean = total / self._n
+        if self._n > 1:
+            variance = max(total_sq / self._n - mean * mean, 0.0) * self._n / (self._n - 1)
+            margin = self.Z_95 * math.sqrt(variance / self._n)
+        else:
+            margin = float("inf")
+        return {
+            "estimate": exact + mean,
+            "ci95_low": exact + max(mean - margin, 0.0),
+            "ci95_high": exact + mean + margin,
+        }
+
+    def result(self) -> Dict[str, object]:
+        """JSON-friendly summary of the current estimate."""
+
+        total = self._interval(self.exact_bytes, self._sum, self._sumsq)
+        by_ext: Dict[str, Dict[str, float]] = {}
+        for ext in set(self.exact_by_ext) | set(self._ext_sum):
+            by_ext[ext] = self._interval(
+                self.exact_by_ext.get(ext, 0), self._ext_sum.get(ext, 0.0), self._ext_sumsq.get(ext, 0.0)
+            )
+        files = self.exact_files + (self._files / self._n if self._n and not self.exact else 0)
+        return {
+            "exact": self.exact,
+            "estimated_total_bytes": round(total["estimate"]),
+            "ci95_low_bytes": round(total["ci95_low"]),
+            "ci95_high_bytes": round(total["ci95_high"]) if math.isfinite(total["ci95_high"]) else None,
+            "estimated_file_count": round(files),
+            "exact_bytes": self.exact_bytes,
+            "dirs_scanned_exactly": self.dirs_expanded,
+            "dirs_unexplored": len(self.frontier) - self._next,
+            "probes": self._n,
+            "probes_total": self.probes_total,
+            "by_extension": {
+                ext: {key: round(value) if math.isfinite(value) else None for key, value in row.items()}
+                for ext, row in sorted(by_ext.items(), key=lambda kv: kv[1]["estimate"], reverse=True)
+            },
+        }
+
+
+def estimate_command(
+    root: Path,
+    estimator: SizeEstimator,
+    time_budget: float,
+    by_ext: bool,
+    as_json: bool,
+) -> int:
+    """Run a SizeEstimator and print its result (text or JSON)."""
+
+    result = estimator.run(time_budget).result()
+    if not by_ext:
+        result.pop("by_extension")
+    if as_json:
+        print(json.dumps({"path": str(root), "time_budget_s": time_budget, **result}, indent=2))
+        return 0
+
+    def size_range(low: Optional[int], high: Optional[int]) -> str:
+        high_text = human_readable_size(high) if high is not None else "?"
+        return f"{human_readable_size(low or 0)} - {high_text}"
+
+    print(f"Path: {root}")
+    estimate = result["estimated_total_bytes"]
+    if result["exact"]:
+        print(f"Total size: {human_readable_size(estimate)} ({estimate} bytes) - exact, every directory scanned")
+    else:
+        print(
+            f"Estimated total size: ~{human_readable_size(estimate)} "
+            f"(95% interval {size_range(result['ci95_low_bytes'], result['ci95_high_bytes'])})"
+        )
+        print(
+            f"Scanned exactly: {result['dirs_scanned_exactly']} directories "
+            f"({human_readable_size(result['exact_bytes'])}); "
+            f"{result['dirs_unexplored']} unexplored, estimated from {result['probes']} random probes"
+        )
+    print(f"Estimated files: ~{result['estimated_file_count']}")
+    if by_ext:
+        print("\nBreakdown by file extension (estimated, largest first):")
+        for ext, row in result["by_extension"].items():  # type: ignore[union-attr]
+            line = f"  {ext:>8}: ~{human_readable_size(row['estimate'])}"
+            if not result["exact"]:
+                line += f" ({size_range(row['ci95_low'], row['ci95_high'])})"
+            print(line)
+    return 0
+
+
+# -------------------------------- NDJSON Output ------------------------------
+
+
+# C-accelerated JSON string quoting (what json.dumps uses for a str)
+_json_string = json.encoder.encode_basestring_ascii
+# Read once per NDJSON record; a module global is found faster than time.monotonic
+_monotonic = time.monotonic
+
+
+class NdjsonWriter:
+    """Stream newline-delimited JSON (one compact record per line) to `stream`.
+
+    Why not just print() each record?
+    - One write per file means one system call per file when stdout is a
+      pipe. Records are joined and written in chunks of about `chunk_size`
+      characters instead.
+    - Buffering must not hide progress: queued records are written out once
+      the buffer is older than `max_delay` seconds. The clock is read for
+      every record - time.monotonic() costs a few tens of nanoseconds, far
+      less than encoding the record - and, through `flush_if_due` (the
+      walkers' `on_directory` hook), once per directory the walk finishes.
+      So records queued before a stretch of empty or slow directories go
+      out within about `max_delay` plus one directory listing, not at the
+      end of the scan. Callers flush right after the first record so the
+      first byte shows up within milliseconds.
+
+    If the reader goes away (e.g. `| head`), the write raises
+    BrokenPipeError, which stops the scan; the CLI entry point then exits
+    quietly instead of printing a traceback.
+    """
+
+    def __init__(self, stream: IO[str], chunk_size: int = 1 << 16, max_delay: float = 0.25) -> None:
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.max_delay = max_delay
+        self.records = 0
+        self._parts: List[str] = []
+        self._pending = 0
+        self._deadline = time.monotonic() + max_delay
+
+    def write_line(self, line: str) -> None:
+        """Queue one already-encoded line (must end with a newline)."""
+
+        self._parts.append(line)
+        self._pending += len(line)
+        self.records += 1
+        if self._pending >= self.chunk_size or _monotonic() >= self._deadline:
+            self.flush()
+
+    def flush_if_due(self) -> None:
+        """Flush if records are queued and the buffer is older than `max_delay`."""
+
+        if self._parts and _monotonic() >= self._deadline:
+            self.flush()
+
+    def write(self, record: Dict[str, object]) -> None:
+        """Queue one record (any JSON-serializable dict)."""
+
+        self.write_line(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def file(self, info: FileInfo) -> None:
+        """Queue a "file" record; usable directly as a scan listener.
+
+        Built by hand instead of json.dumps(dict): this runs once per file,
+        and only the path and extension need string escaping.
+        """
+
+        line = (
+            '{"type":"file","path":' + _json_string(info.path)
+            + ',"size_bytes":' + str(info.size_bytes)
+            + ',"extension":' + _json_string(info.extension)
+        )
+        if info.allocated_bytes is not None:
+            line += ',"allocated_bytes":' + str(info.allocated_bytes)
+        self.write_line(line + "}\n")
+
+    def flush(self) -> None:
+        """Write everything queued so far and flush the stream."""
+
+        if self._parts:
+            self.stream.write("".join(self._parts))
+            self._parts.clear()
+            self._pending = 0
+        self.stream.flush()
+        self._deadline = time.monotonic() + self.max_delay
+
+
+# ---------------------------------- Snapshots --------------------------------
+
+
+class SnapshotWriter:
+    """Write a compact, sorted binary snapshot of (relative path, size) pairs.
+
+    File layout:
+        magic b"CBSNAP01" | u32 header length | JSON header
+        then one record per file, sorted by path:
+        u16 shared prefix | u16 suffix length | u64 size | suffix bytes
+
+    Why sorted by path (front-coded) rather than by path hash?
+    - Paths are stored, so a diff can name added and removed files.
+    - Consecutive sorted paths share long prefixes ("src/pkg/mod/..."), and
+      front coding stores only the differing tail: most records take a few
+      dozen bytes.
+    - Path order keeps every directory's subtree contiguous, which is what
+      lets `SnapshotDiff` compute per-directory deltas with memory bounded by
+      the tree depth.
+    Path separators are stored as NUL bytes (never valid in file names) so
+    "a/x" sorts before "a.b/y" and subtrees really are contiguous.
+
+    Files arrive in walk order, so sorting uses an external merge sort:
+    sorted runs of `run_records` entries go to temporary files next to the
+    target, and the runs are merged into the final file at `close()`.
+    Memory therefore stays bounded however many files the tree has.
+    """
+
+    MAGIC = b"CBSNAP01"
+    RECORD = struct.Struct("<HHQ")
+
+    def __init__(self, path: Path, root: Path, run_records: int = 1 << 18) -> None:
+        self.path = Path(path)
+        self.root = str(root)
+        self.run_records = run_records
+        self.file_count = 0
+        self.total_bytes = 0
+        self._prefix_len = len(self.root.rstrip(os.sep)) + 1
+        self._sep = os.fsencode(os.sep)
+        self._buffer: List[Tuple[bytes, int]] = []
+        self._runs: List[str] = []
+        self._tmpdir = tempfile.TemporaryDirectory(prefix=".snapshot-", dir=self.path.parent)
+
+    def add(self, info: FileInfo) -> None:
+        """Record one file; usable directly as a scan listener."""
+
+        key = os.fsencode(info.path[self._prefix_len:]).replace(self._sep, b"\0")
+        self._buffer.append((key, info.size_bytes))
+        self.file_count += 1
+        self.total_bytes += info.size_bytes
+        if len(self._buffer) >= self.run_records:
+            self._spill()
+
+    def _spill(self) -> None:
+        """Sort the in-memory buffer and write it out as one run file."""
+
+        self._buffer.sort()
+        run_path = os.path.join(self._tmpdir.name, f"run{len(self._runs)}")
+        with open(run_path, "wb") as handle:
+            self._write_records(handle, self._buffer)
+        self._runs.append(run_path)
+        self._buffer = []
+
+    @classmethod
+    def _write_records(cls, handle: IO[bytes], records: Iterable[Tuple[bytes, int]]) -> None:
+        pack = cls.RECORD.pack
+        previous = b""
+        for key, size in records:
+            shared = len(os.path.commonprefix((previous, key)))
+            suffix = key[shared:]
+            handle.write(pack(shared, len(suffix), size))
+            handle.write(suffix)
+            previous = key
+
+    def close(self) -> None:
+        """Merge all runs into the final snapshot file."""
+
+        handles: List[IO[bytes]] = []
+        try:
+            if self._runs:
+                self._spill()
+                handles = [open(run, "rb") for run in self._runs]
+                records: Iterable[Tuple[bytes, int]] = heapq.merge(
+                    *(_read_records(handle) for handle in handles)
+                )
+            else:
+                # Everything fit in memory: no temporary files needed
+                self._buffer.sort()
+                records = self._buffer
+            header = json.dumps(
+                {
+                    "root": self.root,
+                    "created": time.time(),
+                    "file_count": self.file_count,
+                    "total_bytes": self.total_bytes,
+                }
+            ).encode("utf-8")
+            # Write to a temporary name first so a crash never leaves a
+            # truncated snapshot under the real name
+            partial = self.path.with_name(self.path.name + ".partial")
+            with open(partial, "wb") as handle:
+                handle.write(self.MAGIC + struct.pack("<I", len(header)) + header)
+                self._write_records(handle, records)
+            os.replace(partial, self.path)
+        finally:
+            for handle in handles:
+                handle.close()
+            self._tmpdir.cleanup()
+
+
+def _read_records(handle: IO[bytes]) -> Iterator[Tuple[bytes, int]]:
+    """Yield (key, size) records from a snapshot body, undoing front coding."""
+
+    unpack = SnapshotWriter.RECORD.unpack
+    size_of = SnapshotWriter.RECORD.size
+    read = handle.read
+    previous = b""
+    while True:
+        fixed = read(size_of)
+        if len(fixed) < size_of:
+            return
+        shared, suffix_len, size = unpack(fixed)
+        previous = previous[:shared] + read(suffix_len)
+        yield previous, size
+
+
+def open_snapshot(path: Union[str, Path]) -> Tuple[Dict[str, object], IO[bytes]]:
+    """Open a snapshot file; return (header dict, handle positioned at the records).
+
+    Raises ValueError if the file is not a snapshot.
+    """
+
+    handle = open(path, "rb")
+    magic = handle.read(len(SnapshotWriter.MAGIC))
+    if magic != SnapshotWriter.MAGIC:
+        handle.close()
+        raise ValueError(f"not a codebase_size snapshot: {path}")
+    (length,) = struct.unpack("<I", handle.read(4))
+    header = json.loads(handle.read(length).decode("utf-8"))
+    return header, handle
+
+
+@dataclass
+class FileChange:
+    """One file that differs between two snapshots (sizes are None if absent)."""
+
+    path: str
+    old_size: Optional[int]
+    new_size: Optional[int]
+
+    @property
+    def kind(self) -> str:
+        if self.old_size is None:
+            return "added"
+        if self.new_size is None:
+            return "removed"
+        return "resized"
+
+    @property
+    def delta(self) -> int:
+        return (self.new_size or 0) - (self.old_size or 0)
+
+
+@dataclass
+class DirectoryDelta:
+    """Net change of one directory, including everything below it."""
+
+    path: str
+    delta_bytes: int = 0
+    added: int = 0
+    removed: int = 0
+    resized: int = 0
+
+
+class SnapshotDiff:
+    """Compare two snapshots with one streaming merge-join.
+
+    Both files are sorted the same way, so reading them side by side like
+    the merge step of merge sort finds every added, removed and resized file
+    in a single pass: time is linear in the number of files and only one
+    record of each file is in memory at a time.
+
+    Per-directory deltas are computed on the fly: changed files arrive
+    grouped by directory, so we keep one open DirectoryDelta per level of the
+    current path (a stack). When the path moves on, finished directories are
+    reported and folded into their parent. `max_depth` folds deeper
+    directories into their ancestor, like --tree.
+
+    Only summaries are kept: counts, the `top_n` largest file changes and the
+    `top_dirs` largest directory deltas (bounded heaps). Callers who want
+    every change pass `on_change` / `on_dir` callbacks.
+    """
+
+    def __init__(self, top_n: int = 10, top_dirs: int = 10, max_depth: Optional[int] = None) -> None:
+        self.top_n = top_n
+        self.top_dirs = top_dirs
+        self.max_depth = max_depth
+        self.counts = {"added": 0, "removed": 0, "resized": 0, "unchanged": 0}
+        self.bytes = {"added": 0, "removed": 0, "resized": 0}
+        self._top_changes: List[Tuple[int, int, FileChange]] = []
+        self._top_dirs: List[Tuple[int, int, DirectoryDelta]] = []
+        self._seq = 0
+        # Net change of the whole tree (set by run())
+        self.root = DirectoryDelta(path=".")
+
+    @staticmethod
+    def _merge_join(
+        old: Iterator[Tuple[bytes, int]], new: Iterator[Tuple[bytes, int]]
+    ) -> Iterator[Tuple[bytes, Optional[int], Optional[int]]]:
+        """Yield (key, old size, new size) for every key in either snapshot."""
+
+        done = (None, None)
+        a = next(old, done)
+        b = next(new, done)
+        while a[0] is not None or b[0] is not None:
+            if b[0] is None or (a[0] is not None and a[0] < b[0]):
+                yield a[0], a[1], None
+                a = next(old, done)
+            elif a[0] is None or b[0] < a[0]:
+                yield b[0], None, b[1]
+                b = next(new, done)
+            else:
+                yield a[0], a[1], b[1]
+                a = next(old, done)
+                b = next(new, done)
+
+    @staticmethod
+    def _push(heap: List[Tuple[int, int, object]], limit: int, weight: int, seq: int, item: object) -> None:
+        """Keep the `limit` items with the largest `weight` (ties: first seen wins)."""
+
+        if limit <= 0:
+            return
+        entry = (weight, -seq, item)
+        if len(heap) < limit:
+            heapq.heappush(heap, entry)
+        elif entry[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, entry)
+
+    def run(
+        self,
+        old: Iterator[Tuple[bytes, int]],
+        new: Iterator[Tuple[bytes, int]],
+        on_change: Optional[Callable[[FileChange], None]] = None,
+        on_dir: Optional[Callable[[DirectoryDelta], None]] = None,
+    ) -> "SnapshotDiff":
+        """Consume two record streams (see `_read_records`)."""
+
+        sep = os.sep
+        # Key components of the directory we're in, and one open
+        # DirectoryDelta per level (stack[0] is the root)
+        open_parts: List[bytes] = []
+        stack: List[DirectoryDelta] = [DirectoryDelta(path=".")]
+
+        def close_dir() -> None:
+            finished = stack.pop()
+            open_parts.pop()
+            parent = stack[-1]
+            parent.delta_bytes += finished.delta_bytes
+            parent.added += finished.added
+            parent.removed += finished.removed
+            parent.resized += finished.resized
+            self._report_dir(finished, on_dir)
+
+        for key, old_size, new_size in self._merge_join(old, new):
+            if old_size == new_size:
+                self.counts["unchanged"] += 1
+                continue
+            change = FileChange(
+                path=os.fsdecode(key.replace(b"\0", os.fsencode(sep))),
+                old_size=old_size,
+                new_size=new_size,
+            )
+            kind = change.kind
+            self.counts[kind] += 1
+            self.bytes[kind] += change.delta
+            self._seq += 1
+            self._push(self._top_changes, self.top_n, abs(change.delta), self._seq, change)
+            if on_change is not None:
+                on_change(change)
+
+            # Move the directory stack to this file's directory
+            parts = key.split(b"\0")[:-1]
+            if self.max_depth is not None:
+                parts = parts[: self.max_depth]
+            common = 0
+            while common < len(open_parts) and common < len(parts) and open_parts[common] == parts[common]:
+                common += 1
+            while len(open_parts) > common:
+                close_dir()
+            for part in parts[common:]:
+                open_parts.append(part)
+                stack.append(DirectoryDelta(path=os.fsdecode(os.fsencode(sep).join(open_parts))))
+            current = stack[-1]
+            current.delta_bytes += change.delta
+            setattr(current, kind, getattr(current, kind) + 1)
+
+        while open_parts:
+            close_dir()
+        self.root = stack[0]
+        self._report_dir(self.root, on_dir)
+        return self
+
+    def _report_dir(self, delta: DirectoryDelta, on_dir: Optional[Callable[[DirectoryDelta], None]]) -> None:
+        self._seq += 1
+        self._push(self._top_dirs, self.top_dirs, abs(delta.delta_bytes), self._seq, delta)
+        if on_dir is not None:
+            on_dir(delta)
+
+    def top_changes(self) -> List[FileChange]:
+        """Largest file changes by absolute size delta (largest first)."""
+
+        return [entry[2] for entry in sorted(self._top_changes, key=lambda e: e[:2], reverse=True)]
+
+    def top_directories(self) -> List[DirectoryDelta]:
+        """Largest directory deltas by absolute size delta (largest first)."""
+
+        return [entry[2] for entry in sorted(self._top_dirs, key=lambda e: e[:2], reverse=True)]
+
+
+def diff_command(
+    old_path: Path,
+    new_path: Path,
+    top_n: int,
+    top_dirs: int,
+    max_depth: Optional[int],
+    output: str,
+    out: Optional[IO[str]] = None,
+) -> int:
+    """Compare two snapshot files and print the result.
+
+    `output` is "text", "json" or "ndjson". NDJSON streams every change and
+    every changed directory as it is found, then a summary record.
+    """
+
+    out = out if out is not None else sys.stdout
+    try:
+        old_header, old_handle = open_snapshot(old_path)
+    except (OSError, ValueError, struct.error) as exc:
+        print(f"Error: cannot read snapshot: {exc}", file=sys.stderr)
+        return 2
+    try:
+        new_header, new_handle = open_snapshot(new_path)
+    except (OSError, ValueError, struct.error) as exc:
+        old_handle.close()
+        print(f"Error: cannot read snapshot: {exc}", file=sys.stderr)
+        return 2
+
+    writer = NdjsonWriter(out) if output == "ndjson" else None
+    on_change = on_dir = None
+    if writer is not None:
+        writer.write({"type": "diff", "old": old_header, "new": new_header})
+        writer.flush()
+
+        def on_change(change: FileChange) -> None:
+            writer.write({"type": change.kind, "path": change.path, "old_size": change.old_size,
+                          "new_size": change.new_size, "delta_bytes": change.delta})
+
+        def on_dir(delta: DirectoryDelta) -> None:
+            writer.write({"type": "dir", **delta.__dict__})
+
+    with old_handle, new_handle:
+        diff = SnapshotDiff(top_n=top_n, top_dirs=top_dirs, max_depth=max_depth).run(
+            _read_records(old_handle), _read_records(new_handle), on_change, on_dir
+        )
+
+    summary: Dict[str, object] = {
+        "old": old_header,
+        "new": new_header,
+        "files": dict(diff.counts),
+        "delta_bytes": dict(diff.bytes, total=diff.root.delta_bytes),
+        "top_changes": [
+            {"path": c.path, "change": c.kind, "old_size": c.old_size,
+             "new_size": c.new_size, "delta_bytes": c.delta}
+            for c in diff.top_changes()
+        ],
+        "top_directories": [d.__dict__ for d in diff.top_directories()],
+    }
+    if writer is not None:
+        writer.write({"type": "summary", **summary})
+        writer.flush()
+        return 0
+    if output == "json":
+        out.write(json.dumps(summary, indent=2) + "\n")
+        return 0
+
+    def signed(num_bytes: int) -> str:
+        sign = "+" if num_bytes >= 0 else "-"
+        return f"{sign}{human_readable_size(abs(num_bytes))}"
+
+    out.write(f"Old: {old_path} ({old_header.get('file_count')} files)\n")
+    out.write(f"New: {new_path} ({new_header.get('file_count')} files)\n\n")
+    for kind in ("added", "removed", "resized"):
+        out.write(f"{kind.capitalize():>8}: {diff.counts[kind]} file(s), {signed(diff.bytes[kind])}\n")
+    out.write(f"     Net: {signed(diff.root.delta_bytes)} ({diff.root.delta_bytes} bytes)\n")
+    changes = diff.top_changes()
+    if changes:
+        out.write(f"\nLargest file changes (top {len(changes)}):\n")
+        for c in changes:
+            out.write(f"  {signed(c.delta):>12}  {c.kind:<8} {c.path}\n")
+    directories = diff.top_directories()
+    if directories:
+        out.write(f"\nLargest directory changes (top {len(directories)}):\n")
+        for d in directories:
+            out.write(
+                f"  {signed(d.delta_bytes):>12}  {d.path}"
+                f" (+{d.added} -{d.removed} ~{d.resized})\n"
+            )
+    return 0
 
-import argparse
-import json
-import os
-import sys
-from collections import Counter, defaultdict
-from dataclasses import dataclass
-from pathlib import Path
-from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
+# -------------------------------- Library API --------------------------------
 
-# ------------------------------ Data Structures ------------------------------
+
+def build_report(
+    root: Path,
+    aggregator: ScanAggregator,
+    excluded_dirs: Set[str],
+    include_hidden: bool,
+    follow_symlinks: bool,
+    one_file_system: bool = False,
+    by_ext: bool = False,
+    disk_usage: bool = False,
+    visited: Optional[VisitedDirectories] = None,
+    hardlinks: Optional[HardlinkTracker] = None,
+    histogram: Optional[SizeHistogram] = None,
+    rollup: Optional[DirectoryRollup] = None,
+    tree_top: int = 10,
+    root_results: Optional[List[RootScanResult]] = None,
+    lines: Optional[LineCounter] = None,
+) -> Dict[str, object]:
+    """The JSON report the CLI prints (--json), built from the scan's results.
+
+    Shared by `main()` and `ScanResult.as_dict()`, so library callers get
+    exactly the structure the command line produces. `rollup` must already
+    be finished. `root_results` (several --path roots) replaces "path" with
+    "paths" plus a subtotal per root.
+    """
+
+    output: Dict[str, object] = {
+        "path": str(root),
+        "total_size_bytes": aggregator.total_bytes,
+        "total_size_human": human_readable_size(aggregator.total_bytes),
+        "excluded_dirs": sorted(list(excluded_dirs)),
+        "include_hidden": bool(include_hidden),
+        "follow_symlinks": bool(follow_symlinks),
+    }
+    if root_results is not None:
+        # Several roots: list them all, with a subtotal per root
+        del output["path"]
+        output["paths"] = [result.root for result in root_results]
+        output["roots"] = [
+            {
+                "path": result.root,
+                "total_size_bytes": result.aggregator.total_bytes,
+                "total_size_human": human_readable_size(result.aggregator.total_bytes),
+                "file_count": result.aggregator.file_count,
+            }
+            for result in root_results
+        ]
+    if one_file_system:
+        output["one_file_system"] = True
+    if visited is not None:
+        output["symlink_cycles_skipped"] = visited.cycles_skipped
+        output["duplicate_dirs_skipped"] = visited.duplicates_skipped
+    if disk_usage:
+        output["total_allocated_bytes"] = aggregator.allocated_bytes
+        output["total_allocated_human"] = human_readable_size(aggregator.allocated_bytes)
+        output["hardlinks_skipped"] = hardlinks.skipped if hardlinks else 0
+    if lines is not None:
+        output["total_lines"] = lines.total_lines
+        output["text_files"] = lines.text_files
+        output["binary_files_skipped"] = lines.binary_files
+    if by_ext:
+        output["by_extension_bytes"] = dict(
+            sorted(aggregator.by_extension().items(), key=lambda kv: kv[1], reverse=True)
+        )
+        if disk_usage:
+            output["by_extension_allocated_bytes"] = dict(
+                sorted(aggregator.by_extension_allocated().items(), key=lambda kv: kv[1], reverse=True)
+            )
+        if lines is not None:
+            output["by_extension_lines"] = dict(
+                sorted(lines.by_extension().items(), key=lambda kv: kv[1], reverse=True)
+            )
+    if aggregator.top_n > 0:
+        top_files: List[Dict[str, object]] = []
+        for f in aggregator.top_files():
+            record: Dict[str, object] = {
+                "path": f.path,
+                "size_bytes": f.size_bytes,
+                "size_human": human_readable_size(f.size_bytes),
+                "extension": f.extension,
+            }
+            if f.allocated_bytes is not None:
+                record["allocated_bytes"] = f.allocated_bytes
+            top_files.append(record)
+        output["top_files"] = top_files
+    if histogram is not None:
+        output["size_distribution"] = histogram.as_dict()
+    if rollup is not None:
+        output["tree"] = rollup.as_dict(top_k=tree_top)
+    return output
 
 
 @dataclass
-class FileInfo:
-    """Simple container for file metadata we care about.
+class ScanOptions:
+    """Settings for `scan()`, the library version of the CLI flags.
 
-    Attributes:
-        path: Absolute or relative path to the file.
-        size_bytes: File size in bytes.
-        extension: Lowercased file extension (e.g., ".py"). Empty string if none.
+    `excluded_dirs=None` means the CLI's default excludes. `workers` bounds
+    how many directories are listed at the same time (in `executor`, which
+    must be a thread pool, or in a private thread pool of that size).
+    `progress` is called on the event loop thread with a ScanProgress, at
+    most every `progress_interval` seconds and once more when the scan ends.
     """
 
-    path: str
-    size_bytes: int
-    extension: str
+    excluded_dirs: Optional[Set[str]] = None
+    include_hidden: bool = False
+    follow_symlinks: bool = False
+    exclude_glob: List[str] = field(default_factory=list)
+    respect_gitignore: bool = False
+    one_file_system: bool = False
+    top_n: int = 0
+    by_ext: bool = True
+    disk_usage: bool = False
+    histogram: bool = False
+    tree: bool = False
+    max_depth: Optional[int] = None
+    tree_top: int = 10
+    workers: int = 4
+    executor: Optional[Executor] = None
+    progress: Optional[Callable[["ScanProgress"], None]] = None
+    progress_interval: float = 0.5
 
 
-# ------------------------------ Helper Functions -----------------------------
+@dataclass
+class ScanProgress:
+    """A progress report from `scan()`."""
 
+    elapsed_s: float
+    dirs_scanned: int
+    dirs_pending: int  # found but not scanned yet
+    files: int
+    total_bytes: int
+    entries_per_sec: float  # files + directories per second so far
+    done: bool = False
 
-def human_readable_size(num_bytes: int) -> str:
-    """Convert raw bytes to megabytes for consistent display.
 
-    Always shows megabytes (MB) to make sizes easy to compare.
-    Example: 1_234_567 bytes -> "1.18 MB"
+@dataclass
+class ScanResult:
+    """The aggregate structures of one `scan()` (what the CLI prints).
+
+    They are filled in while the scan runs, so they can be read for partial
+    results at any time; `rollup` is only finished once the scan is done.
     """
 
-    # Convert bytes to megabytes (divide by 1024^2)
-    # Using 1024^2 = 1,048,576 for binary megabytes (MiB)
-    size_mb = num_bytes / (1024 * 1024)
-    
-    # Format with 2 decimal places for readability
-    # Show more precision for very small files
-    if size_mb < 0.01:
-        return f"{size_mb:.4f} MB"
-    else:
-        return f"{size_mb:.2f} MB"
+    root: Path
+    options: ScanOptions
+    excluded_dirs: Set[str]
+    aggregator: ScanAggregator
+    histogram: Optional[SizeHistogram] = None
+    rollup: Optional[DirectoryRollup] = None
+    visited: Optional[VisitedDirectories] = None
+    hardlinks: Optional[HardlinkTracker] = None
 
+    def as_dict(self) -> Dict[str, object]:
+        """The same structure as the CLI's --json output."""
 
-def default_excluded_dirs() -> Set[str]:
-    """Common directories to skip by default.
+        options = self.options
+        return build_report(
+            self.root,
+            self.aggregator,
+            self.excluded_dirs,
+            options.include_hidden,
+            options.follow_symlinks,
+            one_file_system=options.one_file_system,
+            by_ext=options.by_ext,
+            disk_usage=options.disk_usage,
+            visited=self.visited,
+            hardlinks=self.hardlinks,
+            histogram=self.histogram,
+            rollup=self.rollup,
+            tree_top=options.tree_top,
+        )
 
-    Rationale: These directories frequently contain binary caches or third-party
-    dependencies that do not represent your authored code and can distort size
-    measurements if included.
-    """
 
-    return {
-        ".git",
-        "__pycache__",
-        "node_modules",
-        "venv",
-        ".venv",
-        "env",
-        "build",
-        "dist",
-        ".mypy_cache",
-        ".pytest_cache",
-        ".ruff_cache",
-    }
+class AsyncScan:
+    """A directory scan driven by asyncio (returned by `scan()`).
 
+    Why not just run `main()` or `iter_file_entries` in a thread?
+    - A thread gives no progress reports and cannot be stopped halfway.
+      Here the event loop is in charge: each directory listing is one small
+      job in an executor, so cancelling the task that consumes the scan
+      stops it between directories.
 
-def iter_files(
-    root: Path,
-    excluded_dirs: Set[str],
-    include_hidden: bool,
-    follow_symlinks: bool,
-) -> Iterator[Path]:
-    """Yield paths for all regular files under `root`.
+    How it works (the asyncio twin of `_iter_files_parallel`):
+    - A job lists one directory with `_scan_directory` and stat()s its files
+      (DirEntry caches the result, so the event loop never waits on the
+      disk). At most `workers` jobs are in the executor at once.
+    - When a job finishes, its subdirectories are queued and the free
+      worker picks up the one the consumer will need soonest. With
+      follow_symlinks they are queued only once the consumer has claimed
+      the directory, so a duplicate path never starts work that nobody
+      reads. Scans may run ahead of the consumer, but by at most
+      `workers * 64` directories.
+    - The consumer replays the serial walker's depth-first order, so results
+      (including top-N ties and which path wins a duplicated directory) are
+      identical to the CLI's.
 
-    We use os.scandir for performance and to minimize system calls. Hidden files
-    on Windows don't always start with a dot, but for simplicity we treat "dot"
-    names as hidden across platforms. You can override with --include-hidden.
+    Use it either way:
+        async for files in scan(root, options):  # one list per directory
+            ...
+        result = await scan(root, options)       # just the ScanResult
+
+    On cancellation (or `aclose()`), queued jobs are dropped; jobs that
+    already started finish their one directory in the background.
     """
 
-    # Use a manual stack to avoid recursion limits on very deep trees
-    stack: List[Path] = [root]
+    def __init__(self, root: Union[str, Path], options: Optional[ScanOptions] = None) -> None:
+        self.options = options if options is not None else ScanOptions()
+        if self.options.workers < 1:
+            raise ValueError("workers must be at least 1")
+        root = Path(root).resolve()
+        if not root.is_dir():
+            raise NotADirectoryError(f"not a directory: {root}")
+        opts = self.options
+        excluded = opts.excluded_dirs if opts.excluded_dirs is not None else default_excluded_dirs()
+        self.result = ScanResult(
+            root=root,
+            options=opts,
+            excluded_dirs=set(excluded),
+            aggregator=ScanAggregator(top_n=max(opts.top_n, 0)),
+            histogram=SizeHistogram() if opts.histogram else None,
+            rollup=DirectoryRollup(root, opts.max_depth) if opts.tree else None,
+            visited=VisitedDirectories() if opts.follow_symlinks else None,
+            hardlinks=HardlinkTracker() if opts.disk_usage else None,
+        )
+        self._device = os.stat(root).st_dev if opts.one_file_system else None
+        self._running: Set["asyncio.Future[Tuple[List[os.DirEntry], List[_PendingScan]]]"] = set()
+        self._waiting: List[_PendingScan] = []  # found, not submitted (newest last)
+        self._ahead = 0  # submitted but not consumed yet
+        self._max_ahead = opts.workers * 64
+        self._executor: Optional[Executor] = None
+        self._batches = self._walk()
 
-    while stack:
-        current = stack.pop()
+    # -- async iterator / awaitable ---------------------------------------------
+
+    def __aiter__(self) -> "AsyncScan":
+        return self
+
+    async def __anext__(self) -> List[FileInfo]:
+        return await self._batches.__anext__()
 
+    async def aclose(self) -> None:
+        """Stop the scan early (also done on cancellation)."""
+
+        await self._batches.aclose()
+
+    def __await__(self):
+        return self._run_to_end().__await__()
+
+    async def _run_to_end(self) -> ScanResult:
         try:
-            with os.scandir(current) as it:
-                for entry in it:
-                    try:
-                        # Skip hidden (dot) entries unless explicitly requested
-                        name = entry.name
-                        if not include_hidden and name.startswith("."):
-                            if entry.is_dir(follow_symlinks=False):
-                                # Do not traverse into hidden directory
-                                continue
-                            # Skip hidden file
-                            continue
+            async for _ in self._batches:
+                pass
+        finally:
+            await self._batches.aclose()
+        return self.result
 
-                        # Skip excluded directories by name match (shallow check)
-                        if entry.is_dir(follow_symlinks=follow_symlinks):
-                            if name in excluded_dirs:
-                                continue
-                            # Add directory to stack for traversal
-                            stack.append(Path(entry.path))
-                            continue
+    # -- the walk ------------------------------------------------------------------
 
-                        # Only yield regular files; ignore others (sockets, devices)
-                        if entry.is_file(follow_symlinks=follow_symlinks):
-                            yield Path(entry.path)
-                    except (PermissionError, FileNotFoundError):
-                        # Some entries may become inaccessible or disappear; skip
-                        continue
-        except (PermissionError, FileNotFoundError):
-            # Current directory might be inaccessible; skip
-            continue
+    def _job(self, slot: _PendingScan) -> Tuple[List[os.DirEntry], List[_PendingScan]]:
+        """List one directory (runs in the executor)."""
 
+        opts = self.options
+        guard = self.result.visited
+        chain: Ancestry = None
+        if guard is not None:
+            slot.identity = guard.identity(slot.path)
+            if (
+                slot.identity is None
+                or guard.is_cycle(slot.identity, slot.ancestry)
+                or guard.seen(slot.identity)
+            ):
+                return [], []  # the consumer skips (and counts) it
+            chain = (slot.identity, slot.ancestry)
+        files, subdirs, state = _scan_directory(
+            slot.path, self.result.excluded_dirs, opts.include_hidden, opts.follow_symlinks,
+            slot.ignore, device=self._device,
+        )
+        for entry in files:
+            try:
+                entry.stat()  # cached on the entry for collect_file_info
+            except OSError:
+                pass  # collect_file_info skips it
+        pending = [
+            _PendingScan(sub, chain, state.child(sub.name) if state is not None else None)
+            for sub in subdirs
+        ]
+        return files, pending
 
-def collect_file_info(paths: Iterable[Path]) -> Iterator[FileInfo]:
-    """Map raw Path objects to FileInfo with size and extension.
+    def _submit(self, slot: _PendingScan) -> None:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, self._job, slot)
+        slot.future = future  # type: ignore[assignment]
+        self._running.add(future)
+        self._ahead += 1
+        future.add_done_callback(self._finished)
 
-    We keep errors localized; unreadable files are skipped gracefully.
-    """
+    def _finished(self, future: "asyncio.Future[Tuple[List[os.DirEntry], List[_PendingScan]]]") -> None:
+        """A job is done: queue the subdirectories it found and refill."""
 
-    for path in paths:
-        try:
-            size = path.stat().st_size
-            ext = path.suffix.lower()  # ".py", ".md", or "" if none
-            yield FileInfo(path=str(path), size_bytes=size, extension=ext)
-        except (PermissionError, FileNotFoundError, OSError):
-            # If file vanishes or can't be read, we skip it
-            continue
+        self._running.discard(future)
+        if future.cancelled() or future.exception() is not None:
+            return
+        if self.result.visited is None:
+            # With the symlink guard, the consumer queues them instead once
+            # it has claimed the directory (see _walk)
+            self._waiting.extend(future.result()[1])
+        self._fill()
 
+    def _fill(self) -> None:
+        """Submit queued directories while there is room."""
 
-def summarize_by_extension(files: Iterable[FileInfo]) -> Dict[str, int]:
-    """Return a dict mapping file extension -> total size in bytes.
+        workers = self.options.workers
+        while self._waiting and len(self._running) < workers and self._ahead < self._max_ahead:
+            slot = self._waiting.pop()
+            if slot.future is None:
+                self._submit(slot)
 
-    Empty-extension files are grouped under "<no_ext>" to avoid empty keys.
-    """
+    async def _walk(self) -> AsyncIterator[List[FileInfo]]:
+        opts = self.options
+        result = self.result
+        aggregator, histogram, rollup = result.aggregator, result.histogram, result.rollup
+        guard, hardlinks = result.visited, result.hardlinks
+        own_executor = opts.executor is None
+        self._executor = opts.executor or ThreadPoolExecutor(
+            max_workers=opts.workers, thread_name_prefix="scan"
+        )
+        started = last_report = time.monotonic()
+        dirs_scanned = 0
 
-    totals: Dict[str, int] = defaultdict(int)
-    for info in files:
-        key = info.extension if info.extension else "<no_ext>"
-        totals[key] += info.size_bytes
-    return dict(totals)
+        def report(done: bool = False) -> None:
+            elapsed = time.monotonic() - started
+            opts.progress(ScanProgress(  # type: ignore[misc]
+                elapsed_s=elapsed,
+                dirs_scanned=dirs_scanned,
+                dirs_pending=len(stack),
+                files=aggregator.file_count,
+                total_bytes=aggregator.total_bytes,
+                entries_per_sec=(aggregator.file_count + dirs_scanned) / elapsed if elapsed > 0 else 0.0,
+                done=done,
+            ))
+
+        root_slot = _PendingScan(
+            result.root, None, IgnoreState.for_root(opts.exclude_glob, opts.respect_gitignore)
+        )
+        stack: List[_PendingScan] = [root_slot]
+        try:
+            while stack:
+                slot = stack.pop()
+                while slot.future is None:
+                    # Needed now: it goes first as soon as a worker is free
+                    if len(self._running) < opts.workers:
+                        self._submit(slot)
+                    else:
+                        await asyncio.wait(set(self._running), return_when=asyncio.FIRST_COMPLETED)
+                if slot.future.done():  # type: ignore[union-attr]
+                    # No suspension happens when awaiting a finished job, so
+                    # give other tasks (and cancellation) a turn now and then
+                    if dirs_scanned % 64 == 0:
+                        await asyncio.sleep(0)
+                files, pending = await slot.future  # type: ignore[misc]
+                self._ahead -= 1
+                if guard is not None:
+                    if slot.identity is None or guard.enter(slot.identity, slot.ancestry) is None:
+                        self._fill()
+                        continue
+                    # Claimed: only now may its subdirectories run ahead. A
+                    # duplicate's children were never queued, so none of
+                    # them can hold a slot of `_max_ahead` forever.
+                    self._waiting.extend(pending)
+                self._fill()
+                dirs_scanned += 1
+                stack.extend(pending)
+                infos = list(collect_file_info(files, hardlinks=hardlinks))
+                for info in infos:
+                    aggregator.add(info)
+                    if histogram is not None:
+                        histogram.add(info)
+                    if rollup is not None:
+                        rollup.add(info)
+                if opts.progress is not None and time.monotonic() - last_report >= opts.progress_interval:
+                    last_report = time.monotonic()
+                    report()
+                if infos:
+                    yield infos
+            if rollup is not None:
+                rollup.finish()
+            if opts.progress is not None:
+                report(done=True)
+        finally:
+            for future in list(self._running):
+                future.cancel()
+            self._waiting.clear()
+            if own_executor:
+                # Don't block the event loop on jobs that already started
+                self._executor.shutdown(wait=False, cancel_futures=True)
 
 
-def top_n_largest(files: Iterable[FileInfo], n: int) -> List[FileInfo]:
-    """Return the N largest files, sorted descending by size.
+def scan(root: Union[str, Path], options: Optional[ScanOptions] = None) -> AsyncScan:
+    """Scan `root` without blocking the event loop (see AsyncScan).
 
-    We convert to a list to avoid re-iterating generators multiple times.
+    Example:
+        result = await scan("src", ScanOptions(top_n=10, progress=print))
+        print(result.as_dict()["total_size_human"])
     """
 
-    items = list(files)
-    items.sort(key=lambda f: f.size_bytes, reverse=True)
-    return items[:n]
+    return AsyncScan(root, options)
 
 
 # --------------------------------- CLI Logic ---------------------------------
@@ -222,12 +4601,25 @@ def build_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         "--path",
         type=str,
-        default=".",
+        nargs="+",
+        default=["."],
         help=(
             "The directory to measure. Defaults to current directory. "
-            "You can pass an absolute or relative path."
+            "You can pass an absolute or relative path. Several paths are scanned "
+            "concurrently in separate processes and reported together with per-root subtotals."
         ),
     )
+    parser.add_argument(
+        "--one-file-system",
+        action="store_true",
+        help="Don't descend into directories on other file systems (mount points)",
+    )
+    parser.add_argument(
+        "--device-workers",
+        type=int,
+        default=1,
+        help="With several --path roots: how many roots on the same device are scanned at once (default: 1)",
+    )
     parser.add_argument(
         "--include-hidden",
         action="store_true",
@@ -236,7 +4628,10 @@ def build_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         "--follow-symlinks",
         action="store_true",
-        help="Follow symbolic links while traversing (can be slower or circular)",
+        help=(
+            "Follow symbolic links while traversing. Each physical directory is "
+            "walked once; symlink cycles and duplicate paths are skipped"
+        ),
     )
     parser.add_argument(
         "--no-default-excludes",
@@ -252,6 +4647,109 @@ def build_parser() -> argparse.ArgumentParser:
             "Example: --exclude .vscode coverage"
         ),
     )
+    parser.add_argument(
+        "--exclude-glob",
+        nargs="*",
+        default=[],
+        type=exclude_glob_pattern,
+        metavar="PATTERN",
+        help=(
+            "gitignore-style patterns to exclude, e.g. '*.log' 'fixtures/large/' "
+            "'**/tmp/*'. Quote them so your shell does not expand them"
+        ),
+    )
+    parser.add_argument(
+        "--respect-gitignore",
+        action="store_true",
+        help="Skip files and directories ignored by .gitignore files in the scanned tree",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help=(
+            "Number of threads used to scan directories in parallel (default: 1). "
+            "Helps most on slow or network-mounted file systems."
+        ),
+    )
+    parser.add_argument(
+        "--backend",
+        choices=("scandir", "fd"),
+        default="scandir",
+        help=(
+            "Directory walker: 'scandir' (default, portable) or 'fd', which works "
+            "relative to open directory descriptors and only builds full paths when "
+            "needed (POSIX only, serial, not with --cache or --watch)"
+        ),
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=None,
+        metavar="PATH",
+        help=(
+            "Keep a scan index in this SQLite file and only rescan directories "
+            "whose modification time changed since the last run"
+        ),
+    )
+    parser.add_argument(
+        "--cache-verify",
+        action="store_true",
+        help=(
+            "With --cache, stat every cached file again so files edited in place "
+            "(which leave their directory's mtime alone) get their new size; "
+            "slower, but no directory is listed again"
+        ),
+    )
+    parser.add_argument(
+        "--disk-usage",
+        action="store_true",
+        help=(
+            "Also report space allocated on disk (like `du`): sparse files count "
+            "only their used blocks and hardlinked files are counted once"
+        ),
+    )
+    parser.add_argument(
+        "--duplicates",
+        action="store_true",
+        help=(
+            "Find files with identical content and report the space they waste "
+            "(hashing uses --workers processes)"
+        ),
+    )
+    parser.add_argument(
+        "--lines",
+        action="store_true",
+        help=(
+            "Count lines of text, overall and per extension with --by-ext "
+            "(binary files are skipped; reading uses --workers processes)"
+        ),
+    )
+    parser.add_argument(
+        "--tree",
+        action="store_true",
+        help="Show a du-style tree of cumulative directory sizes",
+    )
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        default=None,
+        help="With --tree: deepest directory level to report (root is 0; default: no limit)",
+    )
+    parser.add_argument(
+        "--tree-top",
+        type=int,
+        default=10,
+        help="With --tree: largest subdirectories shown per directory (default: 10)",
+    )
+    parser.add_argument(
+        "--histogram",
+        action="store_true",
+        help=(
+            "Show the file-size distribution overall and per extension: p50/p90/p99 "
+            "(within 1%%) and file counts per power-of-two size bucket"
+        ),
+    )
     parser.add_argument(
         "--by-ext",
         action="store_true",
@@ -263,11 +4761,80 @@ def build_parser() -> argparse.ArgumentParser:
         default=0,
         help="Show the N largest files (0 to disable)",
     )
+    parser.add_argument(
+        "--estimate",
+        action="store_true",
+        help=(
+            "Estimate the total (and --by-ext) from random samples within --time-budget, "
+            "with 95%% confidence intervals; exact if the whole tree fits in the budget"
+        ),
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        default=10.0,
+        help="With --estimate: seconds to spend refining the estimate (default: 10)",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help=(
+            "Scan once, then keep totals up to date from file system change events "
+            "and print a JSON snapshot per line whenever they change (Ctrl+C to stop)"
+        ),
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=5.0,
+        help="With --watch: minimum seconds between snapshots (default: 5)",
+    )
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="With --watch: use the portable stat() poller instead of inotify",
+    )
+    parser.add_argument(
+        "--save-snapshot",
+        metavar="PATH",
+        help="Also write a compact sorted binary snapshot of every file's path and size",
+    )
+    parser.add_argument(
+        "--diff",
+        nargs=2,
+        metavar=("OLD", "NEW"),
+        help=(
+            "Compare two --save-snapshot files instead of scanning: added, removed and "
+            "resized files plus per-directory deltas (--top, --tree-top, --max-depth, "
+            "--json and --ndjson apply)"
+        ),
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help=(
+            "Report per-phase wall/CPU time, directories and files visited, stat() "
+            "calls, skipped errors and peak memory (a \"stats\" key with --json)"
+        ),
+    )
+    parser.add_argument(
+        "--stats-memory",
+        action="store_true",
+        help="With --stats: also trace Python allocations with tracemalloc (slower)",
+    )
     parser.add_argument(
         "--json",
         action="store_true",
         help="Output results as JSON instead of human-readable text",
     )
+    parser.add_argument(
+        "--ndjson",
+        action="store_true",
+        help=(
+            "Stream one JSON record per line while scanning: a \"file\" record per "
+            "file, a \"dir\" record per directory with --tree, then a \"summary\""
+        ),
+    )
     return parser
 
 
@@ -281,10 +4848,88 @@ def main(argv: Optional[List[str]] = None) -> int:
     parser = build_parser()
     args = parser.parse_args(argv)
 
-    # Resolve and validate the target path
-    target_path = Path(args.path).resolve()
-    if not target_path.exists() or not target_path.is_dir():
-        print(f"Error: path does not exist or is not a directory: {target_path}", file=sys.stderr)
+    if args.diff:
+        if args.max_depth is not None and args.max_depth < 0:
+            print("Error: --max-depth must be 0 or greater", file=sys.stderr)
+            return 2
+        return diff_command(
+            old_path=Path(args.diff[0]),
+            new_path=Path(args.diff[1]),
+            top_n=args.top if args.top > 0 else 10,
+            top_dirs=args.tree_top,
+            max_depth=args.max_depth,
+            output="ndjson" if args.ndjson else "json" if args.json else "text",
+        )
+
+    # Resolve and validate the target path(s)
+    roots = [Path(path).resolve() for path in args.path]
+    for target_path in roots:
+        if not target_path.exists() or not target_path.is_dir():
+            print(f"Error: path does not exist or is not a directory: {target_path}", file=sys.stderr)
+            return 2
+    for index, root in enumerate(roots):
+        for other in roots[index + 1:]:
+            if root == other or root in other.parents or other in root.parents:
+                print(f"Error: --path roots overlap: {root} and {other}", file=sys.stderr)
+                return 2
+    target_path = roots[0]
+    multi_root = len(roots) > 1
+    if multi_root and (
+        args.cache or args.watch or args.tree or args.duplicates or args.disk_usage
+        or args.save_snapshot or args.ndjson or args.stats or args.stats_memory or args.lines
+    ):
+        # Roots are scanned in other processes, which only send back totals
+        print(
+            "Error: several --path roots cannot be combined with --cache, --watch, --tree, "
+            "--duplicates, --disk-usage, --save-snapshot, --ndjson, --stats or --lines",
+            file=sys.stderr,
+        )
+        return 2
+
+    if args.backend == "fd":
+        if not fd_backend_available():
+            print("Error: --backend fd is not supported on this platform", file=sys.stderr)
+            return 2
+        if args.workers > 1 or args.cache or args.watch:
+            print(
+                "Error: --backend fd cannot be combined with --workers, --cache or --watch",
+                file=sys.stderr,
+            )
+            return 2
+
+    if args.device_workers < 1:
+        print("Error: --device-workers must be at least 1", file=sys.stderr)
+        return 2
+
+    if args.workers < 1:
+        print("Error: --workers must be at least 1", file=sys.stderr)
+        return 2
+
+    if args.max_depth is not None and args.max_depth < 0:
+        print("Error: --max-depth must be 0 or greater", file=sys.stderr)
+        return 2
+
+    if args.cache and (args.exclude_glob or args.respect_gitignore):
+        # Editing a .gitignore does not change its directory's mtime, so the
+        # cache could silently keep stale results
+        print(
+            "Error: --cache cannot be combined with --exclude-glob/--respect-gitignore",
+            file=sys.stderr,
+        )
+        return 2
+
+    if args.cache_verify and not args.cache:
+        print("Error: --cache-verify only applies together with --cache", file=sys.stderr)
+        return 2
+
+    if args.cache and args.disk_usage:
+        # The cache only records apparent sizes and cannot dedup hardlinks
+        # across directories it did not rescan.
+        print("Error: --cache cannot be combined with --disk-usage", file=sys.stderr)
+        return 2
+
+    if args.json and args.ndjson:
+        print("Error: choose either --json or --ndjson", file=sys.stderr)
         return 2
 
     # Build the set of excluded directory names
@@ -292,75 +4937,392 @@ def main(argv: Optional[List[str]] = None) -> int:
     if not args.no_default_excludes:
         excluded |= default_excluded_dirs()
 
-    # 1) Traverse file system and collect file info
-    file_paths = iter_files(
-        root=target_path,
-        excluded_dirs=excluded,
-        include_hidden=args.include_hidden,
-        follow_symlinks=args.follow_symlinks,
-    )
-    files_list = list(collect_file_info(file_paths))
+    if args.estimate:
+        if (
+            multi_root or args.watch or args.cache or args.duplicates or args.tree
+            or args.disk_usage or args.save_snapshot or args.ndjson or args.stats
+            or args.histogram or args.lines or args.top or args.backend != "scandir"
+        ):
+            print(
+                "Error: --estimate supports --by-ext and --json only (plus the "
+                "traversal options)",
+                file=sys.stderr,
+            )
+            return 2
+        if args.time_budget <= 0:
+            print("Error: --time-budget must be greater than 0", file=sys.stderr)
+            return 2
+        estimator = SizeEstimator(
+            target_path,
+            excluded,
+            args.include_hidden,
+            args.follow_symlinks,
+            ignore=IgnoreState.for_root(args.exclude_glob, args.respect_gitignore),
+            one_file_system=args.one_file_system,
+        )
+        return estimate_command(target_path, estimator, args.time_budget, args.by_ext, args.json)
+
+    if args.watch:
+        if (
+            args.cache or args.duplicates or args.tree or args.disk_usage
+            or args.stats or args.ndjson or args.save_snapshot or args.histogram or args.lines
+        ):
+            # (--watch already prints one JSON record per line)
+            print(
+                "Error: --watch supports --by-ext and --top only (not --cache, --duplicates, "
+                "--tree, --disk-usage, --stats, --ndjson, --save-snapshot, --histogram or --lines)",
+                file=sys.stderr,
+            )
+            return 2
+        if args.interval <= 0:
+            print("Error: --interval must be greater than 0", file=sys.stderr)
+            return 2
+        return watch_command(
+            root=target_path,
+            excluded_dirs=excluded,
+            include_hidden=args.include_hidden,
+            follow_symlinks=args.follow_symlinks,
+            ignore=IgnoreState.for_root(args.exclude_glob, args.respect_gitignore),
+            interval=args.interval,
+            top_n=max(args.top, 0),
+            by_ext=args.by_ext,
+            force_polling=args.poll,
+            one_file_system=args.one_file_system,
+        )
 
-    # 2) Compute total size
-    total_size_bytes = sum(f.size_bytes for f in files_list)
+    # Optional instrumentation; `phase` is a no-op context without --stats
+    stats = ScanStats(trace_memory=args.stats_memory) if args.stats or args.stats_memory else None
+
+    def phase(name: str) -> ContextManager[None]:
+        return stats.phase(name) if stats is not None else nullcontext()
+
+    # 1) Traverse file system and stream file info through the aggregator.
+    #    Nothing is collected into a list, so memory stays flat no matter how
+    #    many files the tree contains.
+    aggregator = ScanAggregator(top_n=max(args.top, 0))
+    duplicates = DuplicateFinder(workers=args.workers) if args.duplicates else None
+    listeners = [duplicates.add] if duplicates is not None else []
+    line_counter = LineCounter(workers=args.workers) if args.lines else None
+    if line_counter is not None:
+        listeners.append(line_counter.add)
+    visited = VisitedDirectories() if args.follow_symlinks else None
+    rollup = DirectoryRollup(target_path, args.max_depth) if args.tree else None
+    if rollup is not None:
+        listeners.append(rollup.add)
+    histogram = SizeHistogram() if args.histogram else None
+    if histogram is not None and not multi_root:
+        listeners.append(histogram.add)
+    writer: Optional[NdjsonWriter] = None
+    if args.ndjson:
+        # Records go out as the walk progresses; the header is flushed
+        # immediately so consumers see output before the scan is done
+        writer = NdjsonWriter(sys.stdout)
+        writer.write({"type": "scan", "path": str(target_path)})
+        writer.flush()
+        listeners.append(writer.file)
+    on_directory = writer.flush_if_due if writer is not None else None
+    hardlinks = HardlinkTracker() if args.disk_usage else None
+    snapshot: Optional[SnapshotWriter] = None
+    if args.save_snapshot:
+        snapshot = SnapshotWriter(Path(args.save_snapshot).resolve(), target_path)
+        listeners.append(snapshot.add)
+    with phase("scan"):
+        if multi_root:
+            # One worker process per root; partial results are merged in
+            # --path order, so the report doesn't depend on timing
+            jobs = [
+                RootScanJob(
+                    root=str(root),
+                    excluded_dirs=excluded,
+                    include_hidden=args.include_hidden,
+                    follow_symlinks=args.follow_symlinks,
+                    workers=args.workers,
+                    one_file_system=args.one_file_system,
+                    exclude_glob=list(args.exclude_glob),
+                    respect_gitignore=args.respect_gitignore,
+                    top_n=aggregator.top_n,
+                    backend=args.backend,
+                    histogram=histogram is not None,
+                )
+                for root in roots
+            ]
+            root_results = scan_roots(jobs, device_workers=args.device_workers)
+            for result in root_results:
+                aggregator.merge(result.aggregator)
+                if histogram is not None and result.histogram is not None:
+                    histogram.merge(result.histogram)
+                if visited is not None:
+                    visited.cycles_skipped += result.cycles_skipped
+                    visited.duplicates_skipped += result.duplicates_skipped
+        elif args.cache:
+            # Incremental scan: unchanged directories come from the cache file.
+            # (The cached walk is serial; --workers does not apply here.)
+            settings = {
+                "root": str(target_path),
+                "excluded_dirs": sorted(excluded),
+                "include_hidden": bool(args.include_hidden),
+                "follow_symlinks": bool(args.follow_symlinks),
+            }
+            if args.one_file_system:
+                settings["one_file_system"] = True
+            with ScanCache(Path(args.cache), settings, verify=args.cache_verify) as cache:
+                cache.scan(
+                    root=target_path,
+                    excluded_dirs=excluded,
+                    include_hidden=args.include_hidden,
+                    follow_symlinks=args.follow_symlinks,
+                    aggregator=aggregator,
+                    listeners=listeners,
+                    visited=visited,
+                    stats=stats,
+                    one_file_system=args.one_file_system,
+                    on_directory=on_directory,
+                )
+            print(
+                f"Cache: reused {cache.dirs_reused} directories, "
+                f"rescanned {cache.dirs_rescanned}",
+                file=sys.stderr,
+            )
+        elif args.backend == "fd":
+            # Descriptor-relative walk; FileInfo objects (and full paths) are
+            # only built when something needs every file individually
+            for directory, records in iter_directory_stats_fd(
+                target_path,
+                excluded,
+                args.include_hidden,
+                args.follow_symlinks,
+                visited=visited,
+                ignore=IgnoreState.for_root(args.exclude_glob, args.respect_gitignore),
+                stats=stats,
+                one_file_system=args.one_file_system,
+                hardlinks=hardlinks,
+                on_directory=on_directory,
+            ):
+                if not listeners:
+                    aggregator.add_directory(directory, records, disk_usage=args.disk_usage)
+                    continue
+                for info in fd_file_infos(directory, records, disk_usage=args.disk_usage):
+                    aggregator.add(info)
+                    for listener in listeners:
+                        listener(info)
+        else:
+            file_entries = iter_file_entries(
+                root=target_path,
+                excluded_dirs=excluded,
+                include_hidden=args.include_hidden,
+                follow_symlinks=args.follow_symlinks,
+                workers=args.workers,
+                visited=visited,
+                ignore=IgnoreState.for_root(args.exclude_glob, args.respect_gitignore),
+                stats=stats,
+                one_file_system=args.one_file_system,
+                on_directory=on_directory,
+            )
+            for info in collect_file_info(file_entries, hardlinks=hardlinks, stats=stats):
+                aggregator.add(info)
+                for listener in listeners:
+                    listener(info)
+
+    if snapshot is not None:
+        with phase("snapshot"):
+            snapshot.close()
+        print(f"Snapshot: wrote {snapshot.file_count} files to {snapshot.path}", file=sys.stderr)
+
+    # 2) Total size
+    total_size_bytes = aggregator.total_bytes
 
     # 3) Optional breakdowns
     by_ext: Optional[Dict[str, int]] = None
-    if args.by_ext:
-        by_ext = summarize_by_extension(files_list)
-
+    by_ext_allocated: Dict[str, int] = {}
     top_files: Optional[List[FileInfo]] = None
-    if args.top and args.top > 0:
-        top_files = top_n_largest(files_list, args.top)
+    with phase("summarize"):
+        if args.by_ext:
+            by_ext = aggregator.by_extension()
+            by_ext_allocated = aggregator.by_extension_allocated()
+
+        if args.top and args.top > 0:
+            top_files = aggregator.top_files()
+
+        if rollup is not None:
+            rollup.finish()
+
+    duplicate_groups: Optional[List[DuplicateGroup]] = None
+    if duplicates is not None:
+        with phase("duplicates"):
+            duplicate_groups = duplicates.find()
+
+    if line_counter is not None:
+        with phase("lines"):
+            line_counter.count()
 
     # 4) Output
-    if args.json:
-        # JSON-friendly structure
-        output = {
-            "path": str(target_path),
-            "total_size_bytes": total_size_bytes,
-            "total_size_human": human_readable_size(total_size_bytes),
-            "excluded_dirs": sorted(list(excluded)),
-            "include_hidden": bool(args.include_hidden),
-            "follow_symlinks": bool(args.follow_symlinks),
-        }
-        if by_ext is not None:
-            output["by_extension_bytes"] = dict(sorted(by_ext.items(), key=lambda kv: kv[1], reverse=True))
-        if top_files is not None:
-            output["top_files"] = [
-                {
-                    "path": f.path,
-                    "size_bytes": f.size_bytes,
-                    "size_human": human_readable_size(f.size_bytes),
-                    "extension": f.extension,
-                }
-                for f in top_files
-            ]
-        print(json.dumps(output, indent=2))
+    if args.json or args.ndjson:
+        # JSON-friendly structure (the same one ScanResult.as_dict() returns)
+        output = build_report(
+            target_path,
+            aggregator,
+            excluded,
+            args.include_hidden,
+            args.follow_symlinks,
+            one_file_system=args.one_file_system,
+            by_ext=args.by_ext,
+            disk_usage=args.disk_usage,
+            visited=visited,
+            hardlinks=hardlinks,
+            histogram=histogram,
+            rollup=rollup if writer is None else None,
+            tree_top=args.tree_top,
+            root_results=root_results if multi_root else None,
+            lines=line_counter,
+        )
+        if duplicate_groups is not None:
+            output["duplicates"] = {
+                "reclaimable_bytes": sum(g.reclaimable_bytes for g in duplicate_groups),
+                "bytes_hashed": duplicates.bytes_read if duplicates else 0,
+                "same_file_paths_skipped": duplicates.same_file_paths if duplicates else 0,
+                "groups": [
+                    {
+                        "size_bytes": g.size_bytes,
+                        "reclaimable_bytes": g.reclaimable_bytes,
+                        "paths": g.paths,
+                        **({"same_file": g.same_file} if g.same_file else {}),
+                    }
+                    for g in duplicate_groups
+                ],
+            }
+        if writer is not None:
+            # NDJSON: per-directory records (if any), then the summary last
+            with phase("output"):
+                if rollup is not None:
+                    for record in rollup.records():
+                        writer.write(record)
+            if stats is not None:
+                output["stats"] = stats.as_dict()
+            writer.write({"type": "summary", **output})
+            writer.flush()
+            return 0
+        if stats is not None:
+            output["stats"] = stats.as_dict()
+        # The report is encoded once, with the stats already in it, so the
+        # "encode" phase itself can only be reported afterwards (on stderr,
+        # and in `stats.phases` for library callers)
+        with phase("encode"):
+            text = json.dumps(output, indent=2)
+        with phase("output"):
+            print(text)
+        if stats is not None:
+            encode = stats.phases["encode"]
+            print(
+                f"Stats: encoding the JSON report took {encode['wall_s']:.3f}s wall, "
+                f"{encode['cpu_s']:.3f}s CPU",
+                file=sys.stderr,
+            )
         return 0
 
     # Human-readable text output
-    print(f"Path: {target_path}")
-    print(f"Excluded directories: {', '.join(sorted(list(excluded))) or '(none)'}")
-    print(f"Include hidden: {'yes' if args.include_hidden else 'no'} | Follow symlinks: {'yes' if args.follow_symlinks else 'no'}")
-    print("")
-    print(f"Total size: {human_readable_size(total_size_bytes)} ({total_size_bytes} bytes)")
-
-    if by_ext is not None:
-        print("\nBreakdown by file extension (largest first):")
-        for ext, size in sorted(by_ext.items(), key=lambda kv: kv[1], reverse=True):
-            print(f"  {ext:>8}: {human_readable_size(size)} ({size} bytes)")
-
-    if top_files is not None and len(top_files) > 0:
-        print(f"\nTop {len(top_files)} largest files:")
-        for f in top_files:
-            print(f"  {human_readable_size(f.size_bytes):>12}  {f.path}")
+    with phase("output"):
+        if multi_root:
+            print(f"Paths: {', '.join(str(root) for root in roots)}")
+        else:
+            print(f"Path: {target_path}")
+        print(f"Excluded directories: {', '.join(sorted(list(excluded))) or '(none)'}")
+        print(f"Include hidden: {'yes' if args.include_hidden else 'no'} | Follow symlinks: {'yes' if args.follow_symlinks else 'no'}")
+        if visited is not None:
+            print(
+                f"Symlinked directories skipped: {visited.cycles_skipped} cycle(s), "
+                f"{visited.duplicates_skipped} duplicate path(s)"
+            )
+        print("")
+        if multi_root:
+            for result in root_results:
+                subtotal = result.aggregator.total_bytes
+                print(
+                    f"  {human_readable_size(subtotal):>12}  {result.root} "
+                    f"({result.aggregator.file_count} files)"
+                )
+        print(f"Total size: {human_readable_size(total_size_bytes)} ({total_size_bytes} bytes)")
+        if args.disk_usage:
+            allocated = aggregator.allocated_bytes
+            print(f"Allocated on disk: {human_readable_size(allocated)} ({allocated} bytes)")
+            print(f"Hardlinks counted once: {hardlinks.skipped if hardlinks else 0} extra link(s) skipped")
+        if line_counter is not None:
+            lines_by_ext = line_counter.by_extension()
+            print(
+                f"Lines of text: {line_counter.total_lines} in {line_counter.text_files} files "
+                f"({line_counter.binary_files} binary file(s) skipped)"
+            )
+
+        if by_ext is not None:
+            print("\nBreakdown by file extension (largest first):")
+            for ext, size in sorted(by_ext.items(), key=lambda kv: kv[1], reverse=True):
+                line = f"  {ext:>8}: {human_readable_size(size)} ({size} bytes)"
+                if args.disk_usage:
+                    line += f" | allocated {human_readable_size(by_ext_allocated.get(ext, 0))}"
+                if line_counter is not None:
+                    line += f" | {lines_by_ext.get(ext, 0)} lines"
+                print(line)
+
+        if top_files is not None and len(top_files) > 0:
+            print(f"\nTop {len(top_files)} largest files:")
+            for f in top_files:
+                if f.allocated_bytes is not None:
+                    print(
+                        f"  {human_readable_size(f.size_bytes):>12}  "
+                        f"{human_readable_size(f.allocated_bytes):>12} alloc  {f.path}"
+                    )
+                else:
+                    print(f"  {human_readable_size(f.size_bytes):>12}  {f.path}")
+
+        if histogram is not None:
+            print("\nFile-size distribution (quantiles within 1%):")
+            for line in histogram.lines():
+                print(line)
+
+        if rollup is not None:
+            depth = "unlimited" if args.max_depth is None else str(args.max_depth)
+            print(f"\nDirectory tree (max depth {depth}, top {args.tree_top} per directory):")
+            for line in rollup.lines(top_k=args.tree_top):
+                print(line)
+
+        if duplicate_groups is not None:
+            reclaimable = sum(g.reclaimable_bytes for g in duplicate_groups)
+            print(
+                f"\nDuplicate files: {len(duplicate_groups)} group(s), "
+                f"{human_readable_size(reclaimable)} ({reclaimable} bytes) reclaimable"
+            )
+            if duplicates is not None and duplicates.same_file_paths:
+                print(
+                    f"  ({duplicates.same_file_paths} path(s) to an already listed file "
+                    "were not counted: hardlinks or symlinked duplicates)"
+                )
+            for g in duplicate_groups:
+                print(
+                    f"  {len(g.paths)} x {human_readable_size(g.size_bytes)} "
+                    f"(reclaimable {human_readable_size(g.reclaimable_bytes)}):"
+                )
+                for path in g.paths:
+                    print(f"    {path}")
+                    for alias in g.same_file.get(path, []):
+                        print(f"      (same file) {alias}")
+
+    if stats is not None:
+        print("\nScan statistics:")
+        for line in stats.lines():
+            print(line)
 
     return 0
 
 
 if __name__ == "__main__":
     # Delegate to main() so we can test/import cleanly
-    raise SystemExit(main())
+    try:
+        exit_code = main()
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # The reader closed the pipe (e.g. `| head`). Point stdout at devnull
+        # so Python's final flush at exit doesn't raise a second time.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        exit_code = 1
+    raise SystemExit(exit_code)
 
 
@@ -0,0 +1,72 @@
+"""Regression tests for the asyncio scan() API (AsyncScan).
+
+Run from the project folder:
+    python -m unittest discover -s tests
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import codebase_size  # noqa: E402
+from codebase_size import ScanOptions, VisitedDirectories, iter_file_entries, scan  # noqa: E402
+from test_walkers import CountingScans, make_tree  # noqa: E402
+
+
+class SymlinkedAsyncScanTests(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        (self.root / "real").mkdir()
+        real_dirs = make_tree(self.root / "real")
+        (self.root / "links").mkdir()
+        self.symlinks = 5
+        for index in range(self.symlinks):
+            os.symlink(self.root / "real", self.root / "links" / f"l{index}")
+        self.unique_dirs = real_dirs + 2  # root + links + the real subtree
+
+    def run_scan(self, workers: int):
+        async def collect(scanner):
+            paths = []
+            async for files in scanner:
+                paths.extend(info.path for info in files)
+            return paths
+
+        counter = CountingScans()
+        options = ScanOptions(excluded_dirs=set(), follow_symlinks=True, workers=workers)
+        scanner = scan(self.root, options)
+        with mock.patch.object(codebase_size, "_scan_directory", counter):
+            paths = asyncio.run(collect(scanner))
+        return scanner, paths, counter.calls
+
+    def test_matches_serial_walker(self) -> None:
+        serial = [
+            entry.path
+            for entry in iter_file_entries(
+                self.root, set(), False, True, visited=VisitedDirectories()
+            )
+        ]
+        _, paths, _ = self.run_scan(workers=4)
+        self.assertEqual(paths, serial)
+
+    def test_duplicates_do_not_leak_run_ahead_slots(self) -> None:
+        for _ in range(3):
+            scanner, _, calls = self.run_scan(workers=4)
+            # Every submitted job was consumed, so nothing holds a slot
+            self.assertEqual(scanner._ahead, 0)
+            self.assertEqual(scanner._waiting, [])
+            # At most one wasted listing per duplicate path, never a subtree
+            self.assertLessEqual(calls, self.unique_dirs + self.symlinks)
+            self.assertEqual(scanner.result.visited.duplicates_skipped, self.symlinks)
+
+
+if __name__ == "__main__":
+    unittest.main()
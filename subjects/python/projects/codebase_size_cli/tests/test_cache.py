@@ -0,0 +1,112 @@
+"""Regression tests for --cache (ScanCache).
+
+Run from the project folder:
+    python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import codebase_size  # noqa: E402
+
+
+def run_json(*argv: str) -> dict:
+    """Run the CLI with --json and return the parsed report."""
+
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(io.StringIO()):
+        code = codebase_size.main([*argv, "--json"])
+    assert code == 0, code
+    return json.loads(out.getvalue())
+
+
+def age_tree(root: Path) -> None:
+    """Move every mtime well outside the cache's "racy" window."""
+
+    old = 1_000_000_000
+    for dirpath, _dirnames, filenames in os.walk(root):
+        for name in filenames:
+            os.utime(os.path.join(dirpath, name), (old, old))
+        os.utime(dirpath, (old, old))
+
+
+class ScanCacheTests(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name) / "tree"
+        (self.root / "sub").mkdir(parents=True)
+        (self.root / "sub" / "log.txt").write_bytes(b"abc")
+        (self.root / "a.py").write_bytes(b"x" * 7)
+        self.db = str(Path(tmp.name) / "cache.db")
+        age_tree(self.root)
+
+    def test_unchanged_directories_reuse_stored_subtotals(self) -> None:
+        first = run_json("--path", str(self.root), "--cache", self.db, "--by-ext")
+        # Without --cache-verify no cached file is stat'ed again
+        with mock.patch.object(codebase_size.os, "scandir", side_effect=AssertionError("listed")):
+            cached = run_json("--path", str(self.root), "--cache", self.db, "--by-ext", "--stats")
+        self.assertEqual(cached["total_size_bytes"], first["total_size_bytes"])
+        self.assertEqual(cached["by_extension_bytes"], first["by_extension_bytes"])
+        self.assertEqual(cached["stats"]["stat_calls"], 2)  # one per directory
+
+        # ... which is why an in-place edit is not seen (see the README)
+        with open(self.root / "sub" / "log.txt", "ab") as handle:
+            handle.write(b"defghij")
+        self.assertEqual(run_json("--path", str(self.root), "--cache", self.db)["total_size_bytes"], 10)
+
+    def test_in_place_edit_is_seen_with_verify(self) -> None:
+        first = run_json("--path", str(self.root), "--cache", self.db)
+        self.assertEqual(first["total_size_bytes"], 10)
+
+        # Appending changes the file's size but not its directory's mtime
+        dir_mtime = os.stat(self.root / "sub").st_mtime_ns
+        with open(self.root / "sub" / "log.txt", "ab") as handle:
+            handle.write(b"defghij")
+        self.assertEqual(os.stat(self.root / "sub").st_mtime_ns, dir_mtime)
+
+        full = run_json("--path", str(self.root))
+        cached = run_json("--path", str(self.root), "--cache", self.db, "--cache-verify")
+        self.assertEqual(full["total_size_bytes"], 17)
+        self.assertEqual(cached["total_size_bytes"], full["total_size_bytes"])
+
+        # The new size and subtotals are written back, so a plain run agrees too
+        again = run_json("--path", str(self.root), "--cache", self.db)
+        self.assertEqual(again["total_size_bytes"], 17)
+
+    def test_top_n_uses_fresh_sizes_with_verify(self) -> None:
+        run_json("--path", str(self.root), "--cache", self.db, "--top", "1")
+        stale = run_json("--path", str(self.root), "--cache", self.db, "--top", "1")
+        self.assertEqual(stale["top_files"][0]["size_bytes"], 7)  # replayed from the cache
+        with open(self.root / "sub" / "log.txt", "ab") as handle:
+            handle.write(b"0123456789")
+        cached = run_json("--path", str(self.root), "--cache", self.db, "--top", "1", "--cache-verify")
+        full = run_json("--path", str(self.root), "--top", "1")
+        self.assertEqual(cached["top_files"], full["top_files"])
+        self.assertEqual(cached["top_files"][0]["size_bytes"], 13)
+
+    def test_duplicates_from_cache_keep_same_file_collapse(self) -> None:
+        os.link(self.root / "a.py", self.root / "sub" / "b.py")
+        age_tree(self.root)
+        full = run_json("--path", str(self.root), "--duplicates")
+        run_json("--path", str(self.root), "--cache", self.db, "--duplicates")
+        cached = run_json("--path", str(self.root), "--cache", self.db, "--duplicates")
+        self.assertEqual(cached["duplicates"], full["duplicates"])
+
+    def test_verify_needs_cache(self) -> None:
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(codebase_size.main(["--path", str(self.root), "--cache-verify"]), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+"""Regression tests for --duplicates (DuplicateFinder).
+
+Run from the project folder:
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import codebase_size  # noqa: E402
+from codebase_size import DuplicateFinder, collect_file_info, iter_file_entries  # noqa: E402
+
+
+def find_duplicates(root: Path, follow_symlinks: bool = False) -> DuplicateFinder:
+    finder = DuplicateFinder()
+    entries = iter_file_entries(root, set(), False, follow_symlinks)
+    for info in collect_file_info(entries):
+        finder.add(info)
+    return finder
+
+
+class DuplicateFinderTests(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+
+    def test_hardlinks_are_not_reclaimable(self) -> None:
+        (self.root / "a").write_bytes(b"same content")
+        os.link(self.root / "a", self.root / "b")
+        finder = find_duplicates(self.root)
+        self.assertEqual(finder.find(), [])
+        self.assertEqual(finder.same_file_paths, 1)
+        # Nothing to compare, so nothing is read
+        self.assertEqual(finder.bytes_read, 0)
+
+    def test_hardlink_next_to_real_copy(self) -> None:
+        (self.root / "a").write_bytes(b"same content")
+        os.link(self.root / "a", self.root / "b")
+        (self.root / "c").write_bytes(b"same content")
+        groups = find_duplicates(self.root).find()
+        self.assertEqual(len(groups), 1)
+        group = groups[0]
+        self.assertEqual(len(group.paths), 2)
+        self.assertEqual(group.reclaimable_bytes, len(b"same content"))
+        aliases = [alias for names in group.same_file.values() for alias in names]
+        self.assertEqual(len(aliases), 1)
+
+    def test_symlinked_directory_is_same_file(self) -> None:
+        (self.root / "real").mkdir()
+        (self.root / "real" / "f.txt").write_bytes(b"data" * 10)
+        os.symlink(self.root / "real", self.root / "link")
+        finder = find_duplicates(self.root, follow_symlinks=True)
+        self.assertEqual(finder.find(), [])
+
+    def test_symlinked_file_is_same_file(self) -> None:
+        (self.root / "f.txt").write_bytes(b"data" * 10)
+        os.symlink(self.root / "f.txt", self.root / "alias.txt")
+        finder = find_duplicates(self.root, follow_symlinks=True)
+        self.assertEqual(finder.find(), [])
+        self.assertEqual(finder.same_file_paths, 1)
+
+    def test_bytes_read_counts_only_real_reads(self) -> None:
+        big = codebase_size.PARTIAL_HASH_BLOCK * 3
+        (self.root / "x").write_bytes(b"1" * big)
+        (self.root / "y").write_bytes(b"1" * big)
+        (self.root / "gone").write_bytes(b"1" * big)
+        finder = find_duplicates(self.root)
+        # Vanishes between the scan and hashing: it must not count as read
+        (self.root / "gone").unlink()
+        groups = finder.find()
+        self.assertEqual(len(groups), 1)
+        partial = 2 * codebase_size.PARTIAL_HASH_BLOCK
+        self.assertEqual(finder.bytes_read, 2 * partial + 2 * big)
+
+
+if __name__ == "__main__":
+    unittest.main()
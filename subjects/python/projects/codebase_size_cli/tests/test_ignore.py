@@ -0,0 +1,70 @@
+"""Regression tests for gitignore-style patterns (--exclude-glob, .gitignore).
+
+Run from the project folder:
+    python -m unittest discover -s tests
+"""
+
+import contextlib
+import fnmatch
+import io
+import re
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import codebase_size  # noqa: E402
+from codebase_size import IgnoreRules, IgnoreState, _glob_to_regex, iter_file_entries  # noqa: E402
+
+
+class GlobTranslationTests(unittest.TestCase):
+    def test_bracket_edge_cases_compile_and_match_like_fnmatch(self) -> None:
+        cases = {
+            "foo[]bar": ["foo[]bar", "foo]bar"],
+            "[]]x": ["]x", "]]x"],
+            "[!]]x": ["ax", "]x"],
+            "[!]": ["[!]", "!"],
+            "a[b": ["a[b", "ab"],
+        }
+        for pattern, names in cases.items():
+            regex = re.compile(_glob_to_regex(pattern), re.DOTALL)
+            for name in names:
+                with self.subTest(pattern=pattern, name=name):
+                    self.assertEqual(
+                        bool(regex.fullmatch(name)), fnmatch.fnmatchcase(name, pattern)
+                    )
+
+
+class IgnoreRulesTests(unittest.TestCase):
+    def test_invalid_lines_are_dropped_not_fatal(self) -> None:
+        rules = IgnoreRules(["[z-a]\n", "*.log\n", "build/[z-a]/x\n", "tmp\n"])
+        self.assertEqual(rules.invalid, ["[z-a]", "build/[z-a]/x"])
+        self.assertTrue(rules.match("debug.log", False))
+        self.assertTrue(rules.match("tmp", True))
+        self.assertIsNone(rules.match("main.py", False))
+
+    def test_bad_gitignore_does_not_abort_scan(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        root = Path(tmp.name)
+        (root / ".gitignore").write_text("[z-a]\nfoo[]bar\n*.log\n")
+        (root / "keep.py").write_text("x")
+        (root / "drop.log").write_text("x")
+        (root / "foo[]bar").write_text("x")
+        state = IgnoreState.for_root([], respect_gitignore=True)
+        names = sorted(entry.name for entry in iter_file_entries(root, set(), False, False, ignore=state))
+        self.assertEqual(names, ["keep.py"])
+
+    def test_bad_exclude_glob_is_a_usage_error(self) -> None:
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err), self.assertRaises(SystemExit) as raised:
+            codebase_size.main(["--path", ".", "--exclude-glob", "[z-a]"])
+        self.assertEqual(raised.exception.code, 2)
+        self.assertIn("invalid glob pattern", err.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+"""Regression tests for --ndjson (NdjsonWriter).
+
+Run from the project folder:
+    python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import codebase_size  # noqa: E402
+from codebase_size import FileInfo, NdjsonWriter  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class NdjsonWriterTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        for target in ("_monotonic", "time.monotonic"):
+            patcher = mock.patch(f"codebase_size.{target}", self.clock)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.out = io.StringIO()
+        self.writer = NdjsonWriter(self.out, max_delay=0.25)
+
+    def lines(self):
+        return [json.loads(line) for line in self.out.getvalue().splitlines()]
+
+    def test_slow_trickle_is_flushed_by_max_delay(self) -> None:
+        self.writer.file(FileInfo("/a/one.py", 1, ".py"))
+        self.assertEqual(self.out.getvalue(), "")  # still buffered
+        # A few records, far apart: each must go out once the buffer is stale
+        for index in range(3):
+            self.clock.now += 1.0
+            self.writer.file(FileInfo(f"/a/{index}.py", index, ".py"))
+            self.assertEqual(len(self.lines()), index + 2)
+
+    def test_flush_if_due(self) -> None:
+        self.writer.flush_if_due()  # nothing queued: no write
+        self.writer.file(FileInfo("/a/one.py", 1, ".py"))
+        self.writer.flush_if_due()
+        self.assertEqual(self.out.getvalue(), "")  # not stale yet
+        self.clock.now += 1.0
+        self.writer.flush_if_due()
+        self.assertEqual(len(self.lines()), 1)
+
+    def test_fast_records_stay_buffered(self) -> None:
+        for index in range(100):
+            self.clock.now += 0.001
+            self.writer.write({"type": "file", "n": index})
+        self.assertEqual(self.out.getvalue(), "")
+        self.writer.flush()
+        self.assertEqual(len(self.lines()), 100)
+
+    def test_file_record_shape(self) -> None:
+        self.writer.file(FileInfo('/a/"q".txt', 7, ".txt", allocated_bytes=4096))
+        self.writer.flush()
+        self.assertEqual(
+            self.lines(),
+            [{"type": "file", "path": '/a/"q".txt', "size_bytes": 7,
+              "extension": ".txt", "allocated_bytes": 4096}],
+        )
+
+
+class ChunkRecorder(io.StringIO):
+    """stdout stand-in that remembers what each write contained."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.chunks = []
+
+    def write(self, text: str) -> int:
+        self.chunks.append(text)
+        return super().write(text)
+
+
+class QuietStretchTests(unittest.TestCase):
+    """A record queued before many slow, empty directories must not wait for the end."""
+
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name) / "root"
+        self.root.mkdir()
+        (self.root / "a.txt").write_bytes(b"x")
+        for index in range(5):
+            (self.root / f"empty{index}").mkdir()
+        self.db = str(Path(tmp.name) / "cache.db")
+
+    def run_ndjson(self, *extra: str) -> list:
+        clock = FakeClock()
+        real_scan = codebase_size._scan_directory
+
+        listed = []
+
+        def slow_scan(*args, **kwargs):
+            if listed:
+                clock.now += 1.0  # every listing after the root's takes a second
+            listed.append(args[0])
+            return real_scan(*args, **kwargs)
+
+        out = ChunkRecorder()
+        with mock.patch("codebase_size._monotonic", clock), \
+                mock.patch("codebase_size.time.monotonic", clock), \
+                mock.patch.object(codebase_size, "_scan_directory", slow_scan), \
+                mock.patch.object(codebase_size.sys, "stdout", out), \
+                contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(codebase_size.main(["--path", str(self.root), "--ndjson", *extra]), 0)
+        return out.chunks
+
+    def test_record_is_flushed_during_the_walk(self) -> None:
+        variants = [(), ("--workers", "2"), ("--cache", self.db)]
+        if codebase_size.fd_backend_available():
+            variants.append(("--backend", "fd"))
+        for extra in variants:
+            with self.subTest(extra=extra):
+                chunks = self.run_ndjson(*extra)
+                written = [chunk for chunk in chunks if "a.txt" in chunk]
+                self.assertEqual(len(written), 1)
+                self.assertNotIn('"type":"summary"', written[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+"""Tests for --save-snapshot and --diff (SnapshotWriter, SnapshotDiff).
+
+Run from the project folder:
+    python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import codebase_size  # noqa: E402
+from codebase_size import (  # noqa: E402
+    FileInfo,
+    SnapshotDiff,
+    SnapshotWriter,
+    _read_records,
+    diff_command,
+    open_snapshot,
+)
+
+
+def rel(*parts: str) -> str:
+    return os.sep.join(parts)
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.root = self.tmp / "root"
+
+    def write_snapshot(self, name: str, files: dict, run_records: int = 1 << 18) -> Path:
+        path = self.tmp / name
+        writer = SnapshotWriter(path, self.root, run_records=run_records)
+        for relative, size in files.items():
+            writer.add(FileInfo(str(self.root / relative), size, ""))
+        writer.close()
+        return path
+
+    def read_snapshot(self, path: Path):
+        header, handle = open_snapshot(path)
+        with handle:
+            records = [(key.replace(b"\0", b"/").decode(), size) for key, size in _read_records(handle)]
+        return header, records
+
+
+class SnapshotWriterTests(SnapshotTestCase):
+    FILES = {
+        rel("a.b", "y"): 1,
+        rel("a", "x"): 2,
+        rel("a", "deep", "z"): 3,
+        "top": 4,
+        rel("src", "pkg", "module_one.py"): 5,
+        rel("src", "pkg", "module_two.py"): 6,
+        rel("a", "w"): 7,
+    }
+
+    def test_round_trip_in_memory_and_with_spilled_runs(self) -> None:
+        for run_records in (1 << 18, 2):
+            with self.subTest(run_records=run_records):
+                path = self.write_snapshot("snap.bin", self.FILES, run_records)
+                header, records = self.read_snapshot(path)
+                self.assertEqual(header["file_count"], len(self.FILES))
+                self.assertEqual(header["total_bytes"], sum(self.FILES.values()))
+                # Subtrees are contiguous: everything under "a/" comes before "a.b/"
+                self.assertEqual(
+                    [name for name, _ in records],
+                    ["a/deep/z", "a/w", "a/x", "a.b/y", "src/pkg/module_one.py",
+                     "src/pkg/module_two.py", "top"],
+                )
+                # No temporary runs or partial files are left behind
+                self.assertEqual(sorted(p.name for p in self.tmp.iterdir()), ["snap.bin"])
+
+    def test_not_a_snapshot(self) -> None:
+        bogus = self.tmp / "bogus.bin"
+        bogus.write_bytes(b"hello world")
+        with self.assertRaises(ValueError):
+            open_snapshot(bogus)
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            self.assertEqual(diff_command(bogus, bogus, 5, 5, None, "text", out=io.StringIO()), 2)
+        self.assertIn("cannot read snapshot", err.getvalue())
+
+
+class SnapshotDiffTests(SnapshotTestCase):
+    OLD = {
+        rel("docs", "a.md"): 10,
+        rel("src", "app", "main.py"): 100,
+        rel("src", "app", "util.py"): 50,
+        rel("src", "lib", "gone.py"): 30,
+        "README": 5,
+    }
+    NEW = {
+        rel("docs", "a.md"): 10,
+        rel("src", "app", "main.py"): 160,
+        rel("src", "app", "util.py"): 50,
+        rel("src", "app", "new.py"): 20,
+        "README": 1,
+    }
+
+    def diff(self, **options) -> SnapshotDiff:
+        old = self.write_snapshot("old.bin", self.OLD)
+        new = self.write_snapshot("new.bin", self.NEW)
+        _, old_handle = open_snapshot(old)
+        _, new_handle = open_snapshot(new)
+        with old_handle, new_handle:
+            return SnapshotDiff(**options).run(_read_records(old_handle), _read_records(new_handle))
+
+    def test_counts_and_bytes(self) -> None:
+        diff = self.diff()
+        self.assertEqual(diff.counts, {"added": 1, "removed": 1, "resized": 2, "unchanged": 2})
+        self.assertEqual(diff.bytes, {"added": 20, "removed": -30, "resized": 56})
+        self.assertEqual(diff.root.delta_bytes, 46)
+        self.assertEqual([c.path for c in diff.top_changes()][:2], [rel("src", "app", "main.py"), rel("src", "lib", "gone.py")])
+
+    def test_directory_deltas_roll_up(self) -> None:
+        deltas = {d.path: d for d in self.diff(top_dirs=100).top_directories()}
+        self.assertEqual(deltas[rel("src", "app")].delta_bytes, 80)
+        self.assertEqual(deltas[rel("src", "lib")].delta_bytes, -30)
+        self.assertEqual(deltas["src"].delta_bytes, 50)
+        self.assertEqual((deltas["src"].added, deltas["src"].removed, deltas["src"].resized), (1, 1, 1))
+        self.assertEqual(deltas["."].delta_bytes, 46)
+        self.assertNotIn("docs", deltas)  # unchanged directories are not reported
+
+    def test_max_depth_folds_deeper_directories(self) -> None:
+        deltas = {d.path: d.delta_bytes for d in self.diff(top_dirs=100, max_depth=1).top_directories()}
+        self.assertEqual(deltas, {"src": 50, ".": 46})
+
+    def test_cli_save_snapshot_then_diff(self) -> None:
+        self.root.mkdir()
+        (self.root / "keep.txt").write_bytes(b"x" * 4)
+        (self.root / "grow.txt").write_bytes(b"x" * 4)
+        old = str(self.tmp / "old.bin")
+        new = str(self.tmp / "new.bin")
+        quiet = contextlib.redirect_stderr(io.StringIO())
+        with quiet, contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(codebase_size.main(["--path", str(self.root), "--save-snapshot", old]), 0)
+            (self.root / "grow.txt").write_bytes(b"x" * 10)
+            (self.root / "added.txt").write_bytes(b"x")
+            self.assertEqual(codebase_size.main(["--path", str(self.root), "--save-snapshot", new]), 0)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(codebase_size.main(["--diff", old, new, "--json"]), 0)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report["files"], {"added": 1, "removed": 0, "resized": 1, "unchanged": 1})
+        self.assertEqual(report["delta_bytes"]["total"], 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
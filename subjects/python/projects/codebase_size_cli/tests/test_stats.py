@@ -0,0 +1,93 @@
+"""Regression tests for --stats (ScanStats).
+
+Run from the project folder:
+    python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import codebase_size  # noqa: E402
+from codebase_size import (  # noqa: E402
+    ScanAggregator,
+    ScanCache,
+    ScanStats,
+    collect_file_info,
+    iter_file_entries,
+)
+
+DIRS = 4  # root, a, a/b, c
+FILES = 5
+
+
+class ScanStatsTests(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.root = self.tmp / "tree"
+        for rel in ["a/b/one.py", "a/two.py", "c/three.txt", "four", "five.md"]:
+            path = self.root / rel
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b"x" * 3)
+
+    def walk(self, workers: int = 1, **options: bool) -> ScanStats:
+        stats = ScanStats()
+        entries = iter_file_entries(
+            self.root, set(), False, workers=workers, stats=stats,
+            follow_symlinks=options.get("follow_symlinks", False),
+            one_file_system=options.get("one_file_system", False),
+        )
+        list(collect_file_info(entries, stats=stats))
+        return stats
+
+    def test_stat_calls_include_per_directory_stats(self) -> None:
+        self.assertEqual(self.walk().stat_calls, FILES)
+        # One identity stat per directory for the symlink guard
+        self.assertEqual(self.walk(follow_symlinks=True).stat_calls, FILES + DIRS)
+        self.assertEqual(self.walk(workers=3, follow_symlinks=True).stat_calls, FILES + DIRS)
+        # The root's device, plus one stat per subdirectory found
+        self.assertEqual(self.walk(one_file_system=True).stat_calls, FILES + 1 + DIRS - 1)
+
+    def test_stat_calls_with_cache(self) -> None:
+        settings = {"root": str(self.root)}
+        db = self.tmp / "cache.db"
+        old = 1_000_000_000  # outside the cache's "racy" window
+        for directory in (self.root, self.root / "a", self.root / "a" / "b", self.root / "c"):
+            os.utime(directory, (old, old))
+        # Each directory's mtime check, plus each file when it is listed (first
+        # run) or stat'ed again (--cache-verify)
+        for verify, expected in ((False, FILES + DIRS), (False, DIRS), (True, FILES + DIRS)):
+            stats = ScanStats()
+            with ScanCache(db, settings, verify=verify) as cache:
+                cache.scan(self.root, set(), False, False, ScanAggregator(), stats=stats)
+            self.assertEqual(stats.stat_calls, expected)
+
+    def test_path_construction_is_timed(self) -> None:
+        stats = self.walk()
+        self.assertIn("path_construction_s", stats.as_dict())
+        self.assertGreater(stats.path_seconds, 0.0)
+
+    def test_json_report_has_stats_and_encode_phase(self) -> None:
+        out, err = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            code = codebase_size.main(["--path", str(self.root), "--json", "--stats"])
+        self.assertEqual(code, 0)
+        report = json.loads(out.getvalue())
+        self.assertEqual(list(report)[-1], "stats")
+        self.assertEqual(report["stats"]["files_found"], FILES)
+        self.assertIn("scan", report["stats"]["phases"])
+        self.assertIn("encoding the JSON report took", err.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+"""Regression tests for --tree (DirectoryRollup).
+
+Run from the project folder:
+    python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import codebase_size  # noqa: E402
+from codebase_size import DirectoryRollup, FileInfo  # noqa: E402
+
+
+class DirectoryRollupTests(unittest.TestCase):
+    def deep_rollup(self, levels: int) -> DirectoryRollup:
+        rollup = DirectoryRollup(Path(os.sep + "root"))
+        path = os.path.join(os.sep + "root", *(["d"] * levels), "f.txt")
+        rollup.add(FileInfo(path=path, size_bytes=5, extension=".txt"))
+        return rollup.finish()
+
+    def test_very_deep_tree_has_no_recursion_error(self) -> None:
+        tree = self.deep_rollup(sys.getrecursionlimit() + 100).as_dict(top_k=3)
+        # The whole encoding must succeed too, indented like the CLI does it
+        json.dumps(tree, indent=2)
+        node, levels = tree, 0
+        while node["children"]:
+            node = node["children"][0]
+            levels += 1
+        self.assertEqual(levels, codebase_size.TREE_JSON_MAX_LEVELS)
+        self.assertTrue(node["depth_limited"])
+        self.assertEqual(node["children_omitted"], 1)
+        self.assertEqual(node["size_bytes"], 5)
+
+    def test_shallow_tree_is_unchanged(self) -> None:
+        rollup = DirectoryRollup(Path(os.sep + "root"))
+        for rel, size in [("a/x", 1), ("a/b/y", 2), ("c/z", 4), ("w", 8)]:
+            path = os.path.join(os.sep + "root", *rel.split("/"))
+            rollup.add(FileInfo(path=path, size_bytes=size, extension=""))
+        tree = rollup.finish().as_dict(top_k=1)
+        self.assertEqual(tree["size_bytes"], 15)
+        self.assertEqual([child["path"] for child in tree["children"]], ["c"])
+        self.assertEqual(tree["children_omitted"], 1)
+        self.assertNotIn("depth_limited", tree)
+
+    def test_cli_json_on_deep_directory(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        # Create the chain with relative steps (a long absolute path per
+        # mkdir would run into PATH_MAX)
+        fd = os.open(tmp.name, os.O_RDONLY)
+        try:
+            for _ in range(300):
+                os.mkdir("d", dir_fd=fd)
+                child = os.open("d", os.O_RDONLY, dir_fd=fd)
+                os.close(fd)
+                fd = child
+            os.close(os.open("f.txt", os.O_WRONLY | os.O_CREAT, dir_fd=fd))
+        finally:
+            os.close(fd)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(codebase_size.main(["--path", tmp.name, "--tree", "--json"]), 0)
+        self.assertEqual(json.loads(out.getvalue())["tree"]["file_count"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+"""Regression tests for the directory walkers.
+
+Run from the project folder:
+    python -m unittest discover -s tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import codebase_size  # noqa: E402
+from codebase_size import (  # noqa: E402
+    ScanStats,
+    VisitedDirectories,
+    fd_backend_available,
+    iter_directory_stats_fd,
+    iter_file_entries,
+)
+
+
+def make_tree(root: Path, fanout: int = 6, depth: int = 3) -> int:
+    """Build a tree with one file per directory; returns the directory count."""
+
+    count = 1
+    (root / "f.txt").write_bytes(b"x")
+    if depth:
+        for index in range(fanout):
+            sub = root / f"d{index}"
+            sub.mkdir()
+            count += make_tree(sub, fanout, depth - 1)
+    return count
+
+
+class CountingScans:
+    """Wraps _scan_directory to count how many directories get listed."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._real = codebase_size._scan_directory
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            self.calls += 1
+        return self._real(*args, **kwargs)
+
+
+class SymlinkedTreeTests(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        (self.root / "real").mkdir()
+        real_dirs = make_tree(self.root / "real")
+        (self.root / "links").mkdir()
+        self.symlinks = 5
+        for index in range(self.symlinks):
+            os.symlink(self.root / "real", self.root / "links" / f"l{index}")
+        # root + links + the real subtree
+        self.unique_dirs = real_dirs + 2
+
+    def walk(self, workers: int):
+        counter = CountingScans()
+        visited = VisitedDirectories()
+        with mock.patch.object(codebase_size, "_scan_directory", counter):
+            paths = [
+                entry.path
+                for entry in iter_file_entries(
+                    self.root, set(), False, True, workers=workers, visited=visited
+                )
+            ]
+        return paths, counter.calls, visited
+
+    def test_parallel_matches_serial(self) -> None:
+        serial, _, serial_visited = self.walk(workers=1)
+        parallel, _, parallel_visited = self.walk(workers=4)
+        self.assertEqual(parallel, serial)
+        self.assertEqual(parallel_visited.duplicates_skipped, serial_visited.duplicates_skipped)
+
+    def test_parallel_work_is_bounded_by_unique_directories(self) -> None:
+        _, serial_calls, _ = self.walk(workers=1)
+        self.assertEqual(serial_calls, self.unique_dirs)
+        for _ in range(3):
+            _, calls, _ = self.walk(workers=4)
+            # At most one wasted listing per duplicate path, never a subtree
+            self.assertLessEqual(calls, self.unique_dirs + self.symlinks)
+
+
+@unittest.skipUnless(fd_backend_available(), "needs descriptor-relative os calls")
+class FdWalkerTests(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name) / "root"
+        for name in ("keep", "victim"):
+            (self.root / name).mkdir(parents=True)
+            (self.root / name / "f.txt").write_bytes(b"12345")
+        (self.root / "top.txt").write_bytes(b"1")
+
+    def walk_with_swap(self, replace) -> tuple:
+        """Walk; swap "victim" for something else right before it is opened."""
+
+        real_open = codebase_size._open_directory
+
+        def open_directory(name, dir_fd, follow_symlinks):
+            if name == "victim":
+                shutil.rmtree(self.root / "victim")
+                replace(self.root / "victim")
+            return real_open(name, dir_fd, follow_symlinks)
+
+        stats = ScanStats()
+        with mock.patch.object(codebase_size, "_open_directory", open_directory):
+            names = sorted(
+                name
+                for _directory, records in iter_directory_stats_fd(
+                    self.root, set(), False, False, stats=stats
+                )
+                for name, _st in records
+            )
+        return names, stats
+
+    def test_directory_replaced_by_symlink(self) -> None:
+        (self.root.parent / "elsewhere").mkdir()
+        names, stats = self.walk_with_swap(
+            lambda path: os.symlink(self.root.parent / "elsewhere", path)
+        )
+        self.assertEqual(names, ["f.txt", "top.txt"])  # keep/f.txt and top.txt
+        self.assertEqual(sum(stats.errors.values()), 1)
+
+    def test_directory_replaced_by_file(self) -> None:
+        names, stats = self.walk_with_swap(lambda path: path.write_bytes(b"now a file"))
+        self.assertEqual(names, ["f.txt", "top.txt"])
+        self.assertEqual(dict(stats.errors), {"scandir:NotADirectoryError": 1})
+
+    def test_unopenable_root_is_recorded(self) -> None:
+        stats = ScanStats()
+        target = self.root / "top.txt"  # not a directory
+        self.assertEqual(list(iter_directory_stats_fd(target, set(), False, False, stats=stats)), [])
+        self.assertEqual(dict(stats.errors), {"scandir:NotADirectoryError": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+"""Regression tests for --watch (WatchIndex and the watchers).
+
+Run from the project folder:
+    python -m unittest discover -s tests
+"""
+
+import contextlib
+import errno
+import io
+import json
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import codebase_size  # noqa: E402
+from codebase_size import InotifyWatcher, watch_command  # noqa: E402
+
+
+def inotify_available() -> bool:
+    try:
+        InotifyWatcher().close()
+    except (OSError, AttributeError):
+        return False
+    return True
+
+
+class SnapshotSink:
+    """File-like `out` for watch_command: records snapshots, stops it after `limit`."""
+
+    def __init__(self, limit: int) -> None:
+        self.snapshots = []
+        self.limit = limit
+        self.changed = threading.Condition()
+
+    def write(self, text: str) -> None:
+        with self.changed:
+            self.snapshots.append(json.loads(text))
+            self.changed.notify_all()
+        if len(self.snapshots) >= self.limit:
+            raise KeyboardInterrupt  # watch_command treats this as Ctrl+C
+
+    def flush(self) -> None:
+        pass
+
+    def wait_for(self, count: int, timeout: float = 10.0) -> bool:
+        with self.changed:
+            return self.changed.wait_for(lambda: len(self.snapshots) >= count, timeout)
+
+
+@unittest.skipUnless(inotify_available(), "needs Linux inotify")
+class InotifyWatcherTests(unittest.TestCase):
+    def test_vanished_or_replaced_directory_is_ignored(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        (Path(tmp.name) / "file").write_text("x")
+        watcher = InotifyWatcher()
+        self.addCleanup(watcher.close)
+        watcher.add(str(Path(tmp.name) / "gone"))  # ENOENT
+        watcher.add(str(Path(tmp.name) / "file"))  # ENOTDIR
+
+    def test_watch_limit_at_runtime_falls_back_to_polling(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        root = Path(tmp.name) / "root"
+        root.mkdir()
+        (root / "a.txt").write_bytes(b"12345")
+        staged = Path(tmp.name) / "staged"
+        staged.mkdir()
+        (staged / "b.txt").write_bytes(b"1234567")
+
+        real_add = InotifyWatcher.add
+        initial_scan_done = threading.Event()
+
+        def add(watcher: InotifyWatcher, directory: str) -> None:
+            if initial_scan_done.is_set():
+                raise OSError(errno.ENOSPC, "No space left on device")
+            real_add(watcher, directory)
+
+        sink = SnapshotSink(limit=2)
+        result = {}
+
+        def run() -> None:
+            with mock.patch.object(InotifyWatcher, "add", add):
+                result["code"] = watch_command(
+                    root, set(), False, False, None, 0.05, 0, False, out=sink
+                )
+
+        with contextlib.redirect_stderr(io.StringIO()) as err:
+            thread = threading.Thread(target=run, daemon=True)
+            thread.start()
+            self.assertTrue(sink.wait_for(1))
+            initial_scan_done.set()
+            # A new directory needs a new watch, which now fails with ENOSPC
+            staged.rename(root / "new")
+            self.assertTrue(sink.wait_for(2))
+            thread.join(10)
+
+        self.assertEqual(result.get("code"), 0)
+        self.assertIn("falling back to polling", err.getvalue())
+        self.assertEqual(sink.snapshots[0]["total_size_bytes"], 5)
+        self.assertEqual(sink.snapshots[-1]["total_size_bytes"], 12)
+
+
+if __name__ == "__main__":
+    unittest.main()